@@ -0,0 +1,250 @@
+"""local stand-in for Geonadir api, S3 storage and a STAC file server, for benchmarking
+"""
+import email.parser
+import json
+import random
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from geonadir_upload_cli.util import geonadir_filename_trans
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def form_fields(content_type, body):
+    """parse multipart or urlencoded form body.
+
+    Returns:
+        dict: field name -> value, for non-file fields.
+    """
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        return {k: v[0] for k, v in urllib.parse.parse_qs(body.decode()).items()}
+    message = email.parser.BytesParser().parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+    fields = {}
+    for part in message.get_payload() if message.is_multipart() else []:
+        name = part.get_param("name", header="content-disposition")
+        if name and not part.get_filename():
+            fields[name] = part.get_payload(decode=True).decode()
+    return fields
+
+
+class MockGeonadir:
+    """threaded http server answering the requests made by geonadir-cli.
+
+    Api endpoints (dataset creation, presigned urls, image registration,
+    metadata and image listing) and storage uploads wait `latency` and
+    `storage_latency` seconds respectively, and fail with `error_status` at
+    `error_rate`. GET requests under /stac/ serve files from `static_dir`,
+    e.g. STAC catalogs, collections and their assets. Images are timed from their
+    presigned url request to their registration.
+    """
+
+    def __init__(self, static_dir, latency=0.0, storage_latency=0.0, error_rate=0.0, error_status=503):
+        """
+        Args:
+            static_dir (str): directory served under /stac/.
+            latency (float, optional): seconds added to each api request. Defaults to 0.0.
+            storage_latency (float, optional): seconds added to each storage upload. Defaults to 0.0.
+            error_rate (float, optional): share of api and storage requests failing. Defaults to 0.0.
+            error_status (int, optional): status of failing requests. Defaults to 503.
+        """
+        self.static_dir = static_dir
+        self.latency = latency
+        self.storage_latency = storage_latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._lock = threading.Lock()
+        self._datasets = {}
+        self._presigned_at = {}
+        self.latencies = []
+        self.stored_bytes = 0
+        self.errors = 0
+        self.first_request = None
+        self.last_register = None
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        """base url of the api, to be passed as --base-url
+        """
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def storage_url(self):
+        """url of the storage stand-in, to be set as GEONADIR_STORAGE_URL
+        """
+        return f"{self.url}/storage/"
+
+    def start(self):
+        """serve in a background thread
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """stop serving and close the socket
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_stats(self):
+        """forget timings and counters of earlier runs, keeping datasets
+        """
+        with self._lock:
+            self._presigned_at = {}
+            self.latencies = []
+            self.stored_bytes = 0
+            self.errors = 0
+            self.first_request = None
+            self.last_register = None
+
+    def registered(self):
+        """number of images registered in all datasets
+        """
+        with self._lock:
+            return sum(len(images) for images in self._datasets.values())
+
+    def _fail(self):
+        if self.error_rate and random.random() < self.error_rate:
+            with self._lock:
+                self.errors += 1
+            return True
+        return False
+
+    def _create_dataset(self):
+        with self._lock:
+            dataset_id = len(self._datasets) + 1
+            self._datasets[dataset_id] = []
+        return 201, {"id": dataset_id}
+
+    def _presign(self, payload):
+        now = time.monotonic()
+        fields = []
+        with self._lock:
+            if self.first_request is None:
+                self.first_request = now
+            for image in payload["images"]:
+                key = f"privateuploads/images/{payload['dataset_id']}-{uuid.uuid4()}/{geonadir_filename_trans(image)}"
+                self._presigned_at.setdefault(key.removeprefix("privateuploads/"), now)
+                fields.append({"key": key, "policy": "policy", "signature": "signature"})
+        return 200, {"fields": fields, "url": self.storage_url, "AWSAccessKeyId": "benchmark"}
+
+    def _register(self, fields):
+        now = time.monotonic()
+        dataset_id = int(fields["dataset_id"])
+        image = fields["image"]
+        with self._lock:
+            self._datasets.setdefault(dataset_id, []).append(f"{self.storage_url}privateuploads/{image}")
+            started = self._presigned_at.pop(image, None)
+            if started is not None:
+                self.latencies.append(now - started)
+            self.last_register = now
+        return 201, {"dataset_id": dataset_id, "image": image}
+
+    def _metadata(self, query):
+        dataset_id = int(query["project_id"][0])
+        with self._lock:
+            if dataset_id not in self._datasets:
+                return 200, "Metadata not found"
+            count = len(self._datasets[dataset_id])
+        return 200, {"project_id": {"project_name": f"benchmark_{dataset_id}", "image_count": count}}
+
+    def _images(self, path, query):
+        dataset_id = int(query["project_id"][0])
+        page = int(query.get("page", ["1"])[0])
+        page_size = int(query.get("page_size", ["100"])[0])
+        with self._lock:
+            images = list(self._datasets.get(dataset_id, []))
+        results = images[(page - 1) * page_size:page * page_size]
+        if page > 1 and not results:
+            return 404, {"detail": "Invalid page."}
+        next_page = None
+        if page * page_size < len(images):
+            next_page = f"{self.url}{path}?" + urllib.parse.urlencode(
+                {"project_id": dataset_id, "page": page + 1, "page_size": page_size})
+        return 200, {
+            "count": len(images),
+            "next": next_page,
+            "results": [{"upload_files": f"{url}?Expires=0"} for url in results],
+        }
+
+    def _handler(self):
+        mock = self
+
+        class Handler(SimpleHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, directory=mock.static_dir, **kwargs)
+
+            def log_message(self, format, *args):
+                pass
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length", 0))
+                return self.rfile.read(length)
+
+            def _drain(self):
+                length = int(self.headers.get("Content-Length", 0))
+                while length > 0:
+                    chunk = self.rfile.read(min(length, READ_CHUNK_SIZE))
+                    if not chunk:
+                        break
+                    length -= len(chunk)
+                return int(self.headers.get("Content-Length", 0))
+
+            def _send(self, status, payload=None):
+                body = b"" if payload is None else json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                parsed = urllib.parse.urlparse(self.path)
+                query = urllib.parse.parse_qs(parsed.query)
+                if parsed.path.startswith("/stac/"):
+                    self.path = parsed.path[len("/stac"):]
+                    return super().do_GET()
+                time.sleep(mock.latency)
+                if parsed.path == "/api/metadata/":
+                    return self._send(*mock._metadata(query))
+                if parsed.path == "/api/uploadfiles/":
+                    return self._send(*mock._images(parsed.path, query))
+                self._send(404, {"detail": "Not found."})
+
+            def do_POST(self):
+                path = urllib.parse.urlparse(self.path).path
+                if path == "/storage/":
+                    size = self._drain()
+                    time.sleep(mock.storage_latency)
+                    if mock._fail():
+                        return self._send(mock.error_status)
+                    with mock._lock:
+                        mock.stored_bytes += size
+                    return self._send(204)
+                body = self._body()
+                time.sleep(mock.latency)
+                if path == "/api/dataset/":
+                    return self._send(*mock._create_dataset())
+                if path == "/api/utility/dataset-actions/":
+                    return self._send(200, {})
+                if mock._fail():
+                    return self._send(mock.error_status, {"detail": "Service unavailable."})
+                if path == "/api/generate_presigned_url/":
+                    return self._send(*mock._presign(json.loads(body)))
+                if path == "/api/create_post_image/":
+                    return self._send(*mock._register(
+                        form_fields(self.headers.get("Content-Type", ""), body)))
+                self._send(404, {"detail": "Not found."})
+
+        return Handler
@@ -0,0 +1,227 @@
+"""end-to-end upload throughput benchmark against a local Geonadir/S3 stand-in
+
+Generates a synthetic image directory and STAC catalog, runs local-upload,
+collection-upload and catalog-upload against mock_geonadir.MockGeonadir and
+reports images/s, MB/s and p50/p99 image latency of each run.
+
+usage: python benchmarks/run_benchmarks.py [options] [-- extra cli options]
+e.g.   python benchmarks/run_benchmarks.py --images 500 --latency 0.05 -- -w 4 --engine async
+"""
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.insert(0, SRC_DIR)
+
+from geonadir_upload_cli.adaptive import percentile  # noqa: E402
+from mock_geonadir import MockGeonadir  # noqa: E402
+
+SCENARIOS = ("local", "collection", "catalog")
+MB = 1000 * 1000
+
+
+def write_images(directory, count, size_kb):
+    """write count synthetic jpg files of size_kb KB each
+
+    Returns:
+        list: file names.
+    """
+    os.makedirs(directory, exist_ok=True)
+    content = os.urandom(size_kb * 1024)
+    names = [f"img_{i:05d}.jpg" for i in range(count)]
+    for name in names:
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(content)
+    return names
+
+
+def write_collection(directory, collection_id, image_names):
+    """write collection.json with images in the same directory as assets
+    """
+    now = datetime.datetime.now().isoformat()
+    collection = {
+        "type": "Collection",
+        "stac_version": "1.0.0",
+        "id": collection_id,
+        "title": collection_id,
+        "description": f"benchmark collection {collection_id}",
+        "license": "CC-BY-4.0",
+        "extent": {
+            "spatial": {"bbox": [[152.9, -27.6, 153.1, -27.4]]},
+            "temporal": {"interval": [[now, None]]},
+        },
+        "summaries": {"created": now, "updated": now},
+        "links": [],
+        "assets": {name: {"href": name, "type": "image/jpeg"} for name in image_names},
+    }
+    with open(os.path.join(directory, "collection.json"), "w") as f:
+        json.dump(collection, f)
+
+
+def write_catalog(directory, child_hrefs):
+    """write catalog.json linking to child collections or catalogs
+    """
+    catalog = {
+        "type": "Catalog",
+        "stac_version": "1.0.0",
+        "id": os.path.basename(directory),
+        "description": "benchmark catalog",
+        "links": [{"rel": "child", "href": href} for href in child_hrefs],
+    }
+    with open(os.path.join(directory, "catalog.json"), "w") as f:
+        json.dump(catalog, f)
+
+
+def generate_data(root, images, size_kb, collections):
+    """generate local images and a STAC catalog of collections, half of them
+    behind a sub-catalog.
+
+    Returns:
+        (str, str, str): local image directory, collection path and catalog path under root.
+    """
+    image_dir = os.path.join(root, "local")
+    write_images(image_dir, images, size_kb)
+    hrefs = []
+    for i in range(collections):
+        parent = "sub" if i % 2 else ""
+        directory = os.path.join(root, "stac", parent, f"collection_{i}")
+        write_collection(directory, f"benchmark_collection_{i}",
+                         write_images(directory, images, size_kb))
+        hrefs.append((parent, f"collection_{i}/collection.json"))
+    write_catalog(os.path.join(root, "stac", "sub"),
+                  [href for parent, href in hrefs if parent])
+    write_catalog(os.path.join(root, "stac"),
+                  [href for parent, href in hrefs if not parent] + ["sub/catalog.json"])
+    return image_dir, "collection_0/collection.json", "catalog.json"
+
+
+def run_scenario(mock, scenario, item, expected, workdir, extra_args):
+    """run one cli command against the mock and collect its stats
+
+    Returns:
+        dict: stats of the run.
+    """
+    mock.reset_stats()
+    registered = mock.registered()
+    command = {
+        "local": ["local-upload", "-i", "benchmark_local", item],
+        "collection": ["collection-upload", "-i", "benchmark_collection", item],
+        "catalog": ["catalog-upload", "-i", item],
+    }[scenario]
+    if scenario != "local":
+        command += ["-cd", os.path.join(workdir, "cache")]
+    env = dict(
+        os.environ,
+        GEONADIR_STORAGE_URL=mock.storage_url,
+        PYTHONPATH=os.pathsep.join([SRC_DIR] + [p for p in [os.environ.get("PYTHONPATH")] if p]),
+    )
+    start = time.monotonic()
+    proc = subprocess.run(
+        [sys.executable, "-m", "geonadir_upload_cli"] + command
+        + ["-u", mock.url, "-t", "benchmark"] + extra_args,
+        env=env, cwd=workdir, capture_output=True, text=True)
+    wall = time.monotonic() - start
+    uploaded = mock.registered() - registered
+    window = None
+    if mock.first_request is not None and mock.last_register is not None:
+        window = max(mock.last_register - mock.first_request, 1e-6)
+    return {
+        "scenario": scenario,
+        "exit_code": proc.returncode,
+        "expected": expected,
+        "uploaded": uploaded,
+        "injected_errors": mock.errors,
+        "wall_sec": round(wall, 3),
+        "images_per_sec": round(uploaded / window, 2) if window else 0.0,
+        "mb_per_sec": round(mock.stored_bytes / MB / window, 2) if window else 0.0,
+        "p50_sec": percentile(mock.latencies, 50) if mock.latencies else None,
+        "p99_sec": percentile(mock.latencies, 99) if mock.latencies else None,
+        "stderr_tail": proc.stderr.strip().splitlines()[-5:] if proc.returncode or uploaded < expected else [],
+    }
+
+
+def print_report(results):
+    """print stats as a table
+    """
+    def fmt(value):
+        return "-" if value is None else f"{value:.3f}" if isinstance(value, float) else str(value)
+
+    columns = ["scenario", "uploaded", "expected", "injected_errors", "wall_sec",
+               "images_per_sec", "mb_per_sec", "p50_sec", "p99_sec"]
+    rows = [[fmt(result[column]) for column in columns] for result in results]
+    widths = [max(len(column), *(len(row[i]) for row in rows)) for i, column in enumerate(columns)]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)))
+    for result in results:
+        for line in result["stderr_tail"]:
+            print(f"[{result['scenario']}] {line}")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    extra_args = []
+    if "--" in argv:
+        extra_args = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    parser = argparse.ArgumentParser(
+        description="Benchmark geonadir-cli uploads against a local Geonadir/S3 stand-in. "
+        "Options after -- are passed to every cli command.")
+    parser.add_argument("--images", type=int, default=200, help="images per dataset (default 200)")
+    parser.add_argument("--image-size", type=int, default=256, help="image size in KB (default 256)")
+    parser.add_argument("--collections", type=int, default=4,
+                        help="collections in the catalog (default 4)")
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="seconds added to each api request (default 0.02)")
+    parser.add_argument("--storage-latency", type=float, default=0.05,
+                        help="seconds added to each storage upload (default 0.05)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="share of api and storage requests failing (default 0)")
+    parser.add_argument("--error-status", type=int, default=503,
+                        help="status of failing requests (default 503)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"comma separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument("--json", help="also write results to this json file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        image_dir, collection, catalog = generate_data(
+            workdir, args.images, args.image_size, args.collections)
+        mock = MockGeonadir(
+            os.path.join(workdir, "stac"),
+            latency=args.latency,
+            storage_latency=args.storage_latency,
+            error_rate=args.error_rate,
+            error_status=args.error_status,
+        ).start()
+        try:
+            items = {
+                "local": (image_dir, args.images),
+                "collection": (f"{mock.url}/stac/{collection}", args.images),
+                "catalog": (f"{mock.url}/stac/{catalog}", args.images * args.collections),
+            }
+            results = []
+            for scenario in args.scenarios.split(","):
+                item, expected = items[scenario]
+                results.append(run_scenario(mock, scenario, item, expected, workdir, extra_args))
+        finally:
+            mock.stop()
+
+    print(f"{args.images} images of {args.image_size} KB, api latency {args.latency}s, "
+          f"storage latency {args.storage_latency}s, error rate {args.error_rate}, "
+          f"cli options: {' '.join(extra_args) or '-'}")
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"settings": vars(args), "cli_options": extra_args, "results": results}, f, indent=4)
+    return 0 if all(r["exit_code"] == 0 and r["uploaded"] == r["expected"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""AIMD controller of the number of images uploaded at the same time
+"""
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+env = os.environ.get("GEONADIR_CLI_ENV", "prod")
+LOG_LEVEL = logging.INFO
+if env != "prod":
+    LOG_LEVEL = logging.DEBUG
+logging.basicConfig(level=LOG_LEVEL)
+
+MAX_ADAPTIVE_WORKERS = 64
+THROTTLE_STATUSES = (429, 503)
+# min number of finished images between two adjustments
+MIN_WINDOW = 10
+# limit is multiplied by this factor when backing off
+DECREASE_FACTOR = 0.5
+# p95 latency above best p95 seen so far times this factor counts as rising
+LATENCY_TOLERANCE = 1.5
+# throughput above previous window throughput times this factor counts as improving
+THROUGHPUT_TOLERANCE = 0.95
+
+
+def percentile(values, q):
+    """nearest-rank percentile
+
+    Args:
+        values (list): numbers, not empty.
+        q (float): percentile between 0 and 100.
+
+    Returns:
+        float: q-th percentile of values.
+    """
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class AdaptiveConcurrency:
+    """additive-increase/multiplicative-decrease limit of images in flight.
+
+    Latency of every finished image is collected in windows of at least
+    MIN_WINDOW images (or the current limit if larger). At the end of a window
+    the limit grows by one if throughput kept improving and p95 latency stayed
+    within LATENCY_TOLERANCE of the best p95 seen, and is halved if p95 rose.
+    Throttling responses (429/503) and timeouts, reported through on_retry,
+    halve the limit at once, at most once per window. After a decrease, images
+    which were already in flight are left out of the next window, as they were
+    started under the old limit. Every change is logged and kept in history.
+    """
+
+    def __init__(self, initial, maximum, minimum=1):
+        """
+        Args:
+            initial (int): limit to start with.
+            maximum (int): max limit.
+            minimum (int, optional): min limit. Defaults to 1.
+        """
+        self.minimum = minimum
+        self.maximum = max(maximum, minimum)
+        self.limit = min(max(initial, minimum), self.maximum)
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._latencies = []
+        self._backed_off = False
+        self._skip = 0
+        self._best_p95 = None
+        self._last_throughput = None
+        self._start = time.monotonic()
+        self._window_start = self._start
+        self.history = [(0.0, self.limit)]
+        logger.info(
+            f"adaptive concurrency between {self.minimum} and {self.maximum}, starting at {self.limit}")
+
+    def acquire(self):
+        """wait until another image can be uploaded within the current limit
+        """
+        with self._cond:
+            while self._in_flight >= self.limit:
+                self._cond.wait()
+            self._in_flight += 1
+
+    def release(self, latency=None):
+        """mark image finished.
+
+        Args:
+            latency (float, optional): seconds taken by the image, None if it failed or was skipped. Defaults to None.
+        """
+        with self._cond:
+            self._in_flight -= 1
+            if self._skip:
+                self._skip -= 1
+            elif latency is not None:
+                self._latencies.append(latency)
+                if len(self._latencies) >= max(MIN_WINDOW, self.limit):
+                    self._end_window()
+            self._cond.notify_all()
+
+    def on_retry(self, status, error):
+        """back off on throttling responses and timeouts. Meant to be registered with
+        session.set_retry_observer.
+
+        Args:
+            status (int | None): response status of failed attempt.
+            error (Exception | None): exception of failed attempt, from urllib3 if retried or from requests if final.
+        """
+        from requests.exceptions import Timeout
+        from urllib3.exceptions import TimeoutError as RequestTimeoutError
+
+        if status in THROTTLE_STATUSES:
+            reason = f"status {status}"
+        elif isinstance(error, (RequestTimeoutError, Timeout)):
+            reason = "timeout"
+        else:
+            return
+        with self._cond:
+            if not self._backed_off:
+                self._backed_off = True
+                self._set_limit(self._decreased(), reason)
+
+    def _decreased(self):
+        return max(int(self.limit * DECREASE_FACTOR), self.minimum)
+
+    def _end_window(self):
+        now = time.monotonic()
+        throughput = len(self._latencies) / max(now - self._window_start, 1e-6)
+        p95 = percentile(self._latencies, 95)
+        stats = f"{throughput:.2f} images/s, p95 {p95:.2f}s"
+        best_p95, last_throughput = self._best_p95, self._last_throughput
+        if best_p95 is None or p95 < best_p95:
+            self._best_p95 = p95
+        self._last_throughput = throughput
+        self._latencies = []
+        self._window_start = now
+        if self._backed_off:
+            self._backed_off = False
+            logger.debug(f"concurrency {self.limit} after back off ({stats})")
+        elif best_p95 is not None and p95 > best_p95 * LATENCY_TOLERANCE:
+            self._set_limit(self._decreased(), f"p95 rising, {stats}")
+        elif last_throughput is None or throughput >= last_throughput * THROUGHPUT_TOLERANCE:
+            self._set_limit(min(self.limit + 1, self.maximum), stats)
+        else:
+            logger.debug(f"concurrency {self.limit} kept ({stats})")
+
+    def _set_limit(self, limit, reason):
+        if limit == self.limit:
+            return
+        logger.info(f"concurrency {self.limit} -> {limit} ({reason})")
+        if limit < self.limit:
+            # start a new window with images started under the new limit
+            self._skip = self._in_flight
+            self._latencies = []
+            self._window_start = time.monotonic()
+        self.limit = limit
+        self.history.append((time.monotonic() - self._start, limit))
+        self._cond.notify_all()
+
+    def log_history(self):
+        """log limit over time
+        """
+        logger.info(
+            "concurrency over time: "
+            + ", ".join(f"{limit} at {elapsed:.0f}s" for elapsed, limit in self.history))
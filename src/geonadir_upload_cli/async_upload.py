@@ -0,0 +1,314 @@
+"""asyncio based upload engine
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+
+try:
+    import aiohttp
+except ImportError:  # optional dependency, see check_async_engine
+    aiohttp = None
+
+from .dataset import STORAGE_URL
+from . import metrics
+from .journal import PRESIGNED, REGISTERED, STORED, reusable_presigned_info
+from .multipart import MultipartStream
+from .throttle import THROTTLE_CHUNK_SIZE, get_limiter
+from .timing import PhaseTimer, count_retry, phase
+
+logger = logging.getLogger(__name__)
+env = os.environ.get("GEONADIR_CLI_ENV", "prod")
+LOG_LEVEL = logging.INFO
+if env != "prod":
+    LOG_LEVEL = logging.DEBUG
+logging.basicConfig(level=LOG_LEVEL)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def check_async_engine():
+    """make sure the async engine can be used
+
+    Raises:
+        Exception: aiohttp not installed.
+    """
+    if aiohttp is None:
+        raise Exception(
+            "Async engine requires aiohttp. Install it with `pip install geonadir-upload-cli[async]`.")
+
+
+def run_async_uploads(items, param, max_retry, retry_interval, timeout, concurrency, pbar, batcher=None):
+    """upload images on a single event loop, with up to `concurrency` images in flight.
+    Each image goes through the same steps as dataset.upload_single_image, with remote
+    assets downloaded to local file first and deleted after uploading. The first
+    exception cancels all other images and is re-raised.
+
+    Args:
+        items (list): (image_name, local_path, url) of each image. image_name is the path relative to
+            image directory or asset name, and identifies the image in journal. url is None for local images.
+        param (dict): base_url, token, dataset_id and optionally dataset_name and journal (journal.UploadJournal).
+        max_retry (int): max retry for each http request.
+        retry_interval (float): interval between retries.
+        timeout (float): timeout for each http request.
+        concurrency (int): max number of images in flight.
+        pbar (tqdm.tqdm): progress bar updated once per finished image.
+        batcher (presign.PresignedUrlBatcher, optional): source of batched presigned info, keyed by
+            image_name. Defaults to None.
+
+    Returns:
+        list: (image_name, response_code, upload_time, file_size, timer) of each image in the same order as items.
+    """
+    check_async_engine()
+    return asyncio.run(_upload_all(
+        items, param, max_retry, retry_interval, timeout, concurrency, pbar, batcher))
+
+
+async def _upload_all(items, param, max_retry, retry_interval, timeout, concurrency, pbar, batcher):
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency * 2)
+    logger.debug(f"uploading with async engine, {concurrency} images in flight")
+
+    async with aiohttp.ClientSession(connector=connector, trust_env=True) as session:
+        async def upload(item):
+            async with semaphore:
+                with metrics.in_flight("images_in_flight"):
+                    result = await _upload_one(
+                        session, item, param, max_retry, retry_interval, timeout, batcher)
+            metrics.image_done(param["dataset_id"], param.get("dataset_name"), result[3])
+            pbar.update(1)
+            return result
+
+        tasks = [asyncio.ensure_future(upload(item)) for item in items]
+        if not tasks:
+            return []
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        for task in tasks:
+            if task in done and task.exception():
+                raise task.exception()
+        return [task.result() for task in tasks]
+
+
+async def _upload_one(session, item, param, max_retry, retry_interval, timeout, batcher):
+    # each image runs in its own task, so the timer is current for this image only
+    with PhaseTimer().activate() as timer:
+        result = await _upload_timed(
+            session, item, param, max_retry, retry_interval, timeout, batcher)
+    return (*result, timer)
+
+
+async def _upload_timed(session, item, param, max_retry, retry_interval, timeout, batcher):
+    image_name, file_path, url = item
+    if url:
+        try:
+            with phase("download"):
+                await _download(session, url, file_path, max_retry, retry_interval, timeout)
+        except Exception as exc:
+            logger.error(f"Error when downloading {url}")
+            raise exc
+    file_size = os.path.getsize(file_path)
+
+    journal = param.get("journal")
+    journal_name = image_name
+    dataset_id = param["dataset_id"]
+
+    start_time = time.time()
+    try:
+        presigned_info = None
+        if journal:
+            presigned_info = reusable_presigned_info(
+                journal.get(dataset_id, journal_name))
+        reused = presigned_info is not None
+        if not presigned_info:
+            with phase("presign"):
+                if batcher:
+                    presigned_info = await asyncio.to_thread(batcher.get, image_name)
+                if not presigned_info:
+                    presigned_info = await _generate_presigned_url(
+                        session, param, file_path, max_retry, retry_interval, timeout)
+        if journal and not reused:
+            journal.record(dataset_id, journal_name, PRESIGNED, presigned_info)
+        with phase("storage"):
+            await _upload_to_amazon(
+                session, presigned_info, file_path, max_retry, retry_interval, timeout)
+        if journal:
+            journal.record(dataset_id, journal_name, STORED, size=file_size)
+        with phase("register"):
+            response_code = await _create_post_image(
+                session, param, presigned_info, max_retry, retry_interval, timeout)
+        if journal:
+            journal.record(dataset_id, journal_name, REGISTERED)
+    except Exception as exc:
+        logger.error(f"Error when uploading {image_name}")
+        raise exc
+
+    if url:
+        logger.debug(f"deleting {file_path} after uploading")
+        os.unlink(file_path)
+    upload_time = time.time() - start_time
+    return image_name, response_code, upload_time, file_size
+
+
+async def _request(session, method, url, max_retry, retry_interval, timeout, make_data=None, on_response=None, **kwargs):
+    """send request, retrying on connection errors and timeouts, and on error status for GET only,
+    like the retry strategy of the shared requests sessions.
+    Interval between retries is retry_interval * (2 ** ({number of total retries} - 1)).
+
+    Args:
+        make_data (callable, optional): builds a fresh request body for every attempt. Defaults to None.
+        on_response (coroutine function, optional): consumes the response body instead of reading it all. Defaults to None.
+
+    Returns:
+        (int, bytes): status code and response body (None if consumed by on_response).
+    """
+    retries = 0
+    while True:
+        try:
+            if make_data:
+                kwargs["data"] = make_data()
+            with metrics.in_flight("requests_in_flight"):
+                async with session.request(
+                    method,
+                    url,
+                    timeout=aiohttp.ClientTimeout(
+                        total=None, sock_connect=timeout, sock_read=timeout),
+                    **kwargs
+                ) as r:
+                    if r.status >= 400:
+                        text = await r.text()
+                        if method == "GET" and retries < max_retry:
+                            logger.debug(f"{method} {url} returned {r.status}, retrying")
+                            raise aiohttp.ServerConnectionError(f"{r.status}: {text}")
+                        raise Exception(f"{r.status} {r.reason} for url: {url}: {text}")
+                    if on_response:
+                        await on_response(r)
+                        return r.status, None
+                    return r.status, await r.read()
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as exc:
+            if retries >= max_retry:
+                raise Exception(f"{method} {url} failed: {str(exc)}") from exc
+        retries += 1
+        count_retry()
+        metrics.record_retry()
+        await asyncio.sleep(retry_interval * (2 ** (retries - 1)))
+
+
+async def _throttled(chunks, limiter):
+    # like throttle.throttled_chunks, waiting on the event loop instead of blocking it
+    for chunk in chunks:
+        await asyncio.sleep(limiter.reserve(len(chunk)))
+        yield chunk
+
+
+async def _download(session, url, file_path, max_retry, retry_interval, timeout):
+    limiter = get_limiter()
+
+    async def save(r):
+        with open(file_path, "wb") as fd:
+            async for chunk in r.content.iter_chunked(THROTTLE_CHUNK_SIZE if limiter else CHUNK_SIZE):
+                if limiter:
+                    await asyncio.sleep(limiter.reserve(len(chunk)))
+                fd.write(chunk)
+
+    logger.debug(f"downloading {url} to {file_path}")
+    await _request(session, "GET", url, max_retry, retry_interval, timeout, on_response=save)
+
+
+async def _generate_presigned_url(session, param, file_path, max_retry, retry_interval, timeout):
+    json_data = {
+        'dataset_id': str(param["dataset_id"]),
+        'images': [
+            os.path.basename(file_path),
+        ],
+    }
+    logger.debug(f"generate presigned url: {json_data}")
+    _, body = await _request(
+        session,
+        "POST",
+        f"{param['base_url']}/api/generate_presigned_url/",
+        max_retry,
+        retry_interval,
+        timeout,
+        headers={'Authorization': param["token"]},
+        json=json_data,
+    )
+    return json.loads(body)
+
+
+async def _upload_to_amazon(session, presigned_info, file_path, max_retry, retry_interval, timeout):
+    fields = [
+        ('key', presigned_info["fields"][0]["key"]),
+        ('AWSAccessKeyId', presigned_info["AWSAccessKeyId"]),
+        ('policy', presigned_info["fields"][0]["policy"]),
+        ('signature', presigned_info["fields"][0]["signature"]),
+    ]
+    opened = []
+    limiter = get_limiter()
+    headers = {}
+
+    def make_form():
+        # file is streamed by aiohttp in chunks; reopened for every attempt
+        file = open(file_path, "rb")
+        opened.append(file)
+        if limiter:
+            # the body is paced chunk by chunk, so it is built by hand with its length
+            # declared up front, as storage does not accept chunked transfer encoding
+            body = MultipartStream(
+                fields, file_path, file, os.path.getsize(file_path), THROTTLE_CHUNK_SIZE)
+            headers["Content-Type"] = body.content_type
+            headers["Content-Length"] = str(len(body))
+            return _throttled(body, limiter)
+        form = aiohttp.FormData()
+        for name, value in fields:
+            form.add_field(name, value)
+        form.add_field("file", file, filename=os.path.basename(file_path))
+        return form
+
+    logger.debug(f"upload to GN Amazon S3 storage: {fields[0][1]}")
+    try:
+        status, _ = await _request(
+            session,
+            "POST",
+            STORAGE_URL,
+            max_retry,
+            retry_interval,
+            timeout,
+            make_data=make_form,
+            headers=headers,
+        )
+    finally:
+        for file in opened:
+            file.close()
+    return status
+
+
+async def _create_post_image(session, param, presigned_info, max_retry, retry_interval, timeout):
+    key = presigned_info["fields"][0]["key"].removeprefix("privateuploads/")
+    form = [
+        ('dataset_id', str(param["dataset_id"])),
+        ('image', key),
+    ]
+
+    def make_form():
+        data = aiohttp.FormData()
+        for name, value in form:
+            data.add_field(name, value)
+        return data
+
+    logger.debug(f"create post image: {form}")
+    status, _ = await _request(
+        session,
+        "POST",
+        f"{param['base_url']}/api/create_post_image/",
+        max_retry,
+        retry_interval,
+        timeout,
+        headers={'Authorization': param["token"]},
+        make_data=make_form,
+    )
+    return status
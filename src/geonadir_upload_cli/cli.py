@@ -7,8 +7,11 @@ from importlib.metadata import version
 
 import click
 
-from .dataset import dataset_info, search_datasets, search_datasets_coord
-from .upload import normal_upload, upload_from_catalog, upload_from_collection
+from .adaptive import MAX_ADAPTIVE_WORKERS
+from .httpcache import DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE
+from .journal import JOURNAL_FILENAME
+from .throttle import parse_schedule
+from .verify import VERIFY_TIMEOUT
 
 logger = logging.getLogger(__name__)
 env = os.environ.get("GEONADIR_CLI_ENV", "prod")
@@ -17,6 +20,10 @@ if env != "prod":
     LOG_LEVEL = logging.DEBUG
 logging.basicConfig(level=LOG_LEVEL)
 
+# heavy dependencies (pandas, pystac, tqdm, requests) are imported by the commands
+# that need them, so that e.g. --version and dataset searches start quickly.
+# Modules imported here must stay free of them, see tests/tests.py.
+
 
 def print_version(ctx, _, value):
     """callback for printing cli tool version
@@ -30,6 +37,27 @@ def print_version(ctx, _, value):
     ctx.exit()
 
 
+def check_stream_engine(kwargs):
+    """reject --stream with the async engine, which always downloads assets before uploading
+
+    Raises:
+        click.UsageError: both given.
+    """
+    if kwargs.get("stream") and kwargs.get("engine") == "async":
+        raise click.UsageError(
+            "--stream is not supported by the async engine. Use --engine thread to stream assets.")
+
+
+def validate_schedule(ctx, param, value):
+    """callback for validating bandwidth schedule
+    """
+    try:
+        parse_schedule(value)
+    except Exception as exc:
+        raise click.BadParameter(str(exc))
+    return value
+
+
 @click.group()
 @click.option(
     '--version',
@@ -135,9 +163,117 @@ If flagged without specifing output folder, default is the current path of your
     help="Existing Geonadir dataset id to be uploaded to. Only works when dataset id is valid. \
 Leave default or set 0 to skip dataset existence check and upload to new dataset insetad."
 )
+@click.option(
+    "--workers", "-w",
+    default=1,
+    show_default=True,
+    type=click.IntRange(1, max_open=True),
+    required=False,
+    help="Number of concurrent image uploads. The thread engine uploads up to 5 x this number of images at once, shared by all datasets. The async engine uploads up to this number per dataset.",
+)
+@click.option(
+    "--presign-batch-size", "-pb",
+    default=1,
+    show_default=True,
+    type=click.IntRange(1, max_open=True),
+    required=False,
+    help="Number of images per presigned url request. Falls back to single image requests if a batch is rejected.",
+)
+@click.option(
+    "--engine", "-e",
+    default="thread",
+    show_default=True,
+    type=click.Choice(["thread", "async"]),
+    required=False,
+    help="Upload engine. 'async' uploads images of a dataset on a single event loop and requires aiohttp.",
+)
+@click.option(
+    "--journal", "-j",
+    is_flag=False,
+    flag_value=JOURNAL_FILENAME,
+    type=click.Path(dir_okay=False),
+    required=False,
+    help="Record upload progress in a local sqlite journal and resume from it on re-run. \
+If flagged without specifying path, the journal is created in the output folder, or in the current path of your terminal.",
+)
+@click.option(
+    "--verify-timeout", "-vt",
+    default=VERIFY_TIMEOUT,
+    show_default=True,
+    type=click.FloatRange(0, max_open=True),
+    required=False,
+    help="Max seconds to wait for uploaded images to show up in Geonadir dataset.",
+)
+@click.option(
+    "--adaptive", "-ad",
+    is_flag=True,
+    default=False,
+    show_default=True,
+    type=bool,
+    required=False,
+    help="Adjust the number of concurrent image uploads to throughput, latency and throttling, starting from 5 x --workers.",
+)
+@click.option(
+    "--max-workers", "-mw",
+    default=MAX_ADAPTIVE_WORKERS,
+    show_default=True,
+    type=click.IntRange(1, max_open=True),
+    required=False,
+    help="Max number of concurrent image uploads with --adaptive.",
+)
+@click.option(
+    "--bandwidth-limit", "-bl",
+    default=None,
+    type=click.FloatRange(0, min_open=True),
+    required=False,
+    help="Max MB/s shared by all uploads to storage and asset downloads. Unlimited if not specified.",
+)
+@click.option(
+    "--bandwidth-schedule", "-bs",
+    default=[],
+    type=str,
+    required=False,
+    multiple=True,
+    callback=validate_schedule,
+    help="Time-of-day bandwidth limit overriding --bandwidth-limit, e.g. 19:00-07:00=unlimited or 09:00-17:00=5. Can be specified multiple times.",
+)
+@click.option(
+    "--dedup", "-dd",
+    is_flag=True,
+    default=False,
+    show_default=True,
+    type=bool,
+    required=False,
+    help="Skip images by content hash instead of file name. Keeps a hash index in the upload journal, which is enabled if not specified.",
+)
+@click.option(
+    "--recursive", "-r",
+    is_flag=True,
+    default=False,
+    show_default=True,
+    type=bool,
+    required=False,
+    help="Upload images in subdirectories of the image directory too.",
+)
+@click.option(
+    "--metrics-port", "-mp",
+    default=None,
+    type=click.IntRange(0, 65535),
+    required=False,
+    help="Serve live metrics of the run on http://127.0.0.1:<port>/metrics (OpenMetrics) and /metrics.json. 0 for any free port. Disabled if not specified.",
+)
+@click.option(
+    "--metrics-file", "-mf",
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    required=False,
+    help="Rewrite live metrics of the run to this file every 15 sec, as JSON if it ends with .json or as Prometheus text otherwise (e.g. for node exporter textfile collector). Disabled if not specified.",
+)
 def local_upload(**kwargs):
     """upload local images
     """
+    from .upload import normal_upload
+
     normal_upload(**kwargs)
 
 
@@ -267,9 +403,141 @@ e.g. ... --item collection_title ./collection.json ...",
     help="Existing Geonadir dataset id to be uploaded to. Only works when dataset id is valid. \
 Leave default or set 0 to skip dataset existence check and upload to new dataset insetad."
 )
+@click.option(
+    "--workers", "-w",
+    default=1,
+    show_default=True,
+    type=click.IntRange(1, max_open=True),
+    required=False,
+    help="Number of concurrent image uploads. The thread engine uploads up to 5 x this number of images at once, shared by all datasets. The async engine and --download-workers upload up to this number per dataset.",
+)
+@click.option(
+    "--presign-batch-size", "-pb",
+    default=1,
+    show_default=True,
+    type=click.IntRange(1, max_open=True),
+    required=False,
+    help="Number of images per presigned url request. Falls back to single image requests if a batch is rejected.",
+)
+@click.option(
+    "--stream",
+    is_flag=True,
+    default=False,
+    show_default=True,
+    type=bool,
+    required=False,
+    help="Stream assets from source straight to Geonadir storage instead of downloading them first.",
+)
+@click.option(
+    "--download-workers", "-dw",
+    default=0,
+    show_default=True,
+    type=click.IntRange(0, max_open=True),
+    required=False,
+    help="Number of workers downloading assets ahead of the upload workers. 0 to download and upload in the same worker.",
+)
+@click.option(
+    "--prefetch", "-pf",
+    default=2,
+    show_default=True,
+    type=click.IntRange(1, max_open=True),
+    required=False,
+    help="Max number of downloaded assets per dataset waiting for upload. Only works with --download-workers.",
+)
+@click.option(
+    "--engine", "-e",
+    default="thread",
+    show_default=True,
+    type=click.Choice(["thread", "async"]),
+    required=False,
+    help="Upload engine. 'async' uploads images of a dataset on a single event loop and requires aiohttp.",
+)
+@click.option(
+    "--journal", "-j",
+    is_flag=False,
+    flag_value=JOURNAL_FILENAME,
+    type=click.Path(dir_okay=False),
+    required=False,
+    help="Record upload progress in a local sqlite journal and resume from it on re-run. \
+If flagged without specifying path, the journal is created in the output folder, or in the current path of your terminal.",
+)
+@click.option(
+    "--verify-timeout", "-vt",
+    default=VERIFY_TIMEOUT,
+    show_default=True,
+    type=click.FloatRange(0, max_open=True),
+    required=False,
+    help="Max seconds to wait for uploaded images to show up in Geonadir dataset.",
+)
+@click.option(
+    "--adaptive", "-ad",
+    is_flag=True,
+    default=False,
+    show_default=True,
+    type=bool,
+    required=False,
+    help="Adjust the number of concurrent image uploads to throughput, latency and throttling, starting from 5 x --workers.",
+)
+@click.option(
+    "--max-workers", "-mw",
+    default=MAX_ADAPTIVE_WORKERS,
+    show_default=True,
+    type=click.IntRange(1, max_open=True),
+    required=False,
+    help="Max number of concurrent image uploads with --adaptive.",
+)
+@click.option(
+    "--bandwidth-limit", "-bl",
+    default=None,
+    type=click.FloatRange(0, min_open=True),
+    required=False,
+    help="Max MB/s shared by all uploads to storage and asset downloads. Unlimited if not specified.",
+)
+@click.option(
+    "--bandwidth-schedule", "-bs",
+    default=[],
+    type=str,
+    required=False,
+    multiple=True,
+    callback=validate_schedule,
+    help="Time-of-day bandwidth limit overriding --bandwidth-limit, e.g. 19:00-07:00=unlimited or 09:00-17:00=5. Can be specified multiple times.",
+)
+@click.option(
+    "--cache-dir", "-cd",
+    default=DEFAULT_CACHE_DIR,
+    show_default=True,
+    type=click.Path(file_okay=False),
+    required=False,
+    help="Directory of the local cache of catalog and collection json files.",
+)
+@click.option(
+    "--cache-size", "-cs",
+    default=DEFAULT_CACHE_SIZE,
+    show_default=True,
+    type=click.IntRange(0, max_open=True),
+    required=False,
+    help="Max size of the local cache in MB. 0 to disable caching.",
+)
+@click.option(
+    "--metrics-port", "-mp",
+    default=None,
+    type=click.IntRange(0, 65535),
+    required=False,
+    help="Serve live metrics of the run on http://127.0.0.1:<port>/metrics (OpenMetrics) and /metrics.json. 0 for any free port. Disabled if not specified.",
+)
+@click.option(
+    "--metrics-file", "-mf",
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    required=False,
+    help="Rewrite live metrics of the run to this file every 15 sec, as JSON if it ends with .json or as Prometheus text otherwise (e.g. for node exporter textfile collector). Disabled if not specified.",
+)
 def collection_upload(**kwargs):
     """upload dataset from valid STAC collection object
     """
+    check_stream_engine(kwargs)
+    from .upload import upload_from_collection
+
     upload_from_collection(**kwargs)
 
 
@@ -400,9 +668,141 @@ If flagged without specifing output folder, default is the current path of your
     required=False,
     help="Retry interval second for uploading single image.",
 )
+@click.option(
+    "--workers", "-w",
+    default=1,
+    show_default=True,
+    type=click.IntRange(1, max_open=True),
+    required=False,
+    help="Number of concurrent image uploads. The thread engine uploads up to 5 x this number of images at once, shared by all datasets. The async engine and --download-workers upload up to this number per dataset.",
+)
+@click.option(
+    "--presign-batch-size", "-pb",
+    default=1,
+    show_default=True,
+    type=click.IntRange(1, max_open=True),
+    required=False,
+    help="Number of images per presigned url request. Falls back to single image requests if a batch is rejected.",
+)
+@click.option(
+    "--stream",
+    is_flag=True,
+    default=False,
+    show_default=True,
+    type=bool,
+    required=False,
+    help="Stream assets from source straight to Geonadir storage instead of downloading them first.",
+)
+@click.option(
+    "--download-workers", "-dw",
+    default=0,
+    show_default=True,
+    type=click.IntRange(0, max_open=True),
+    required=False,
+    help="Number of workers downloading assets ahead of the upload workers. 0 to download and upload in the same worker.",
+)
+@click.option(
+    "--prefetch", "-pf",
+    default=2,
+    show_default=True,
+    type=click.IntRange(1, max_open=True),
+    required=False,
+    help="Max number of downloaded assets per dataset waiting for upload. Only works with --download-workers.",
+)
+@click.option(
+    "--engine", "-e",
+    default="thread",
+    show_default=True,
+    type=click.Choice(["thread", "async"]),
+    required=False,
+    help="Upload engine. 'async' uploads images of a dataset on a single event loop and requires aiohttp.",
+)
+@click.option(
+    "--journal", "-j",
+    is_flag=False,
+    flag_value=JOURNAL_FILENAME,
+    type=click.Path(dir_okay=False),
+    required=False,
+    help="Record upload progress in a local sqlite journal and resume from it on re-run. \
+If flagged without specifying path, the journal is created in the output folder, or in the current path of your terminal.",
+)
+@click.option(
+    "--verify-timeout", "-vt",
+    default=VERIFY_TIMEOUT,
+    show_default=True,
+    type=click.FloatRange(0, max_open=True),
+    required=False,
+    help="Max seconds to wait for uploaded images to show up in Geonadir dataset.",
+)
+@click.option(
+    "--adaptive", "-ad",
+    is_flag=True,
+    default=False,
+    show_default=True,
+    type=bool,
+    required=False,
+    help="Adjust the number of concurrent image uploads to throughput, latency and throttling, starting from 5 x --workers.",
+)
+@click.option(
+    "--max-workers", "-mw",
+    default=MAX_ADAPTIVE_WORKERS,
+    show_default=True,
+    type=click.IntRange(1, max_open=True),
+    required=False,
+    help="Max number of concurrent image uploads with --adaptive.",
+)
+@click.option(
+    "--bandwidth-limit", "-bl",
+    default=None,
+    type=click.FloatRange(0, min_open=True),
+    required=False,
+    help="Max MB/s shared by all uploads to storage and asset downloads. Unlimited if not specified.",
+)
+@click.option(
+    "--bandwidth-schedule", "-bs",
+    default=[],
+    type=str,
+    required=False,
+    multiple=True,
+    callback=validate_schedule,
+    help="Time-of-day bandwidth limit overriding --bandwidth-limit, e.g. 19:00-07:00=unlimited or 09:00-17:00=5. Can be specified multiple times.",
+)
+@click.option(
+    "--cache-dir", "-cd",
+    default=DEFAULT_CACHE_DIR,
+    show_default=True,
+    type=click.Path(file_okay=False),
+    required=False,
+    help="Directory of the local cache of catalog and collection json files.",
+)
+@click.option(
+    "--cache-size", "-cs",
+    default=DEFAULT_CACHE_SIZE,
+    show_default=True,
+    type=click.IntRange(0, max_open=True),
+    required=False,
+    help="Max size of the local cache in MB. 0 to disable caching.",
+)
+@click.option(
+    "--metrics-port", "-mp",
+    default=None,
+    type=click.IntRange(0, 65535),
+    required=False,
+    help="Serve live metrics of the run on http://127.0.0.1:<port>/metrics (OpenMetrics) and /metrics.json. 0 for any free port. Disabled if not specified.",
+)
+@click.option(
+    "--metrics-file", "-mf",
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    required=False,
+    help="Rewrite live metrics of the run to this file every 15 sec, as JSON if it ends with .json or as Prometheus text otherwise (e.g. for node exporter textfile collector). Disabled if not specified.",
+)
 def catalog_upload(**kwargs):
     """upload dataset from valid STAC catalog object
     """
+    check_stream_engine(kwargs)
+    from .upload import upload_from_catalog
+
     upload_from_catalog(**kwargs)
 
 
@@ -428,6 +828,8 @@ If flagged without specifing output folder, default is the current path of your
 def search_dataset(**kwargs):
     """search dataset by keyword
     """
+    from .dataset import search_datasets
+
     base_url = kwargs.get("base_url")
     search = kwargs.get("search_str")
     output = kwargs.get("output_folder", None)
@@ -467,6 +869,8 @@ If flagged without specifing output folder, default is the current path of your
 def range_dataset(**kwargs):
     """search dataset by latlon area
     """
+    from .dataset import search_datasets_coord
+
     base_url = kwargs.get("base_url")
     search = kwargs.get("coords")
     output = kwargs.get("output_folder", None)
@@ -502,6 +906,8 @@ If flagged without specifing output folder, default is the current path of your
 def get_dataset_info(**kwargs):
     """get metadata of dataset given dataset id
     """
+    from .dataset import dataset_info
+
     base_url = kwargs.get("base_url")
     project_id = kwargs.get("project_id")
     output = kwargs.get("output_folder", None)
@@ -1,17 +1,28 @@
 """dataset handling functions
 """
+import concurrent.futures
 import json
 import logging
+import math
 import os
+import shutil
+import tempfile
 import time
 
-import pandas as pd
-import requests
-import tqdm as tq
-from requests.adapters import HTTPAdapter, Retry
-
+from . import metrics
+from .hashing import hash_files
+from .journal import (PRESIGNED, REGISTERED, STORED,
+                      reusable_presigned_info)
+from .multipart import MultipartStream
+from .pipeline import run_pipeline
+from .presign import PresignedUrlBatcher
+from .results import UploadResults
+from .session import get_session
+from .throttle import (THROTTLE_CHUNK_SIZE, ThrottledReader, get_limiter,
+                       throttled_chunks)
+from .timing import PhaseTimer, phase
 from .util import (geonadir_filename_trans, get_filelist_from_collection,
-                   original_filename)
+                   original_filename, scan_images)
 
 logger = logging.getLogger(__name__)
 env = os.environ.get("GEONADIR_CLI_ENV", "prod")
@@ -20,6 +31,12 @@ if env != "prod":
     LOG_LEVEL = logging.DEBUG
 logging.basicConfig(level=LOG_LEVEL)
 
+PAGE_SIZE = 100
+PAGINATION_WORKERS = 8
+# Geonadir S3 storage, overridable e.g. for benchmarking against a local stand-in
+STORAGE_URL = os.environ.get(
+    "GEONADIR_STORAGE_URL", "https://geonadir-prod.s3.amazonaws.com/")
+
 
 def create_dataset(payload_data, base_url, token):
     """
@@ -53,7 +70,7 @@ def create_dataset(payload_data, base_url, token):
     logger.debug(f"url: {reqUrl}")
     logger.debug(f"data: {payload}")
     logger.debug(f"headers: {headers}")
-    response = requests.post(reqUrl, data=payload,
+    response = get_session().post(reqUrl, data=payload,
                              headers=headers, timeout=120)
     response.raise_for_status()
     logger.debug("response content:")
@@ -63,7 +80,7 @@ def create_dataset(payload_data, base_url, token):
     return dataset_id
 
 
-def upload_images(dataset_name, dataset_id, img_dir, base_url, token, max_retry, retry_interval, timeout):
+def upload_images(dataset_name, dataset_id, img_dir, base_url, token, max_retry, retry_interval, timeout, options=None):
     """
     Upload images from a directory to a dataset.
 
@@ -76,69 +93,159 @@ def upload_images(dataset_name, dataset_id, img_dir, base_url, token, max_retry,
         max_retry (int): Max retry for uploading single image.
         retry_interval (float): Interval between retries.
         timeout (float): Timeout limit for uploading single images.
+        options (dict, optional): Tuning options, e.g. number of concurrent workers, upload engine,
+            global image scheduler, whether images are deduplicated by content hash
+            instead of file name (requires journal), or whether subdirectories are
+            scanned too. Defaults to None.
 
     Returns:
         pd.DataFrame: DataFrame containing upload results for each image.
     """
-    file_list = os.listdir(img_dir)
-    file_list = [
-        file for file in file_list if file.lower().endswith(
-            ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tif')
-        )
-    ]
-
-    url = f"{base_url}/api/uploadfiles/?page=1&project_id={dataset_id}"
-    existing_image_list = [original_filename(
-        name) for name in paginate_dataset_images(url, [])]
-    existing_images = set(existing_image_list)
-    file_list = [file for file in file_list if geonadir_filename_trans(
-        file) not in existing_images]
-
-    count = 0
-    df_list = []
+    options = options or {}
+    workers = options.get("workers", 1)
+    scheduler = options.get("scheduler")
+    journal = options.get("journal")
+    dedup = options.get("dedup") and journal
+
+    existing_images = set()
+    if not options.get("new_dataset"):
+        existing_images = {
+            original_filename(name) for name in paginate_dataset_images(base_url, dataset_id)
+        }
 
-    with tq.tqdm(total=len(file_list), position=0) as pbar:
-        for file_path in file_list:
+    sizes = {}
+
+    def scanned():
+        names = set()
+        for file_path, file_size in scan_images(img_dir, options.get("recursive", False)):
+            name = os.path.basename(file_path)
+            if name in names:
+                logger.warning(
+                    f"{file_path} has the same file name as another image in {img_dir}")
+            names.add(name)
+            # with dedup, content decides which images are already uploaded
+            if not dedup and geonadir_filename_trans(name) in existing_images:
+                continue
+            sizes[file_path] = file_size
+            yield file_path
+
+    # upload while directory is still being listed, unless the full list is needed first
+    lazy = not journal and options.get("presign_batch_size", 1) <= 1 \
+        and options.get("engine") != "async"
+    file_list = scanned() if lazy else list(scanned())
+
+    stored = []
+    digests = {}
+    if dedup:
+        file_list, stored, digests = split_by_content(
+            journal, dataset_id, file_list, img_dir, existing_images)
+    elif journal:
+        file_list, stored = split_by_journal(journal, dataset_id, file_list)
+
+    batcher = None
+    if options.get("presign_batch_size", 1) > 1:
+        batcher = PresignedUrlBatcher(
+            dataset_id,
+            base_url,
+            token,
+            file_list,
+            options["presign_batch_size"],
+            max_retry,
+            retry_interval,
+            timeout,
+        )
 
-            file_size = os.path.getsize(os.path.join(img_dir, file_path))
+    def upload(file_path):
+        file_size = sizes[file_path]
+        timer = PhaseTimer()
 
-            start_time = time.time()
+        start_time = time.time()
 
-            # with open(os.path.join(img_dir, file_path), "rb") as file:
-            param = {
-                "base_url": base_url,
-                "token": token,
-                "dataset_id": dataset_id,
-                "file_path": os.path.join(img_dir, file_path),
-            }
+        param = {
+            "base_url": base_url,
+            "token": token,
+            "dataset_id": dataset_id,
+            "file_path": os.path.join(img_dir, file_path),
+            "journal": journal,
+            "journal_name": file_path,
+        }
+        with timer.activate():
+            if batcher:
+                with phase("presign"):
+                    param["presigned_info"] = batcher.get(file_path)
             try:
                 response_code = upload_single_image(
                     param, max_retry, retry_interval, timeout)
             except Exception as exc:
                 logger.error(f"Error when uploading {file_path}")
                 raise exc
-
-            end_time = time.time()
-            upload_time = end_time - start_time
-            df = pd.DataFrame(
-                {
-                    "Project ID": dataset_id,
-                    "Dataset Name": dataset_name,
-                    "Image Name": file_path,
-                    "Response Code": response_code,
-                    "Upload Time": upload_time,
-                    "Image Size": file_size
-                },
-                index=[0]
+        record_digest(file_path)
+
+        end_time = time.time()
+        upload_time = end_time - start_time
+        return file_path, response_code, upload_time, file_size, timer
+
+    def register_stored(file_path):
+        timer = PhaseTimer()
+        start_time = time.time()
+        param = {
+            "base_url": base_url,
+            "token": token,
+            "dataset_id": dataset_id,
+            "file_path": os.path.join(img_dir, file_path),
+            "journal": journal,
+            "journal_name": file_path,
+        }
+        with timer.activate():
+            try:
+                response_code = upload_single_image(
+                    param, max_retry, retry_interval, timeout)
+            except Exception as exc:
+                logger.error(f"Error when registering {file_path}")
+                raise exc
+        record_digest(file_path)
+        upload_time = time.time() - start_time
+        file_size = journal.get(dataset_id, file_path)["size"]
+        return file_path, response_code, upload_time, file_size, timer
+
+    def record_digest(file_path):
+        if file_path in digests:
+            journal.record_hash(dataset_id, file_path, digests[file_path])
+
+    import tqdm as tq
+
+    total = None if lazy else len(file_list) + len(stored)
+    metrics.dataset_started(dataset_id, dataset_name, total)
+    # tqdm gives each bar of concurrent datasets its own line
+    with tq.tqdm(total=total, desc=dataset_name) as pbar:
+        results = UploadResults(dataset_id, dataset_name)
+        results.extend(run_image_tasks(
+            metrics.metered(register_stored, dataset_id, dataset_name),
+            stored, workers, pbar, scheduler))
+        if options.get("engine") == "async":
+            from .async_upload import run_async_uploads
+
+            async_results = run_async_uploads(
+                [(file, os.path.join(img_dir, file), None) for file in file_list],
+                {"base_url": base_url, "token": token, "dataset_id": dataset_id,
+                    "dataset_name": dataset_name, "journal": journal},
+                max_retry,
+                retry_interval,
+                timeout,
+                workers,
+                pbar,
+                batcher,
             )
-            df_list.append(df)
-
-            count += 1
-            pbar.update(1)
+            for file_path, *_ in async_results:
+                record_digest(file_path)
+            results.extend(async_results)
+        else:
+            results.extend(run_image_tasks(
+                metrics.metered(upload, dataset_id, dataset_name),
+                file_list, workers, pbar, scheduler))
 
     logger.debug(f"generating result dataframe")
-    result_df = pd.concat(df_list, ignore_index=True)
-    return result_df
+    return results.to_dataframe()
 
 
 def upload_images_from_collection(
@@ -150,7 +257,8 @@ def upload_images_from_collection(
         remote_collection_json,
         max_retry,
         retry_interval,
-        timeout
+        timeout,
+        options=None
 ):
     """
     Upload images from a directory to a dataset.
@@ -158,55 +266,146 @@ def upload_images_from_collection(
     Args:
         dataset_name (str): Name of the dataset to upload images to.
         dataset_id (str): ID of the dataset to upload images to.
-        collection (str): Path of local collection.json.
+        collection (pystac.Collection): Parsed collection.
         base_url (str): Base url of Geonadir api.
         token (str): User token.
         remote_collection_json (str): Remote url of collection.json.
         max_retry (int): Max retry for downloading/uploading single image.
         retry_interval (float): Interval between retries.
         timeout (float): Timeout limit for uploading single images.
+        options (dict, optional): Tuning options, e.g. number of concurrent workers, upload engine,
+            whether assets are streamed to storage without being saved locally, number of
+            download workers prefetching assets for upload workers, or global image scheduler.
+            Defaults to None.
 
     Returns:
         pd.DataFrame: DataFrame containing upload results for each image.
     """
+    options = options or {}
+    workers = options.get("workers", 1)
+    scheduler = options.get("scheduler")
+    stream = options.get("stream", False)
+    download_workers = options.get("download_workers", 0)
+
     file_dict = get_filelist_from_collection(
         collection, remote_collection_json)
     if not file_dict:
-        raise Exception(f"no applicable asset file in collection {collection}")
+        raise Exception(f"no applicable asset file in collection {remote_collection_json}")
 
-    url = f"{base_url}/api/uploadfiles/?page=1&project_id={dataset_id}"
-    existing_image_list = [original_filename(
-        name) for name in paginate_dataset_images(url, [])]
-    existing_images = set(existing_image_list)
+    existing_images = set()
+    if not options.get("new_dataset"):
+        existing_images = {
+            original_filename(name) for name in paginate_dataset_images(base_url, dataset_id)
+        }
 
-    df_list = []
+    journal = options.get("journal")
+    stored = []
+    if journal:
+        to_upload, stored = split_by_journal(
+            journal, dataset_id, list(file_dict))
+        file_dict = {file_path: file_dict[file_path] for file_path in to_upload}
+
+    batcher = None
+    if options.get("presign_batch_size", 1) > 1:
+        batcher = PresignedUrlBatcher(
+            dataset_id,
+            base_url,
+            token,
+            [
+                file_path for file_path in file_dict
+                if geonadir_filename_trans(os.path.basename(file_path)) not in existing_images
+            ],
+            options["presign_batch_size"],
+            max_retry,
+            retry_interval,
+            timeout,
+        )
 
-    with tq.tqdm(total=len(file_dict), position=0) as pbar:
-        for file_path, file_url in file_dict.items():
-            if geonadir_filename_trans(os.path.basename(file_path)) in existing_images:
-                logger.warning(f"{file_path} already uploaded. skipped")
-                pbar.update(1)
-                continue
+    def upload(asset):
+        file_path, file_url = asset
+        if geonadir_filename_trans(os.path.basename(file_path)) in existing_images:
+            logger.warning(f"{file_path} already uploaded. skipped")
+            return None
+
+        if stream:
+            # only opening the stream counts as download, the body is read while uploading
+            timer = PhaseTimer()
+            with timer.activate():
+                try:
+                    with phase("download"):
+                        source = open_image_stream(
+                            file_url, max_retry, retry_interval, timeout)
+                except Exception as exc:
+                    logger.error(f"Error when downloading {file_url}")
+                    raise exc
+                with source:
+                    content_length = source.headers.get("Content-Length")
+                    if content_length:
+                        logger.debug(f"streaming {file_url} to storage")
+                        start_time = time.time()
+                        param = {
+                            "base_url": base_url,
+                            "token": token,
+                            "dataset_id": dataset_id,
+                            "file_path": file_path,
+                            "stream": source.raw,
+                            "stream_length": int(content_length),
+                            "journal": journal,
+                            "journal_name": file_path,
+                        }
+                        if batcher:
+                            with phase("presign"):
+                                param["presigned_info"] = batcher.get(file_path)
+                        try:
+                            response_code = upload_single_image(
+                                param, max_retry, retry_interval, timeout)
+                        except Exception as exc:
+                            logger.error(f"Error when uploading {file_path}")
+                            raise exc
+                        upload_time = time.time() - start_time
+                        return file_path, response_code, upload_time, int(content_length), timer
+            logger.warning(
+                f"Size of {file_url} unknown, downloading it before uploading")
+
+        return upload_downloaded(download(asset))
+
+    def download(asset):
+        file_path, file_url = asset
+        if geonadir_filename_trans(os.path.basename(file_path)) in existing_images:
+            logger.warning(f"{file_path} already uploaded. skipped")
+            return None
+        local_path = os.path.join(download_dir, os.path.basename(file_path))
+        timer = PhaseTimer()
+        with timer.activate(), phase("download"):
             try:
                 content = retrieve_single_image(
                     file_url, max_retry, retry_interval)
             except Exception as exc:
                 logger.error(f"Error when downloading {file_url}")
                 raise exc
-            logger.debug(f"writting content from {file_url} to {file_path}")
-            with open(file_path, 'wb') as fd:
+            logger.debug(f"writting content from {file_url} to {local_path}")
+            with open(local_path, 'wb') as fd:
                 fd.write(content)
-            file_size = os.path.getsize(file_path)
+        return file_path, local_path, timer
 
-            start_time = time.time()
+    def upload_downloaded(downloaded):
+        file_path, local_path, timer = downloaded
+        file_size = os.path.getsize(local_path)
 
-            # with open(os.path.join(img_dir, file_path), "rb") as file:
-            param = {
-                "base_url": base_url,
-                "token": token,
-                "dataset_id": dataset_id,
-                "file_path": file_path,
-            }
+        start_time = time.time()
+
+        param = {
+            "base_url": base_url,
+            "token": token,
+            "dataset_id": dataset_id,
+            "file_path": local_path,
+            "journal": journal,
+            "journal_name": file_path,
+        }
+        with timer.activate():
+            if batcher:
+                with phase("presign"):
+                    param["presigned_info"] = batcher.get(file_path)
             try:
                 response_code = upload_single_image(
                     param, max_retry, retry_interval, timeout)
@@ -214,28 +413,243 @@ def upload_images_from_collection(
                 logger.error(f"Error when uploading {file_path}")
                 raise exc
 
-            logger.debug(f"deleting {file_path} after uploading")
-            os.unlink(file_path)
-
-            end_time = time.time()
-            upload_time = end_time - start_time
-            df = pd.DataFrame(
-                {
-                    "Project ID": dataset_id,
-                    "Dataset Name": dataset_name,
-                    "Image Name": file_path,
-                    "Response Code": response_code,
-                    "Upload Time": upload_time,
-                    "Image Size": file_size
-                },
-                index=[0]
-            )
-            df_list.append(df)
-            pbar.update(1)
+        logger.debug(f"deleting {local_path} after uploading")
+        os.unlink(local_path)
+
+        end_time = time.time()
+        upload_time = end_time - start_time
+        return file_path, response_code, upload_time, file_size, timer
+
+    def register_stored(file_path):
+        timer = PhaseTimer()
+        start_time = time.time()
+        param = {
+            "base_url": base_url,
+            "token": token,
+            "dataset_id": dataset_id,
+            "file_path": file_path,
+            "journal": journal,
+            "journal_name": file_path,
+        }
+        with timer.activate():
+            try:
+                response_code = upload_single_image(
+                    param, max_retry, retry_interval, timeout)
+            except Exception as exc:
+                logger.error(f"Error when registering {file_path}")
+                raise exc
+        upload_time = time.time() - start_time
+        file_size = journal.get(dataset_id, file_path)["size"]
+        return file_path, response_code, upload_time, file_size, timer
+
+    def discard(downloaded):
+        _, local_path, _ = downloaded
+        logger.debug(f"deleting {local_path} without uploading")
+        os.unlink(local_path)
+
+    import tqdm as tq
+
+    metrics.dataset_started(dataset_id, dataset_name, len(file_dict) + len(stored))
+    # datasets uploaded at the same time may have assets of the same name,
+    # so each one downloads into a directory of its own
+    download_dir = tempfile.mkdtemp(prefix="geonadir-")
+    try:
+        # tqdm gives each bar of concurrent datasets its own line
+        with tq.tqdm(total=len(file_dict) + len(stored), desc=dataset_name) as pbar:
+            results = UploadResults(dataset_id, dataset_name)
+            results.extend(run_image_tasks(
+                metrics.metered(register_stored, dataset_id, dataset_name),
+                stored, workers, pbar, scheduler))
+            if options.get("engine") == "async":
+                from .async_upload import run_async_uploads
+
+                assets = [
+                    (file_path, os.path.join(download_dir, os.path.basename(file_path)), file_url)
+                    for file_path, file_url in file_dict.items()
+                    if geonadir_filename_trans(os.path.basename(file_path)) not in existing_images
+                ]
+                if len(assets) < len(file_dict):
+                    logger.warning(
+                        f"{len(file_dict) - len(assets)} assets already uploaded. skipped")
+                    pbar.update(len(file_dict) - len(assets))
+                results.extend(run_async_uploads(
+                    assets,
+                    {"base_url": base_url, "token": token, "dataset_id": dataset_id,
+                        "dataset_name": dataset_name, "journal": journal},
+                    max_retry,
+                    retry_interval,
+                    timeout,
+                    workers,
+                    pbar,
+                    batcher,
+                ))
+            elif download_workers and not stream:
+                results.extend(run_pipeline(
+                    list(file_dict.items()),
+                    download,
+                    metrics.metered(upload_downloaded, dataset_id, dataset_name),
+                    download_workers,
+                    workers,
+                    options.get("prefetch", 2),
+                    pbar,
+                    discard,
+                ))
+            else:
+                results.extend(run_image_tasks(
+                    metrics.metered(upload, dataset_id, dataset_name),
+                    list(file_dict.items()), workers, pbar, scheduler))
+    finally:
+        # assets left behind by failed or cancelled uploads
+        shutil.rmtree(download_dir, ignore_errors=True)
 
     logger.debug(f"generating result dataframe")
-    result_df = pd.concat(df_list, ignore_index=True)
-    return result_df
+    return results.to_dataframe()
+
+
+def split_by_journal(journal, dataset_id, file_paths):
+    """drop images registered according to upload journal, and separate images
+    which are already in storage and only need registering.
+
+    Args:
+        journal (journal.UploadJournal): upload journal.
+        dataset_id (str): ID of the dataset.
+        file_paths (list): image paths relative to image directory, or asset names.
+
+    Returns:
+        (list, list): images to be uploaded, images to be registered only.
+    """
+    entries = journal.entries(dataset_id)
+    to_upload, stored = [], []
+    registered = 0
+    for file_path in file_paths:
+        entry = entries.get(file_path)
+        phase = entry["phase"] if entry else None
+        if phase == REGISTERED:
+            registered += 1
+        elif phase == STORED and entry["presigned_info"]:
+            stored.append(file_path)
+        else:
+            to_upload.append(file_path)
+    if registered or stored:
+        logger.info(
+            f"journal {journal.path}: {registered} images of dataset {dataset_id} already uploaded, "
+            f"{len(stored)} to be registered only")
+    return to_upload, stored
+
+
+def split_by_content(journal, dataset_id, file_paths, img_dir="", existing_images=()):
+    """decide by content which images are already uploaded, instead of by name.
+    An image is dropped if its content is registered in the dataset according to
+    the hash index of upload journal, or duplicates another image of this run.
+    A different image taking the name of a hashed one is uploaded, and its stale
+    journal progress is forgotten. Images whose names were uploaded without hash
+    (registered in journal or found in the dataset) can't be compared and are
+    dropped by name. Files are hashed in a process pool, so no bytes are sent to
+    detect duplicates.
+
+    Args:
+        journal (journal.UploadJournal): upload journal.
+        dataset_id (str): ID of the dataset.
+        file_paths (list): image paths relative to img_dir.
+        img_dir (str, optional): directory of images. Defaults to "".
+        existing_images (set, optional): Geonadir file names of images in the dataset. Defaults to ().
+
+    Returns:
+        (list, list, dict): images to be uploaded, images to be registered only,
+            image -> hex digest for images to be uploaded or registered.
+    """
+    file_paths = list(file_paths)
+    hashed = hash_files([os.path.join(img_dir, file_path) for file_path in file_paths])
+    digests = {
+        file_path: hashed[os.path.join(img_dir, file_path)] for file_path in file_paths
+    }
+    uploaded = journal.get_hashes(dataset_id)
+    hashed_names = journal.get_hashed_names(dataset_id)
+    hashed_remote = {
+        geonadir_filename_trans(os.path.basename(name)) for name in hashed_names
+    }
+    entries = journal.entries(dataset_id)
+    seen = {}
+    to_upload, stored = [], []
+    for file_path in file_paths:
+        digest = digests[file_path]
+        entry = entries.get(file_path)
+        phase = entry["phase"] if entry else None
+        remote_name = geonadir_filename_trans(os.path.basename(file_path))
+        if digest in uploaded:
+            logger.warning(
+                f"{file_path} already uploaded as {uploaded[digest]}. skipped")
+            continue
+        if digest in seen:
+            logger.warning(f"{file_path} same as {seen[digest]}. skipped")
+            continue
+        if file_path in hashed_names:
+            logger.info(f"{file_path} changed since uploaded. uploading new content")
+            journal.forget(dataset_id, file_path)
+            to_upload.append(file_path)
+        elif phase == REGISTERED or (
+                remote_name in existing_images and remote_name not in hashed_remote):
+            logger.warning(
+                f"{file_path} already uploaded without content hash. skipped by name")
+            continue
+        elif phase == STORED and entry["presigned_info"]:
+            stored.append(file_path)
+        else:
+            to_upload.append(file_path)
+        seen[digest] = file_path
+    skipped = len(file_paths) - len(to_upload) - len(stored)
+    if skipped or stored:
+        logger.info(
+            f"{skipped} images of dataset {dataset_id} already uploaded, {len(stored)} to be registered only")
+    return to_upload, stored, {file_path: digests[file_path] for file_path in to_upload + stored}
+
+
+def run_image_tasks(task, items, workers, pbar, scheduler=None):
+    """run task for each item, one at a time, on a bounded thread pool, or on the
+    global scheduler shared by all datasets if given.
+    The first exception raised by any task cancels the pending ones and is re-raised.
+
+    Args:
+        task (callable): function called with each item. Returns a result or None if skipped.
+        items (iterable): items to be processed. Tasks are started while items are still being generated.
+        workers (int): max number of tasks running at the same time. Ignored if scheduler given.
+        pbar (tqdm.tqdm): progress bar updated once per finished item.
+        scheduler (scheduler.ImageScheduler, optional): global scheduler. Defaults to None.
+
+    Returns:
+        list: non-None results in the same order as items.
+    """
+    if scheduler:
+        return scheduler.run(task, items, pbar)
+
+    results = []
+    if workers <= 1:
+        for item in items:
+            result = task(item)
+            if result is not None:
+                results.append(result)
+            pbar.update(1)
+        return results
+
+    logger.debug(f"uploading with {workers} workers")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(metrics.queued("images_queued", task), item) for item in items
+        ]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+                pbar.update(1)
+        except Exception as exc:
+            for future in futures:
+                if future.cancel():
+                    metrics.adjust("images_queued", -1)
+            raise exc
+    for future in futures:
+        result = future.result()
+        if result is not None:
+            results.append(result)
+    return results
 
 
 def trigger_ortho_processing(dataset_id, base_url, token):
@@ -261,7 +675,7 @@ def trigger_ortho_processing(dataset_id, base_url, token):
     logger.debug(f"headers: {headers}")
     logger.debug(f"files: {payload}")
 
-    response = requests.post(
+    response = get_session().post(
         f"{base_url}/api/utility/dataset-actions/",
         headers=headers,
         files=payload,
@@ -270,37 +684,101 @@ def trigger_ortho_processing(dataset_id, base_url, token):
     response.raise_for_status()
 
 
-def paginate_dataset_images(url, image_names: list):
+def paginate_dataset_images(base_url, dataset_id, page_size=PAGE_SIZE, workers=PAGINATION_WORKERS):
+    """
+    Iterate over the images of a dataset page by page.
+    Once the first page reveals the total count, the remaining pages are
+    fetched concurrently and yielded in order.
+
+    Args:
+        base_url (str): Base url of Geonadir api.
+        dataset_id (str): ID of the dataset.
+        page_size (int, optional): Images per page requested. Defaults to PAGE_SIZE.
+        workers (int, optional): Max number of pages fetched at the same time. Defaults to PAGINATION_WORKERS.
+
+    Raises:
+        Exception: Failed to get a page.
+
+    Yields:
+        str: image url.
     """
-    Paginate through the dataset images API response to retrieve all image names.
+    url = f"{base_url}/api/uploadfiles/"
+    data = get_dataset_images_page(url, dataset_id, 1, page_size)
+    if not data:
+        logger.warning(f"No image found in dataset {dataset_id}")
+        return
+    results = data["results"]
+    for result in results:
+        yield result["upload_files"]
+    if not data.get("next"):
+        return
+
+    count = data.get("count")
+    if not count or not results:
+        # total unknown: follow next links one after another
+        next_page = data["next"]
+        while next_page:
+            logger.debug(f"get dataset images from {next_page}")
+            response = get_session().get(next_page, timeout=60)
+            response.raise_for_status()
+            data = response.json()
+            for result in data.get("results", []):
+                yield result["upload_files"]
+            next_page = data.get("next")
+        return
+
+    # server may cap page size, so count pages by size of the first one
+    num_pages = math.ceil(count / len(results))
+    logger.debug(
+        f"dataset {dataset_id}: {count} images in {num_pages} pages")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, num_pages - 1)) as executor:
+        pages = executor.map(
+            lambda page: get_dataset_images_page(
+                url, dataset_id, page, page_size),
+            range(2, num_pages + 1)
+        )
+        for data in pages:
+            for result in (data or {}).get("results", []):
+                yield result["upload_files"]
+
+
+def get_dataset_images_page(url, dataset_id, page, page_size=PAGE_SIZE):
+    """get single page of dataset images.
 
     Args:
         url (str): URL of the API endpoint.
-        image_names (list): List to store the image names.
+        dataset_id (str): ID of the dataset.
+        page (int): page number, starting from 1.
+        page_size (int, optional): Images per page requested. Defaults to PAGE_SIZE.
+
+    Raises:
+        Exception: Failed to get the page.
 
     Returns:
-        list: List of image names.
+        dict | None: page with count, next and results, or None if page doesn't exist.
     """
+    params = {
+        "page": page,
+        "page_size": page_size,
+        "project_id": dataset_id,
+    }
+    logger.debug(f"get dataset images from {url}: {params}")
     try:
-        logger.debug(f"get dataset images from {url}")
-        response = requests.get(url, timeout=60)
-        data = response.json()
-        results = data["results"]
-        for result in results:
-            image_name = result["upload_files"]
-            # image_name = re.search(r'([^/]+?)(?:_\d+)?\.JPG', image_url).group(1) + ".JPG"
-            image_names.append(image_name)
-        next_page = data["next"]
-        if next_page:
-            paginate_dataset_images(next_page, image_names)
-        return image_names
+        response = get_session().get(url, params=params, timeout=60)
     except Exception as exc:
-        if "data" in locals():
-            logger.warning(f"No image found in {url}")
-        else:
-            logger.error(
-                f"Failed to get dataset images from {url}: {str(exc)}")
-        return []
+        raise Exception(
+            f"Failed to get dataset images from {url}: {str(exc)}")
+    if response.status_code == 404:
+        return None
+    try:
+        response.raise_for_status()
+    except Exception as exc:
+        raise Exception(
+            f"response code {response.status_code}: {response.text}")
+    data = response.json()
+    if "results" not in data:
+        return None
+    return data
 
 
 def search_datasets(search_str, base_url):
@@ -331,7 +809,7 @@ def search_datasets(search_str, base_url):
     logger.info(f"search for GN dataset: {search_str}")
     logger.debug(f"url: {base_url}/api/search_datasets")
     logger.debug(f"params: {payload}")
-    response = requests.get(
+    response = get_session().get(
         f"{base_url}/api/search_datasets",
         params=payload,
         timeout=180,
@@ -402,7 +880,7 @@ def dataset_info(project_id, base_url):
     }
     logger.debug(f"params: {payload}")
 
-    response = requests.get(
+    response = get_session().get(
         f"{base_url}/api/metadata/",
         params=payload,
         timeout=180,
@@ -448,7 +926,7 @@ def search_datasets_coord(coord, base_url):
 
     logger.debug(f"url: {base_url}/api/dataset_coords")
     logger.debug(f"params: {payload}")
-    response = requests.get(
+    response = get_session().get(
         f"{base_url}/api/dataset_coords",
         params=payload,
         timeout=180,
@@ -473,21 +951,18 @@ def retrieve_single_image(url, max_retry=5, retry_interval=10, timeout=60):
     Returns:
         requests.content: image content from http request
     """
-    s = requests.Session()
-    retries = Retry(
-        total=max_retry,
-        backoff_factor=retry_interval,
-        raise_on_status=False,
-        status_forcelist=list(range(400, 600))
-    )
-    s.mount('http://', HTTPAdapter(max_retries=retries))
-    s.mount('https://', HTTPAdapter(max_retries=retries))
+    limiter = get_limiter()
+    s = get_session(max_retry, retry_interval)
     try:
         logger.debug("retrieve single image from collection:")
         logger.debug(f"url: {url}")
-        r = s.get(url, timeout=timeout)
+        r = s.get(url, timeout=timeout, stream=bool(limiter))
         r.raise_for_status()
         logger.debug(r.status_code)
+        if limiter:
+            with r:
+                return b"".join(throttled_chunks(
+                    r.iter_content(THROTTLE_CHUNK_SIZE), limiter))
         return r.content
     except Exception as exc:
         if "r" not in locals():
@@ -495,14 +970,54 @@ def retrieve_single_image(url, max_retry=5, retry_interval=10, timeout=60):
         raise Exception(str(exc))
 
 
+def open_image_stream(url, max_retry=5, retry_interval=10, timeout=60):
+    """open single image from STAC collection assets for streaming, without reading its content.
+    Content encoding is disabled so that the raw body matches Content-Length.
+
+    Args:
+        url (str): asset href for retrieving image from
+        max_retry (int, optional): max_retry. Defaults to 5.
+        retry_interval (int, optional): retry_interval. Defaults to 10.
+        timeout (int, optional): timeout. Defaults to 60.
+
+    Returns:
+        requests.Response: streaming response. Close it after reading from response.raw.
+    """
+    s = get_session(max_retry, retry_interval)
+    try:
+        logger.debug("open single image stream from collection:")
+        logger.debug(f"url: {url}")
+        r = s.get(
+            url,
+            headers={"Accept-Encoding": "identity"},
+            stream=True,
+            timeout=timeout,
+        )
+        r.raise_for_status()
+        logger.debug(r.status_code)
+        return r
+    except Exception as exc:
+        if "r" not in locals():
+            raise Exception(f"Failed to access url: {url}.")
+        r.close()
+        raise Exception(str(exc))
+
+
 def upload_single_image(param, max_retry=5, retry_interval=10, timeout=60):
     """upload single image to GN in 3 steps:
-    1. generate presigned url for GN Amazon S3 storage.
-    2. upload image to url generated before.
+    1. generate presigned url for GN Amazon S3 storage, unless given in param.
+    2. upload image to url generated before, from local file or from stream in param.
     3. create image uploaded to storage.
+    With an upload journal in param, each finished step is recorded and steps
+    recorded by an earlier run are not done again.
+    Each step is timed as a phase of the current timing.PhaseTimer, if any.
 
     Args:
         param (dict): all params required for uploading, including base_url, token, dataset id and local file path.
+            Optionally presigned_info from a batched presigned url request,
+            stream/stream_length for uploading from an open stream instead of local file,
+            journal (journal.UploadJournal) for recording progress, and journal_name
+            identifying the image in journal (defaults to file name).
         max_retry (int, optional): max retry. Defaults to 5.
         retry_interval (int, optional): retry interval in second. Defaults to 10.
         timeout (int, optional): timeout for single http request in second. Defaults to 60.
@@ -518,13 +1033,42 @@ def upload_single_image(param, max_retry=5, retry_interval=10, timeout=60):
     dataset_id = param["dataset_id"]
     file_path = param["file_path"]
 
+    response_json = param.get("presigned_info")
+    journal = param.get("journal")
+    image_name = param.get("journal_name") or os.path.basename(file_path)
+    entry = journal.get(dataset_id, image_name) if journal else None
+
     try:
-        response_code, response_json = generate_presigned_url(
-            dataset_id, base_url, token, file_path, max_retry, retry_interval, timeout)
-        response_code = upload_to_amazon(
-            response_json, file_path, max_retry, retry_interval, timeout)
-        response_code = create_post_image(response_json, dataset_id, base_url,
-                                          token, max_retry, retry_interval, timeout)
+        if entry and entry["phase"] == STORED and entry["presigned_info"]:
+            logger.debug(f"{image_name} already in storage, registering only")
+            response_json = entry["presigned_info"]
+        else:
+            reused = reusable_presigned_info(entry)
+            response_json = reused or response_json
+            if not response_json:
+                with phase("presign"):
+                    response_code, response_json = generate_presigned_url(
+                        dataset_id, base_url, token, file_path, max_retry, retry_interval, timeout)
+            # reused info keeps the time it was generated at, so it expires on schedule
+            if journal and not reused:
+                journal.record(dataset_id, image_name,
+                               PRESIGNED, response_json)
+            with phase("storage"):
+                if "stream" in param:
+                    response_code = upload_stream_to_amazon(
+                        response_json, file_path, param["stream"], param["stream_length"],
+                        max_retry, retry_interval, timeout)
+                else:
+                    response_code = upload_to_amazon(
+                        response_json, file_path, max_retry, retry_interval, timeout)
+            if journal:
+                size = param.get("stream_length") or os.path.getsize(file_path)
+                journal.record(dataset_id, image_name, STORED, size=size)
+        with phase("register"):
+            response_code = create_post_image(response_json, dataset_id, base_url,
+                                              token, max_retry, retry_interval, timeout)
+        if journal:
+            journal.record(dataset_id, image_name, REGISTERED)
         return response_code
     except Exception as exc:
         raise exc
@@ -573,15 +1117,7 @@ def generate_presigned_url(
             os.path.basename(file_path),
         ],
     }
-    s = requests.Session()
-    retries = Retry(
-        total=max_retry,
-        backoff_factor=retry_interval,
-        raise_on_status=False,
-        status_forcelist=list(range(400, 600))
-    )
-    s.mount('http://', HTTPAdapter(max_retries=retries))
-    s.mount('https://', HTTPAdapter(max_retries=retries))
+    s = get_session(max_retry, retry_interval)
     try:
         logger.debug("generate presigned url:")
         logger.debug(f"url: {base_url}/api/generate_presigned_url/")
@@ -605,6 +1141,8 @@ def generate_presigned_url(
 
 def upload_to_amazon(presigned_info, file_path, max_retry=5, retry_interval=10, timeout=60):
     """Step 2: upload image to url generated before.
+    The file is streamed in chunks behind the policy fields with a known
+    Content-Length, so memory use stays constant regardless of file size.
 
     Args:
         presigned_info (dict): key, policy, signature and AWSAccessKeyId for uploading to Amazon.
@@ -616,46 +1154,71 @@ def upload_to_amazon(presigned_info, file_path, max_retry=5, retry_interval=10,
     Returns:
         int: http request status code.
     """
-    key = presigned_info["fields"][0]["key"]
-    policy = presigned_info["fields"][0]["policy"]
-    signature = presigned_info["fields"][0]["signature"]
-    AWSAccessKeyId = presigned_info["AWSAccessKeyId"]
-
     with open(file_path, 'rb') as file:
-        files = {
-            'key': (None, key),
-            'AWSAccessKeyId': (None, AWSAccessKeyId),
-            'policy': (None, policy),
-            'signature': (None, signature),
-            'file': file,
-        }
+        return upload_stream_to_amazon(
+            presigned_info, file_path, file, os.fstat(file.fileno()).st_size,
+            max_retry, retry_interval, timeout)
+
+
+def upload_stream_to_amazon(
+    presigned_info,
+    file_path,
+    stream,
+    content_length,
+    max_retry=5,
+    retry_interval=10,
+    timeout=60
+):
+    """Step 2 (streaming): upload image read from a stream to url generated before.
+    The body is sent in chunks, so the image is never held in memory as a whole.
+    Chunks go through the bandwidth limiter if configured.
+
+    Args:
+        presigned_info (dict): key, policy, signature and AWSAccessKeyId for uploading to Amazon.
+        file_path (str): file name of uploaded image.
+        stream (file-like | iterable): image content, e.g. raw response of remote asset.
+        content_length (int): image size in bytes.
+        max_retry (int, optional): max retry. Defaults to 5.
+        retry_interval (int, optional): retry interval. Defaults to 10.
+        timeout (int, optional): timeout. Defaults to 60.
 
-        s = requests.Session()
-        retries = Retry(
-            total=max_retry,
-            backoff_factor=retry_interval,
-            raise_on_status=False,
-            status_forcelist=list(range(400, 600))
+    Returns:
+        int: http request status code.
+    """
+    key = presigned_info["fields"][0]["key"]
+    fields = [
+        ('key', key),
+        ('AWSAccessKeyId', presigned_info["AWSAccessKeyId"]),
+        ('policy', presigned_info["fields"][0]["policy"]),
+        ('signature', presigned_info["fields"][0]["signature"]),
+    ]
+    limiter = get_limiter()
+    if limiter and hasattr(stream, "read"):
+        stream = ThrottledReader(stream, limiter)
+    elif limiter:
+        stream = throttled_chunks(stream, limiter)
+    body = MultipartStream(fields, file_path, stream, content_length)
+
+    s = get_session(max_retry, retry_interval)
+    try:
+        logger.debug("stream to GN Amazon S3 storage:")
+        logger.debug(f"url: {STORAGE_URL}")
+        logger.debug(f"fields: {fields}")
+        logger.debug(f"content length: {content_length}")
+        r = s.post(
+            STORAGE_URL,
+            data=body,
+            headers={"Content-Type": body.content_type},
+            timeout=timeout,
         )
-        s.mount('http://', HTTPAdapter(max_retries=retries))
-        s.mount('https://', HTTPAdapter(max_retries=retries))
-        try:
-            logger.debug("upload to GN Amazon S3 storage:")
-            logger.debug("url: https://geonadir-prod.s3.amazonaws.com/")
-            logger.debug(f"files: {files}")
-            r = s.post(
-                "https://geonadir-prod.s3.amazonaws.com/",
-                files=files,
-                timeout=timeout,
-            )
-            r.raise_for_status()
-            logger.debug(r.text)
-            return r.status_code
-        except Exception as exc:
-            if "r" not in locals():
-                raise Exception(
-                    f"https://geonadir-dev.s3.amazonaws.com/ posting failed: {key}.")
-            raise Exception(str(exc))
+        r.raise_for_status()
+        logger.debug(r.text)
+        return r.status_code
+    except Exception as exc:
+        if "r" not in locals():
+            raise Exception(
+                f"{STORAGE_URL} streaming failed: {key}: {str(exc)}")
+        raise Exception(str(exc))
 
 
 def create_post_image(presigned_info, dataset_id, base_url, token, max_retry=5, retry_interval=10, timeout=60):
@@ -684,15 +1247,7 @@ def create_post_image(presigned_info, dataset_id, base_url, token, max_retry=5,
         'image': (None, key),
     }
 
-    s = requests.Session()
-    retries = Retry(
-        total=max_retry,
-        backoff_factor=retry_interval,
-        raise_on_status=False,
-        status_forcelist=list(range(400, 600))
-    )
-    s.mount('http://', HTTPAdapter(max_retries=retries))
-    s.mount('https://', HTTPAdapter(max_retries=retries))
+    s = get_session(max_retry, retry_interval)
     try:
         logger.debug("create post image:")
         logger.debug(f"url: {base_url}/api/create_post_image/")
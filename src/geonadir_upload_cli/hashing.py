@@ -0,0 +1,81 @@
+"""content hashing of local images in a process pool
+"""
+import concurrent.futures
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+env = os.environ.get("GEONADIR_CLI_ENV", "prod")
+LOG_LEVEL = logging.INFO
+if env != "prod":
+    LOG_LEVEL = logging.DEBUG
+logging.basicConfig(level=LOG_LEVEL)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+HASH_WORKERS = os.cpu_count() or 1
+
+_executor = None
+_lock = threading.Lock()
+
+
+def file_digest(file_path):
+    """sha256 of file content, read in chunks
+
+    Args:
+        file_path (str): local file path.
+
+    Returns:
+        str: hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_hash_executor():
+    """get the process pool shared by all datasets of the run, created on first use.
+    Workers are spawned rather than forked, as the parent runs many upload threads.
+
+    Returns:
+        concurrent.futures.ProcessPoolExecutor: pool of HASH_WORKERS processes.
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def shutdown_hashing():
+    """stop the worker processes of the shared pool, if started
+    """
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor:
+        executor.shutdown()
+
+
+def hash_files(file_paths):
+    """hash files on all cores, in the process pool shared by all datasets of the run.
+
+    Args:
+        file_paths (list): local file paths.
+
+    Returns:
+        dict: file path -> hex digest.
+    """
+    if not file_paths:
+        return {}
+    logger.info(f"hashing {len(file_paths)} images")
+    if HASH_WORKERS == 1 or len(file_paths) == 1:
+        return {file_path: file_digest(file_path) for file_path in file_paths}
+    chunksize = max(len(file_paths) // (HASH_WORKERS * 4), 1)
+    digests = get_hash_executor().map(file_digest, file_paths, chunksize=chunksize)
+    return dict(zip(file_paths, digests))
@@ -0,0 +1,197 @@
+"""persistent on-disk cache of STAC catalog and collection json
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+env = os.environ.get("GEONADIR_CLI_ENV", "prod")
+LOG_LEVEL = logging.INFO
+if env != "prod":
+    LOG_LEVEL = logging.DEBUG
+logging.basicConfig(level=LOG_LEVEL)
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"),
+    "geonadir-upload-cli",
+)
+DEFAULT_CACHE_SIZE = 256  # MB
+MB = 1024 * 1024
+
+_cache = None
+
+
+class HttpCache:
+    """conditional-GET cache of http responses, kept as gzip files on disk.
+
+    A response is stored with its ETag and Last-Modified headers. The next
+    request of the same url sends them back as If-None-Match/If-Modified-Since,
+    and a 304 answer is served from disk. Entries are evicted least recently
+    used first once the cache grows over max_bytes. Safe to share between
+    threads; writes are atomic so concurrent runs don't see partial files.
+    """
+
+    def __init__(self, directory, max_bytes):
+        """
+        Args:
+            directory (str): cache directory. Created if not existing.
+            max_bytes (int): max total size of cached files in bytes.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.directory, key)
+        return base + ".json", base + ".gz"
+
+    def get(self, url, timeout=60):
+        """get response body of url, from cache if unchanged on the server.
+
+        Args:
+            url (str): url.
+            timeout (float, optional): request timeout. Defaults to 60.
+
+        Raises:
+            requests.HTTPError: error response and nothing usable in cache.
+
+        Returns:
+            bytes: response body.
+        """
+        meta_path, body_path = self._paths(url)
+        meta = None
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+        from .session import get_session
+
+        headers = {"Accept-Encoding": "gzip"}
+        if meta and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta and meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        r = get_session().get(url, headers=headers, timeout=timeout)
+        if r.status_code == 304 and meta:
+            try:
+                with gzip.open(body_path, "rb") as f:
+                    content = f.read()
+                os.utime(meta_path)
+                logger.debug(f"{url} not modified, served from cache")
+                return content
+            except OSError:
+                # cached body gone, fetch it again unconditionally
+                r = get_session().get(
+                    url, headers={"Accept-Encoding": "gzip"}, timeout=timeout)
+        r.raise_for_status()
+        content = r.content
+        etag = r.headers.get("ETag")
+        last_modified = r.headers.get("Last-Modified")
+        if etag or last_modified:
+            self._store(url, content, etag, last_modified)
+        return content
+
+    def _store(self, url, content, etag, last_modified):
+        meta_path, body_path = self._paths(url)
+        try:
+            self._write(body_path, gzip.compress(content))
+            self._write(meta_path, json.dumps({
+                "url": url,
+                "etag": etag,
+                "last_modified": last_modified,
+            }).encode("utf-8"))
+        except OSError as exc:
+            logger.warning(f"caching {url} failed: {str(exc)}")
+            return
+        self._evict()
+
+    def _write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.name.endswith(".json"):
+                        continue
+                    body = entry.path[:-len(".json")] + ".gz"
+                    try:
+                        size = entry.stat().st_size + os.path.getsize(body)
+                    except OSError:
+                        size = entry.stat().st_size
+                    # metadata mtime is touched on every hit
+                    entries.append((entry.stat().st_mtime, entry.path, body, size))
+                    total += size
+            if total <= self.max_bytes:
+                return
+            for _, meta_path, body_path, size in sorted(entries):
+                for path in (meta_path, body_path):
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+                total -= size
+                logger.debug(f"evicted {meta_path} from cache")
+                if total <= self.max_bytes:
+                    return
+
+
+def configure_cache(directory=DEFAULT_CACHE_DIR, max_mb=DEFAULT_CACHE_SIZE):
+    """set the http cache used for catalog and collection json.
+
+    Args:
+        directory (str, optional): cache directory. Defaults to DEFAULT_CACHE_DIR.
+        max_mb (int, optional): max cache size in MB, 0 to disable caching. Defaults to DEFAULT_CACHE_SIZE.
+    """
+    global _cache
+    if not max_mb:
+        _cache = None
+        return
+    try:
+        _cache = HttpCache(directory, max_mb * MB)
+    except OSError as exc:
+        logger.warning(f"http cache in {directory} disabled: {str(exc)}")
+        _cache = None
+        return
+    logger.debug(f"http cache: {directory}, up to {max_mb} MB")
+
+
+def fetch(url, timeout=60):
+    """get response body of url, through the http cache if configured.
+
+    Args:
+        url (str): url.
+        timeout (float, optional): request timeout. Defaults to 60.
+
+    Raises:
+        requests.HTTPError: error response.
+
+    Returns:
+        bytes: response body.
+    """
+    if _cache:
+        return _cache.get(url, timeout)
+    from .session import get_session
+
+    r = get_session().get(url, timeout=timeout)
+    r.raise_for_status()
+    return r.content
@@ -0,0 +1,286 @@
+"""local on-disk journal of upload progress for resuming interrupted uploads
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+env = os.environ.get("GEONADIR_CLI_ENV", "prod")
+LOG_LEVEL = logging.INFO
+if env != "prod":
+    LOG_LEVEL = logging.DEBUG
+logging.basicConfig(level=LOG_LEVEL)
+
+JOURNAL_FILENAME = "geonadir-upload-journal.sqlite"
+
+# phases of a single image upload, in order
+PRESIGNED = "presigned"
+STORED = "stored"
+REGISTERED = "registered"
+
+# presigned info older than this is requested again instead of being reused
+PRESIGNED_TTL = 30 * 60
+
+
+class UploadJournal:
+    """sqlite journal recording the phase of each image per dataset.
+
+    Images are identified by their path relative to the image directory, or by
+    asset name for collections. An image is "presigned" once its presigned url is generated, "stored" once it
+    is posted to S3 and "registered" once created in Geonadir. A re-run skips
+    registered images and redoes only the missing phases of the others. The
+    Geonadir dataset created for each dataset name and source is recorded too,
+    so a re-run uploads into the same dataset, as well as the content hash of
+    each registered image for deduplication. Safe to share between threads.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): path of sqlite file. Created if not existing.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS images (
+                    dataset_id TEXT NOT NULL,
+                    image_name TEXT NOT NULL,
+                    phase TEXT NOT NULL,
+                    presigned_info TEXT,
+                    size INTEGER,
+                    updated_at REAL NOT NULL,
+                    presigned_at REAL,
+                    PRIMARY KEY (dataset_id, image_name)
+                )"""
+            )
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(images)")]
+            if "presigned_at" not in columns:
+                # journal of an older version, its presigned info is treated as expired
+                self._conn.execute("ALTER TABLE images ADD COLUMN presigned_at REAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS datasets (
+                    dataset_name TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    dataset_id TEXT NOT NULL,
+                    PRIMARY KEY (dataset_name, source)
+                )"""
+            )
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS hashes (
+                    dataset_id TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    image_name TEXT NOT NULL,
+                    remote_key TEXT,
+                    PRIMARY KEY (dataset_id, digest)
+                )"""
+            )
+        logger.debug(f"upload journal: {path}")
+
+    def get_dataset(self, dataset_name, source):
+        """get id of Geonadir dataset created before for given name and image source.
+
+        Args:
+            dataset_name (str): dataset name.
+            source (str): local image directory or remote collection url.
+
+        Returns:
+            str | None: dataset id, or None if not recorded.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT dataset_id FROM datasets WHERE dataset_name = ? AND source = ?",
+                (dataset_name, source),
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_dataset(self, dataset_name, source, dataset_id):
+        """record Geonadir dataset created for given name and image source.
+
+        Args:
+            dataset_name (str): dataset name.
+            source (str): local image directory or remote collection url.
+            dataset_id (str | int): Geonadir dataset id.
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO datasets VALUES (?, ?, ?)",
+                (dataset_name, source, str(dataset_id)),
+            )
+
+    def get(self, dataset_id, image_name):
+        """get journal entry of single image.
+
+        Args:
+            dataset_id (str | int): Geonadir dataset id.
+            image_name (str): image path relative to image directory, or asset name.
+
+        Returns:
+            dict | None: phase, presigned_info, size, updated_at and presigned_at, or None if not recorded.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT phase, presigned_info, size, updated_at, presigned_at FROM images "
+                "WHERE dataset_id = ? AND image_name = ?",
+                (str(dataset_id), image_name),
+            ).fetchone()
+        if not row:
+            return None
+        return _entry(*row)
+
+    def entries(self, dataset_id):
+        """get journal entries of all images of a dataset.
+
+        Args:
+            dataset_id (str | int): Geonadir dataset id.
+
+        Returns:
+            dict: image name -> entry as returned by get.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT image_name, phase, presigned_info, size, updated_at, presigned_at FROM images "
+                "WHERE dataset_id = ?",
+                (str(dataset_id),),
+            ).fetchall()
+        return {image_name: _entry(*row) for image_name, *row in rows}
+
+    def record(self, dataset_id, image_name, phase, presigned_info=None, size=None):
+        """record phase reached by single image. presigned_info and size are kept
+        from earlier phases if not given.
+
+        Args:
+            dataset_id (str | int): Geonadir dataset id.
+            image_name (str): image path relative to image directory, or asset name.
+            phase (str): one of PRESIGNED, STORED and REGISTERED.
+            presigned_info (dict, optional): presigned info newly generated for the image,
+                whose age is counted from now. Defaults to None.
+            size (int, optional): image size in bytes. Defaults to None.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO images
+                    (dataset_id, image_name, phase, presigned_info, size, updated_at, presigned_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (dataset_id, image_name) DO UPDATE SET
+                    phase = excluded.phase,
+                    presigned_info = COALESCE(excluded.presigned_info, images.presigned_info),
+                    size = COALESCE(excluded.size, images.size),
+                    updated_at = excluded.updated_at,
+                    presigned_at = COALESCE(excluded.presigned_at, images.presigned_at)""",
+                (
+                    str(dataset_id),
+                    image_name,
+                    phase,
+                    json.dumps(presigned_info) if presigned_info else None,
+                    size,
+                    now,
+                    now if presigned_info else None,
+                ),
+            )
+
+    def get_hashes(self, dataset_id):
+        """get content hash index of images registered in a dataset.
+
+        Args:
+            dataset_id (str | int): Geonadir dataset id.
+
+        Returns:
+            dict: hex digest -> remote key (or image name if key unknown).
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT digest, image_name, remote_key FROM hashes WHERE dataset_id = ?",
+                (str(dataset_id),),
+            ).fetchall()
+        return {digest: remote_key or image_name for digest, image_name, remote_key in rows}
+
+    def get_hashed_names(self, dataset_id):
+        """get names of images registered in a dataset with their content hash.
+
+        Args:
+            dataset_id (str | int): Geonadir dataset id.
+
+        Returns:
+            set: image paths relative to image directory, or asset names.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT image_name FROM hashes WHERE dataset_id = ?",
+                (str(dataset_id),),
+            ).fetchall()
+        return {image_name for image_name, in rows}
+
+    def forget(self, dataset_id, image_name):
+        """drop recorded progress of single image, e.g. when a different image took its name.
+        Its content hash is kept, as that content is still in the dataset.
+
+        Args:
+            dataset_id (str | int): Geonadir dataset id.
+            image_name (str): image path relative to image directory, or asset name.
+        """
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM images WHERE dataset_id = ? AND image_name = ?",
+                (str(dataset_id), image_name),
+            )
+
+    def record_hash(self, dataset_id, image_name, digest):
+        """record content hash of image registered in a dataset, along with the
+        remote key from its recorded presigned info.
+
+        Args:
+            dataset_id (str | int): Geonadir dataset id.
+            image_name (str): image path relative to image directory, or asset name.
+            digest (str): hex digest of image content.
+        """
+        entry = self.get(dataset_id, image_name)
+        remote_key = None
+        if entry and entry["presigned_info"]:
+            remote_key = entry["presigned_info"]["fields"][0]["key"]
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)",
+                (str(dataset_id), digest, image_name, remote_key),
+            )
+
+    def close(self):
+        """close the sqlite connection
+        """
+        with self._lock:
+            self._conn.close()
+
+
+def _entry(phase, presigned_info, size, updated_at, presigned_at):
+    return {
+        "phase": phase,
+        "presigned_info": json.loads(presigned_info) if presigned_info else None,
+        "size": size,
+        "updated_at": updated_at,
+        "presigned_at": presigned_at,
+    }
+
+
+def reusable_presigned_info(entry):
+    """get presigned info from journal entry if it was generated recently enough to be reused.
+
+    Args:
+        entry (dict | None): journal entry as returned by UploadJournal.get.
+
+    Returns:
+        dict | None: presigned info, or None if missing or expired.
+    """
+    if not entry or not entry.get("presigned_info"):
+        return None
+    presigned_at = entry.get("presigned_at")
+    if presigned_at is None or time.time() - presigned_at > PRESIGNED_TTL:
+        return None
+    return entry["presigned_info"]
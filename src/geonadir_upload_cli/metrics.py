@@ -0,0 +1,360 @@
+"""live metrics of a run for monitoring, served over http or written to a textfile
+"""
+import collections
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+env = os.environ.get("GEONADIR_CLI_ENV", "prod")
+LOG_LEVEL = logging.INFO
+if env != "prod":
+    LOG_LEVEL = logging.DEBUG
+logging.basicConfig(level=LOG_LEVEL)
+
+METRICS_HOST = "127.0.0.1"
+METRICS_INTERVAL = 15  # sec between textfile rewrites
+# current throughput is averaged over the images done in the last THROUGHPUT_WINDOW seconds
+THROUGHPUT_WINDOW = 60  # sec
+PREFIX = "geonadir_upload"
+# gauges adjusted while the run goes, with their help text
+GAUGES = {
+    "requests_in_flight": "Http requests in progress.",
+    "images_in_flight": "Images being uploaded.",
+    "images_queued": "Images waiting for an upload worker.",
+    "assets_prefetched": "Downloaded assets waiting for an upload worker.",
+    "datasets_queued": "Datasets waiting for a dataset thread.",
+}
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_lock = threading.Lock()
+_started = time.monotonic()
+_datasets = {}
+_gauges = dict.fromkeys(GAUGES, 0)
+_retries = 0
+_recent = collections.deque()
+_server = None
+_writer = None
+_stop = threading.Event()
+
+
+def dataset_started(dataset_id, dataset_name, total=None):
+    """register dataset whose images are about to be uploaded.
+
+    Args:
+        dataset_id (str): Geonadir dataset id.
+        dataset_name (str): dataset name.
+        total (int, optional): number of images to upload, None while unknown. Defaults to None.
+    """
+    with _lock:
+        stats = _datasets.setdefault(
+            (str(dataset_id), dataset_name),
+            {"images_total": None, "images_done": 0, "bytes_done": 0})
+        stats["images_total"] = total
+
+
+def image_done(dataset_id, dataset_name, size):
+    """count image uploaded to dataset.
+
+    Args:
+        dataset_id (str): Geonadir dataset id.
+        dataset_name (str): dataset name.
+        size (int): image size in bytes.
+    """
+    now = time.monotonic()
+    with _lock:
+        stats = _datasets.setdefault(
+            (str(dataset_id), dataset_name),
+            {"images_total": None, "images_done": 0, "bytes_done": 0})
+        stats["images_done"] += 1
+        stats["bytes_done"] += size or 0
+        _recent.append((now, size or 0))
+        _trim(now)
+
+
+def record_retry():
+    """count a failed http request attempt about to be retried
+    """
+    global _retries
+    with _lock:
+        _retries += 1
+
+
+def adjust(name, delta):
+    """change gauge by delta.
+
+    Args:
+        name (str): one of GAUGES.
+        delta (int): change.
+    """
+    with _lock:
+        _gauges[name] += delta
+
+
+@contextlib.contextmanager
+def in_flight(name):
+    """count the enclosed block in gauge while it runs.
+
+    Args:
+        name (str): one of GAUGES.
+    """
+    adjust(name, 1)
+    try:
+        yield
+    finally:
+        adjust(name, -1)
+
+
+def queued(name, func):
+    """count func in gauge until it starts running, e.g. while waiting in an executor queue.
+    The caller takes it off the gauge with adjust(name, -1) if it is cancelled before starting.
+
+    Args:
+        name (str): one of GAUGES.
+        func (callable): function to be queued.
+
+    Returns:
+        callable: func, taken off the gauge when called.
+    """
+    adjust(name, 1)
+
+    def run(*args, **kwargs):
+        adjust(name, -1)
+        return func(*args, **kwargs)
+    return run
+
+
+def metered(task, dataset_id, dataset_name):
+    """count image task in flight while it runs, and its image done once it returns.
+
+    Args:
+        task (callable): image task returning (image_name, response_code, upload_time, file_size, ...) or None if skipped.
+        dataset_id (str): Geonadir dataset id.
+        dataset_name (str): dataset name.
+
+    Returns:
+        callable: task counted in metrics.
+    """
+    def run(item):
+        with in_flight("images_in_flight"):
+            result = task(item)
+        if result is not None:
+            image_done(dataset_id, dataset_name, result[3])
+        return result
+    return run
+
+
+def _trim(now):
+    while _recent and _recent[0][0] < now - THROUGHPUT_WINDOW:
+        _recent.popleft()
+
+
+def snapshot():
+    """get current metrics.
+    sample output:
+    {
+        "elapsed_sec": 120.5,
+        "images_done": 300,
+        "bytes_done": 1500000000,
+        "images_per_sec": 2.5,
+        "bytes_per_sec": 12500000.0,
+        "retries": 4,
+        "requests_in_flight": 12,
+        "images_in_flight": 10,
+        "images_queued": 40,
+        "assets_prefetched": 0,
+        "datasets_queued": 2,
+        "datasets": [
+            {
+                "dataset_id": "3254",
+                "dataset_name": "site_1",
+                "images_total": 500,
+                "images_done": 300,
+                "bytes_done": 1500000000
+            }
+        ]
+    }
+
+    Returns:
+        dict: totals, throughput over the last THROUGHPUT_WINDOW seconds, gauges and progress per dataset.
+    """
+    now = time.monotonic()
+    with _lock:
+        _trim(now)
+        window = min(THROUGHPUT_WINDOW, max(now - _started, 1e-6))
+        datasets = [
+            {"dataset_id": dataset_id, "dataset_name": dataset_name, **stats}
+            for (dataset_id, dataset_name), stats in _datasets.items()
+        ]
+        metrics = {
+            "elapsed_sec": round(now - _started, 3),
+            "images_done": sum(dataset["images_done"] for dataset in datasets),
+            "bytes_done": sum(dataset["bytes_done"] for dataset in datasets),
+            "images_per_sec": round(len(_recent) / window, 3),
+            "bytes_per_sec": round(sum(size for _, size in _recent) / window, 1),
+            "retries": _retries,
+            **_gauges,
+            "datasets": datasets,
+        }
+    return metrics
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render(metrics, openmetrics=True):
+    """format metrics as OpenMetrics text, or as Prometheus text for scrapers and
+    textfile collectors not supporting OpenMetrics.
+
+    Args:
+        metrics (dict): output of snapshot.
+        openmetrics (bool, optional): OpenMetrics if True, Prometheus text format 0.0.4 otherwise. Defaults to True.
+
+    Returns:
+        str: exposition text.
+    """
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        # OpenMetrics names counter families without the _total suffix of their samples
+        family_name = f"{PREFIX}_{name}"
+        if kind == "counter" and not openmetrics:
+            family_name += "_total"
+        lines.append(f"# TYPE {family_name} {kind}")
+        lines.append(f"# HELP {family_name} {help_text}")
+        suffix = "_total" if kind == "counter" else ""
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+            lines.append(f"{PREFIX}_{name}{suffix}{{{label_text}}} {value}" if label_text
+                         else f"{PREFIX}_{name}{suffix} {value}")
+
+    def labels(dataset):
+        return {"dataset_id": dataset["dataset_id"], "dataset_name": dataset["dataset_name"]}
+
+    datasets = metrics["datasets"]
+    family("images", "counter", "Images uploaded.",
+           [(labels(dataset), dataset["images_done"]) for dataset in datasets])
+    family("bytes", "counter", "Bytes of images uploaded.",
+           [(labels(dataset), dataset["bytes_done"]) for dataset in datasets])
+    family("dataset_images", "gauge", "Images to upload in dataset, absent while still listing.",
+           [(labels(dataset), dataset["images_total"]) for dataset in datasets
+            if dataset["images_total"] is not None])
+    family("images_per_second", "gauge", f"Images uploaded per second over the last {THROUGHPUT_WINDOW}s.",
+           [({}, metrics["images_per_sec"])])
+    family("bytes_per_second", "gauge", f"Bytes uploaded per second over the last {THROUGHPUT_WINDOW}s.",
+           [({}, metrics["bytes_per_sec"])])
+    family("retries", "counter", "Failed http request attempts retried.",
+           [({}, metrics["retries"])])
+    for name, help_text in GAUGES.items():
+        family(name, "gauge", help_text, [({}, metrics[name])])
+    if openmetrics:
+        lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path):
+    """atomically replace path with current metrics, so readers never see a partial file.
+    Written as JSON if path ends with .json, as Prometheus text (e.g. for the node
+    exporter textfile collector) otherwise.
+
+    Args:
+        path (str): output file.
+    """
+    metrics = snapshot()
+    if path.endswith(".json"):
+        content = json.dumps(metrics, indent=4)
+    else:
+        content = render(metrics, openmetrics=False)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        logger.debug(f"metrics request: {format % args}")
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            # OpenMetrics if the scraper asks for it, like Prometheus does
+            openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+            body = render(snapshot(), openmetrics).encode("utf-8")
+            content_type = OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE
+        elif path == "/metrics.json":
+            body = json.dumps(snapshot()).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def configure_metrics(port=None, path=None, interval=METRICS_INTERVAL):
+    """start exporting live metrics of the run.
+    Metrics are always collected; this only makes them visible from outside.
+
+    Args:
+        port (int, optional): serve /metrics (OpenMetrics or Prometheus text) and /metrics.json
+            on this local port, 0 for any free port. None to disable. Defaults to None.
+        path (str, optional): rewrite this file every interval seconds. None to disable. Defaults to None.
+        interval (float, optional): seconds between textfile rewrites. Defaults to METRICS_INTERVAL.
+    """
+    global _started, _server, _writer
+    stop_metrics()
+    with _lock:
+        _started = time.monotonic()
+    _stop.clear()
+    if port is not None:
+        _server = ThreadingHTTPServer((METRICS_HOST, port), _MetricsHandler)
+        _server.daemon_threads = True
+        threading.Thread(
+            target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        host, port = _server.server_address
+        logger.info(f"serving metrics on http://{host}:{port}/metrics and /metrics.json")
+    if path:
+        def rewrite():
+            stopped = False
+            while True:
+                try:
+                    write_textfile(path)
+                except OSError as exc:
+                    logger.warning(f"writing metrics to {path} failed: {str(exc)}")
+                if stopped:
+                    return
+                stopped = _stop.wait(interval)
+        _writer = threading.Thread(target=rewrite, name="metrics-writer", daemon=True)
+        _writer.start()
+        logger.info(f"writing metrics to {path} every {interval} sec")
+
+
+def stop_metrics():
+    """stop exporting metrics. The textfile is rewritten a last time with the final numbers.
+    """
+    global _server, _writer
+    _stop.set()
+    if _writer:
+        _writer.join()
+        _writer = None
+    if _server:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
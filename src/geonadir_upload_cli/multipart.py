@@ -0,0 +1,118 @@
+"""streaming multipart/form-data body for S3 POST uploads
+"""
+import binascii
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+env = os.environ.get("GEONADIR_CLI_ENV", "prod")
+LOG_LEVEL = logging.INFO
+if env != "prod":
+    LOG_LEVEL = logging.DEBUG
+logging.basicConfig(level=LOG_LEVEL)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class MultipartStream:
+    """file-like multipart/form-data body which streams its file part in chunks.
+
+    Form fields are written first, followed by the file read from content in
+    chunks of chunk_size bytes, so only about one chunk is held in memory no matter
+    how large the file is. The total length is known up front, so requests sends
+    it with a Content-Length header instead of chunked transfer encoding.
+    """
+
+    def __init__(self, fields, filename, content, content_length, chunk_size=CHUNK_SIZE):
+        """
+        Args:
+            fields (list): (name, value) pairs of form fields sent before the file.
+            filename (str): filename of the file part.
+            content (file-like | iterable): object with read(size), or iterable of bytes chunks.
+            content_length (int): exact number of bytes in content.
+            chunk_size (int, optional): bytes read from content at a time. Defaults to CHUNK_SIZE.
+        """
+        self.boundary = binascii.hexlify(os.urandom(16)).decode("ascii")
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self.content_length = content_length
+        self.chunk_size = chunk_size
+        self._content = content
+
+        head = b""
+        for name, value in fields:
+            head += (
+                f"--{self.boundary}\r\n"
+                f"Content-Disposition: form-data; name=\"{name}\"\r\n\r\n"
+                f"{value}\r\n"
+            ).encode("utf-8")
+        filename = os.path.basename(filename).replace('"', "%22")
+        head += (
+            f"--{self.boundary}\r\n"
+            f"Content-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n\r\n"
+        ).encode("utf-8")
+        self._head = head
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+        self._length = len(self._head) + content_length + len(self._tail)
+        self._chunks = self._generate()
+        self._chunk = b""
+        self._offset = 0
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def read(self, size=-1):
+        """read up to size bytes of the body, or the rest of it if size is negative.
+
+        Args:
+            size (int, optional): max bytes returned. Defaults to -1.
+
+        Returns:
+            bytes: next part of body. Empty once body is exhausted.
+        """
+        parts = []
+        remaining = size
+        while size < 0 or remaining > 0:
+            if self._offset >= len(self._chunk):
+                self._chunk = next(self._chunks, b"")
+                self._offset = 0
+                if not self._chunk:
+                    break
+            end = len(self._chunk) if size < 0 else self._offset + remaining
+            part = self._chunk[self._offset:end]
+            self._offset += len(part)
+            remaining -= len(part)
+            parts.append(part)
+        return b"".join(parts)
+
+    def _generate(self):
+        yield self._head
+        sent = 0
+        for chunk in self._iter_content():
+            sent += len(chunk)
+            if sent > self.content_length:
+                raise Exception(
+                    f"content longer than declared length {self.content_length}")
+            yield chunk
+        if sent != self.content_length:
+            raise Exception(
+                f"content ended after {sent} of {self.content_length} bytes")
+        yield self._tail
+
+    def _iter_content(self):
+        if hasattr(self._content, "read"):
+            while True:
+                chunk = self._content.read(self.chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+        else:
+            for chunk in self._content:
+                if chunk:
+                    yield chunk
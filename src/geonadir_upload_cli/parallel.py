@@ -2,14 +2,11 @@
 """
 import logging
 import os
-import time
 
-import pystac
-
-from .dataset import (create_dataset, paginate_dataset_images,
-                      trigger_ortho_processing, upload_images,
-                      upload_images_from_collection)
-from .util import clickable_link, first_value, original_filename
+from .dataset import (create_dataset, dataset_info, trigger_ortho_processing,
+                      upload_images, upload_images_from_collection)
+from .util import clickable_link, geonadir_filename_trans, load_collection
+from .verify import VERIFY_TIMEOUT, dataset_image_count, wait_for_images
 
 logger = logging.getLogger(__name__)
 env = os.environ.get("GEONADIR_CLI_ENV", "prod")
@@ -31,7 +28,9 @@ def process_thread(
     remote_collection_json,
     max_retry,
     retry_interval,
-    timeout
+    timeout,
+    options=None,
+    collection=None
 ):
     """
     Process a thread for uploading images to a dataset.
@@ -48,6 +47,8 @@ def process_thread(
         max_retry (int): Max retry for uploading single image.
         retry_interval (float): Interval between retries.
         timeout (float): Timeout for uploading single image.
+        options (dict, optional): Tuning options passed down to image uploading, e.g. number of workers.
+        collection (pystac.Collection, optional): Parsed collection. Loaded from remote_collection_json if not given.
     Returns:
         dataset_name (str): Geonadir dataset name.
         result_df (pd.DataFrame): DataFrame containing upload results for each image, or False if error raised before DF generated.
@@ -69,6 +70,31 @@ def process_thread(
     #     "is_private": False
     # }
 
+    if remote_collection_json and collection is None:
+        collection = load_collection(remote_collection_json)
+        if collection is None:
+            return dataset_name, False, "load_collection"
+
+    # resume dataset created by an earlier run according to upload journal
+    journal = (options or {}).get("journal")
+    source = remote_collection_json or os.path.abspath(img_dir)
+    if not dataset_id and journal:
+        dataset_id = journal.get_dataset(dataset_name, source)
+        if dataset_id:
+            try:
+                existing = dataset_info(dataset_id, base_url)
+            except Exception as exc:
+                logger.error(
+                    f"Checking dataset {dataset_id} from journal failed:\n{str(exc)}")
+                return dataset_name, False, "dataset_info"
+            if existing == "Metadata not found":
+                logger.warning(
+                    f"Dataset {dataset_id} in journal {journal.path} not found. Creating new dataset.")
+                dataset_id = None
+            else:
+                logger.info(
+                    f"Resuming dataset {dataset_name} (ID: {dataset_id}) from journal {journal.path}")
+
     # create new dataset if dataset_id not specified
     if not dataset_id:
         payload_data = {
@@ -79,9 +105,6 @@ def process_thread(
 
         # retrieve metadata from STAC collection if applicable
         if remote_collection_json:
-            logger.debug(f"loading STAC collection from {img_dir}")
-            collection = pystac.Collection.from_file(img_dir)
-
             # get citation
             citation = collection.extra_fields.get('sci:citation')
             if citation:
@@ -131,23 +154,32 @@ def process_thread(
         except Exception as exc:
             logger.error(f"Create dataset {dataset_name} failed:\n{str(exc)}")
             return dataset_name, False, "create_dataset"
+        if journal:
+            journal.set_dataset(dataset_name, source, dataset_id)
+        # nothing uploaded yet, no need to list existing images
+        options = dict(options or {}, new_dataset=True)
 
     logger.info(f"Dataset name: {dataset_name}, dataset ID: {dataset_id}")
-    url = f"{base_url}/api/uploadfiles/?page=1&project_id={dataset_id}"
+
+    # verification waits for the image count to grow past the images already in the dataset
+    initial_count = 0
+    if not (options or {}).get("new_dataset"):
+        initial_count = dataset_image_count(dataset_id, base_url)
 
     try:
         # upload from STAC collection
-        if os.path.splitext(img_dir)[1] == ".json":
+        if remote_collection_json:
             result_df = upload_images_from_collection(
                 dataset_name,
                 dataset_id,
-                img_dir,
+                collection,
                 base_url,
                 token,
                 remote_collection_json,
                 max_retry,
                 retry_interval,
-                timeout
+                timeout,
+                options
             )
         else:  # upload local images in img_dir
             result_df = upload_images(
@@ -158,26 +190,32 @@ def process_thread(
                 token,
                 max_retry,
                 retry_interval,
-                timeout
+                timeout,
+                options
             )
     except Exception as exc:
         logger.error(f"Uploading images failed:\n{str(exc)}")
         return dataset_name, None, "upload_images"
+    # release the parsed collection, it can be large and isn't needed for verification
+    collection = None
 
     # get all images uploaded in GN dataset
     try:
-        logger.info("sleep 15s")
-        time.sleep(15)
-        image_names = paginate_dataset_images(url, [])
-        logger.debug(image_names)
-        result_df["Is Image in API?"] = result_df["Image Name"].apply(
-            # get original filename from GN image url
-            lambda x: any(original_filename(name) in x for name in image_names)
+        # join local image names with GN image urls on the filename GN stores
+        gn_names = result_df["Image Name"].map(
+            lambda x: geonadir_filename_trans(os.path.basename(x))
         )
-        result_df["Image URL"] = result_df["Image Name"].apply(
-            lambda x: first_value(name if original_filename(
-                name) in x else None for name in image_names)
+        index = wait_for_images(
+            dataset_id,
+            base_url,
+            gn_names,
+            initial_count,
+            (options or {}).get("verify_timeout", VERIFY_TIMEOUT),
         )
+        logger.debug(index)
+        image_urls = gn_names.map(index)
+        result_df["Is Image in API?"] = image_urls.notna()
+        result_df["Image URL"] = image_urls
     except Exception as exc:
         logger.error(
             f"Retrieving image status for {dataset_name} failed:\n{str(exc)}")
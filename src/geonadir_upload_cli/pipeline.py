@@ -0,0 +1,144 @@
+"""two-stage download/upload pipeline
+"""
+import logging
+import os
+import queue
+import threading
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+env = os.environ.get("GEONADIR_CLI_ENV", "prod")
+LOG_LEVEL = logging.INFO
+if env != "prod":
+    LOG_LEVEL = logging.DEBUG
+logging.basicConfig(level=LOG_LEVEL)
+
+POLL_INTERVAL = 0.5
+
+
+def run_pipeline(
+    items,
+    download,
+    upload,
+    download_workers,
+    upload_workers,
+    queue_size,
+    pbar,
+    discard=None
+):
+    """run download and upload of items in two overlapping stages.
+    Download workers prefetch items into a bounded queue which upload workers drain,
+    so both links are busy at the same time while at most queue_size downloaded
+    items wait for uploading. The first exception raised by any worker stops both
+    stages and is re-raised.
+
+    Args:
+        items (list): items to be processed.
+        download (callable): stage 1, called with each item. Returns downloaded item or None if skipped.
+        upload (callable): stage 2, called with each downloaded item. Returns result.
+        download_workers (int): number of download threads.
+        upload_workers (int): number of upload threads.
+        queue_size (int): max number of downloaded items waiting for upload.
+        pbar (tqdm.tqdm): progress bar updated once per finished or skipped item.
+        discard (callable, optional): called with downloaded items left in queue after an error. Defaults to None.
+
+    Returns:
+        list: non-None results in the same order as items.
+    """
+    pending = queue.Queue()
+    for index, item in enumerate(items):
+        pending.put((index, item))
+    ready = queue.Queue(maxsize=max(queue_size, 1))
+    stop = threading.Event()
+    lock = threading.Lock()
+    results = {}
+    errors = []
+
+    def fail(exc):
+        with lock:
+            errors.append(exc)
+        stop.set()
+
+    def put(entry):
+        # counted before it can be taken, so the gauge never goes negative
+        delta = 0 if entry is None else 1
+        metrics.adjust("assets_prefetched", delta)
+        while not stop.is_set():
+            try:
+                ready.put(entry, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        metrics.adjust("assets_prefetched", -delta)
+        return False
+
+    def downloader():
+        while not stop.is_set():
+            try:
+                index, item = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                downloaded = download(item)
+            except Exception as exc:
+                fail(exc)
+                return
+            if downloaded is None:
+                with lock:
+                    pbar.update(1)
+                continue
+            if not put((index, downloaded)):
+                if discard:
+                    discard(downloaded)
+                return
+
+    def uploader():
+        while not stop.is_set():
+            try:
+                entry = ready.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if entry is None:
+                return
+            metrics.adjust("assets_prefetched", -1)
+            index, downloaded = entry
+            try:
+                result = upload(downloaded)
+            except Exception as exc:
+                fail(exc)
+                return
+            with lock:
+                results[index] = result
+                pbar.update(1)
+
+    logger.debug(
+        f"pipeline with {download_workers} download and {upload_workers} upload workers, "
+        f"prefetching up to {queue_size} items")
+    download_threads = [
+        threading.Thread(target=downloader, daemon=True) for _ in range(max(download_workers, 1))
+    ]
+    upload_threads = [
+        threading.Thread(target=uploader, daemon=True) for _ in range(max(upload_workers, 1))
+    ]
+    for thread in download_threads + upload_threads:
+        thread.start()
+    for thread in download_threads:
+        thread.join()
+    # one end marker per upload worker once everything is downloaded
+    for _ in upload_threads:
+        put(None)
+    for thread in upload_threads:
+        thread.join()
+
+    if errors:
+        while discard:
+            try:
+                entry = ready.get_nowait()
+            except queue.Empty:
+                break
+            if entry is not None:
+                metrics.adjust("assets_prefetched", -1)
+                discard(entry[1])
+        raise errors[0]
+    return [results[index] for index in sorted(results) if results[index] is not None]
@@ -0,0 +1,168 @@
+"""batched presigned url generation
+"""
+import json
+import logging
+import os
+import threading
+
+from .session import get_session
+
+logger = logging.getLogger(__name__)
+env = os.environ.get("GEONADIR_CLI_ENV", "prod")
+LOG_LEVEL = logging.INFO
+if env != "prod":
+    LOG_LEVEL = logging.DEBUG
+logging.basicConfig(level=LOG_LEVEL)
+
+
+def generate_presigned_url_batch(
+    dataset_id,
+    base_url,
+    token,
+    file_paths,
+    max_retry=5,
+    retry_interval=10,
+    timeout=60
+):
+    """generate presigned urls for GN Amazon S3 storage for multiple images in one request.
+    The response is split into one presigned info per image, in the same format as
+    the response of generate_presigned_url for a single image.
+
+    Args:
+        dataset_id (str): dataset_id
+        base_url (str): base_url
+        token (str): token
+        file_paths (list): local file paths
+        max_retry (int, optional): max retry. Defaults to 5.
+        retry_interval (int, optional): retry interval in second. Defaults to 10.
+        timeout (int, optional): timeout in second. Defaults to 60.
+
+    Raises:
+        Exception: request failed or number of presigned fields doesn't match number of images.
+
+    Returns:
+        list: presigned info (dict) for each file path.
+    """
+    headers = {
+        'Content-Type': 'application/json',
+        'Authorization': token,
+    }
+
+    json_data = {
+        'dataset_id': str(dataset_id),
+        'images': [os.path.basename(file_path) for file_path in file_paths],
+    }
+    s = get_session(max_retry, retry_interval)
+    try:
+        logger.debug("generate presigned url batch:")
+        logger.debug(f"url: {base_url}/api/generate_presigned_url/")
+        logger.debug(f"headers: {headers}")
+        logger.debug(f"json: {json_data}")
+        r = s.post(
+            f"{base_url}/api/generate_presigned_url/",
+            headers=headers,
+            json=json_data,
+            timeout=timeout,
+        )
+        r.raise_for_status()
+        logger.debug(r.text)
+        response_json = r.json()
+    except Exception as exc:
+        if "r" not in locals():
+            raise Exception(
+                f"failed to generate presigned url: {json.dumps(json_data, indent=4)}.")
+        raise Exception(str(exc))
+
+    fields = response_json.get("fields", [])
+    if len(fields) != len(file_paths):
+        raise Exception(
+            f"{len(fields)} presigned fields returned for {len(file_paths)} images.")
+    presigned_info = {k: v for k, v in response_json.items() if k != "fields"}
+    return [dict(presigned_info, fields=[field]) for field in fields]
+
+
+class PresignedUrlBatcher:
+    """hand out presigned info to upload workers, requesting it in batches.
+
+    A batch is requested by the first worker asking for one of its images, so
+    presigned urls are fresh when used. Once the server rejects a batch, all
+    remaining images fall back to single-file requests (get returns None).
+    """
+
+    def __init__(
+        self,
+        dataset_id,
+        base_url,
+        token,
+        file_paths,
+        batch_size,
+        max_retry=5,
+        retry_interval=10,
+        timeout=60
+    ):
+        """
+        Args:
+            dataset_id (str): dataset_id
+            base_url (str): base_url
+            token (str): token
+            file_paths (list): image paths relative to image directory, or asset names, in the order
+                they are going to be uploaded. Only their file names are sent to Geonadir.
+            batch_size (int): number of images per presigned url request.
+            max_retry (int, optional): max retry. Defaults to 5.
+            retry_interval (int, optional): retry interval in second. Defaults to 10.
+            timeout (int, optional): timeout in second. Defaults to 60.
+        """
+        self.dataset_id = dataset_id
+        self.base_url = base_url
+        self.token = token
+        self.max_retry = max_retry
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        self.rejected = False
+        self._batches = [
+            file_paths[i:i + batch_size] for i in range(0, len(file_paths), batch_size)
+        ]
+        self._batch_index = {
+            file_path: index
+            for index, batch in enumerate(self._batches)
+            for file_path in batch
+        }
+        self._locks = [threading.Lock() for _ in self._batches]
+        self._presigned = {}
+
+    def get(self, file_path):
+        """get presigned info of given file, requesting its whole batch if not yet done.
+
+        Args:
+            file_path (str): image path relative to image directory, or asset name, as given to the batcher.
+
+        Returns:
+            dict | None: presigned info, or None if image should be presigned on its own.
+        """
+        index = self._batch_index.get(file_path)
+        if index is None:
+            return None
+        with self._locks[index]:
+            if index not in self._presigned:
+                self._presigned[index] = self._request(self._batches[index])
+            return self._presigned[index].pop(file_path, None)
+
+    def _request(self, batch):
+        if self.rejected:
+            return {}
+        try:
+            presigned_info = generate_presigned_url_batch(
+                self.dataset_id,
+                self.base_url,
+                self.token,
+                batch,
+                self.max_retry,
+                self.retry_interval,
+                self.timeout,
+            )
+        except Exception as exc:
+            self.rejected = True
+            logger.warning(
+                f"Batched presigned url request rejected, falling back to single image requests: {str(exc)}")
+            return {}
+        return dict(zip(batch, presigned_info))
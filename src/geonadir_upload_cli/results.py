@@ -0,0 +1,152 @@
+"""compact accumulator of per-image upload results
+"""
+import logging
+import os
+import threading
+
+from .adaptive import percentile
+from .timing import PHASES
+
+logger = logging.getLogger(__name__)
+env = os.environ.get("GEONADIR_CLI_ENV", "prod")
+LOG_LEVEL = logging.INFO
+if env != "prod":
+    LOG_LEVEL = logging.DEBUG
+logging.basicConfig(level=LOG_LEVEL)
+
+PHASE_COLUMNS = {
+    "download": "Download Time",
+    "presign": "Presign Time",
+    "storage": "Storage Time",
+    "register": "Register Time",
+}
+RESULT_COLUMNS = [
+    "Project ID",
+    "Dataset Name",
+    "Image Name",
+    "Response Code",
+    "Upload Time",
+    "Image Size",
+    *PHASE_COLUMNS.values(),
+    "Retries",
+]
+MB = 1000 * 1000
+
+
+class UploadResults:
+    """append-only upload results of a dataset, kept as one list per column.
+    Converted to a DataFrame only when needed for output, which also works
+    when no image was uploaded at all.
+    """
+
+    __slots__ = ("dataset_id", "dataset_name", "_image_names", "_response_codes",
+                 "_upload_times", "_image_sizes", "_phase_times", "_retries", "_lock")
+
+    def __init__(self, dataset_id, dataset_name):
+        """
+        Args:
+            dataset_id (str): ID of the dataset.
+            dataset_name (str): Name of the dataset.
+        """
+        self.dataset_id = dataset_id
+        self.dataset_name = dataset_name
+        self._image_names = []
+        self._response_codes = []
+        self._upload_times = []
+        self._image_sizes = []
+        self._phase_times = {name: [] for name in PHASES}
+        self._retries = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._image_names)
+
+    def add(self, image_name, response_code, upload_time, image_size, timer=None):
+        """record result of single image. Safe to call from multiple threads.
+
+        Args:
+            image_name (str): image name.
+            response_code (int): http response code for creating image in GN.
+            upload_time (float): upload time in second.
+            image_size (int): image size in bytes.
+            timer (timing.PhaseTimer, optional): phase durations and retries of the image. Defaults to None.
+        """
+        with self._lock:
+            self._image_names.append(image_name)
+            self._response_codes.append(response_code)
+            self._upload_times.append(upload_time)
+            self._image_sizes.append(image_size)
+            for name in PHASES:
+                self._phase_times[name].append(timer.duration(name) if timer else None)
+            self._retries.append(timer.retries if timer else None)
+
+    def extend(self, rows):
+        """record results of multiple images.
+
+        Args:
+            rows (iterable): (image_name, response_code, upload_time, image_size[, timer]) of each image.
+        """
+        for row in rows:
+            self.add(*row)
+
+    def to_dataframe(self):
+        """build result DataFrame.
+
+        Returns:
+            pd.DataFrame: one row per image with RESULT_COLUMNS, possibly empty.
+        """
+        import pandas as pd
+
+        with self._lock:
+            count = len(self._image_names)
+            return pd.DataFrame(
+                {
+                    "Project ID": [self.dataset_id] * count,
+                    "Dataset Name": [self.dataset_name] * count,
+                    "Image Name": list(self._image_names),
+                    "Response Code": list(self._response_codes),
+                    "Upload Time": list(self._upload_times),
+                    "Image Size": list(self._image_sizes),
+                    **{column: list(self._phase_times[name])
+                       for name, column in PHASE_COLUMNS.items()},
+                    "Retries": list(self._retries),
+                },
+                columns=RESULT_COLUMNS,
+            )
+
+
+def log_run_summary(results, elapsed):
+    """log throughput of the run, and percentiles and share of time of each upload phase,
+    to tell whether Geonadir api or storage is the bottleneck.
+
+    Args:
+        results (list): (dataset_name, result DataFrame or None/False if not available, error) of each dataset.
+        elapsed (float): wall time of the run in second.
+    """
+    import pandas as pd
+
+    # datasets failing before uploading have no DataFrame
+    frames = [df for _, df, _ in results if isinstance(df, pd.DataFrame) and len(df)]
+    if not frames:
+        return
+    images = sum(len(df) for df in frames)
+    size = sum(df["Image Size"].sum() for df in frames)
+    elapsed = max(elapsed, 1e-6)
+    logger.info(
+        f"{images} images, {size / MB:.1f} MB in {elapsed:.1f}s: "
+        f"{images / elapsed:.2f} images/s, {size / MB / elapsed:.2f} MB/s")
+    durations = {
+        name: [value for df in frames for value in df[column].dropna().tolist()]
+        for name, column in PHASE_COLUMNS.items()
+    }
+    total = sum(sum(values) for values in durations.values()) or 1e-6
+    for name, values in durations.items():
+        if not values:
+            continue
+        logger.info(
+            f"{name:>8}: p50 {percentile(values, 50):.2f}s, p95 {percentile(values, 95):.2f}s, "
+            f"p99 {percentile(values, 99):.2f}s, {100 * sum(values) / total:.0f}% of image time")
+    retries = [value for df in frames for value in df["Retries"].dropna().tolist()]
+    if retries:
+        logger.info(
+            f"retries: {int(sum(retries))} in total, {sum(1 for value in retries if value)} images retried")
@@ -0,0 +1,97 @@
+"""global scheduler of image tasks across datasets
+"""
+import concurrent.futures
+import logging
+import os
+import time
+
+from . import metrics
+from .session import set_retry_observer
+
+logger = logging.getLogger(__name__)
+env = os.environ.get("GEONADIR_CLI_ENV", "prod")
+LOG_LEVEL = logging.INFO
+if env != "prod":
+    LOG_LEVEL = logging.DEBUG
+logging.basicConfig(level=LOG_LEVEL)
+
+
+class ImageScheduler:
+    """single work queue for the images of all datasets of a run.
+
+    Every dataset thread submits its image tasks to the same bounded thread pool,
+    so the concurrency budget is shared by the whole run instead of being split
+    per dataset: workers pick up images of any dataset until the last image of the
+    run is done, no matter how unevenly images are spread over datasets.
+    """
+
+    def __init__(self, workers, controller=None):
+        """
+        Args:
+            workers (int): max number of image tasks running at the same time across all datasets.
+            controller (adaptive.AdaptiveConcurrency, optional): adjusts the number of image tasks
+                running at the same time up to its maximum, instead of the fixed workers. Defaults to None.
+        """
+        self.controller = controller
+        self.workers = controller.maximum if controller else workers
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="image")
+        if controller:
+            set_retry_observer(controller.on_retry)
+        logger.debug(f"global image scheduler with {self.workers} workers")
+
+    def run(self, task, items, pbar):
+        """queue task for each item and wait for all of them.
+        The first exception raised by any task cancels the pending tasks of
+        these items (other datasets are not affected) and is re-raised.
+
+        Args:
+            task (callable): function called with each item. Returns a result or None if skipped.
+            items (iterable): items to be processed. Tasks are queued while items are still being generated.
+            pbar (tqdm.tqdm): progress bar updated once per finished item.
+
+        Returns:
+            list: non-None results in the same order as items.
+        """
+        if self.controller:
+            task = self._controlled(task)
+        futures = [
+            self._executor.submit(metrics.queued("images_queued", task), item) for item in items
+        ]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+                pbar.update(1)
+        except Exception as exc:
+            for future in futures:
+                if future.cancel():
+                    metrics.adjust("images_queued", -1)
+            raise exc
+        results = []
+        for future in futures:
+            result = future.result()
+            if result is not None:
+                results.append(result)
+        return results
+
+    def _controlled(self, task):
+        def run_task(item):
+            self.controller.acquire()
+            latency = None
+            start_time = time.monotonic()
+            try:
+                result = task(item)
+                if result is not None:
+                    latency = time.monotonic() - start_time
+                return result
+            finally:
+                self.controller.release(latency)
+        return run_task
+
+    def shutdown(self):
+        """stop the worker threads once all queued tasks are done
+        """
+        self._executor.shutdown(wait=True)
+        if self.controller:
+            set_retry_observer(None)
+            self.controller.log_history()
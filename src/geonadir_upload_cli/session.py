@@ -0,0 +1,182 @@
+"""shared http sessions with pooled keep-alive connections
+"""
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter, Retry
+
+from . import metrics
+from .timing import count_retry
+
+logger = logging.getLogger(__name__)
+env = os.environ.get("GEONADIR_CLI_ENV", "prod")
+LOG_LEVEL = logging.INFO
+if env != "prod":
+    LOG_LEVEL = logging.DEBUG
+logging.basicConfig(level=LOG_LEVEL)
+
+DEFAULT_POOL_SIZE = 10
+
+_pool_size = DEFAULT_POOL_SIZE
+_sessions = {}
+_lock = threading.Lock()
+_retry_observer = None
+
+
+def _observe(status, error):
+    observer = _retry_observer
+    if observer:
+        observer(status, error)
+
+
+class ObservedRetry(Retry):
+    """Retry which reports every failed attempt it retries to the registered retry
+    observer and to the timer of the current image, so throttling and timeouts
+    absorbed by retries are still visible to the caller.
+    """
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        # raises once retries are exhausted, so only attempts actually retried are counted
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        count_retry()
+        metrics.record_retry()
+        _observe(response.status if response is not None else None, error)
+        return retry
+
+
+class MeteredAdapter(HTTPAdapter):
+    """HTTPAdapter counting requests in flight, from sending until the response
+    headers (or final error) are received, retries included.
+
+    The final attempt is reported to the retry observer if it failed: urllib3
+    doesn't retry error statuses of POST requests (presigned urls, storage and
+    image registration), nor attempts once retries are exhausted, so ObservedRetry
+    never sees them.
+    """
+
+    def send(self, request, **kwargs):
+        with metrics.in_flight("requests_in_flight"):
+            try:
+                response = super().send(request, **kwargs)
+            except Exception as exc:
+                _observe(None, exc)
+                raise exc
+        if response.status_code >= 400:
+            _observe(response.status_code, None)
+        return response
+
+
+def set_retry_observer(observer):
+    """register function called once on every failed attempt of requests sent with shared sessions,
+    whether retried or not.
+
+    Args:
+        observer (callable | None): called with response status (None if no response)
+            and exception (None if response received). None to unregister.
+    """
+    global _retry_observer
+    _retry_observer = observer
+
+
+def configure_pool(pool_size):
+    """set the number of keep-alive connections kept per host.
+    Sessions created with a different pool size are closed and recreated on next use.
+
+    Args:
+        pool_size (int): max connections kept open per host.
+    """
+    global _pool_size
+    pool_size = max(int(pool_size), DEFAULT_POOL_SIZE)
+    with _lock:
+        if pool_size == _pool_size:
+            return
+        logger.debug(f"connection pool size per host: {pool_size}")
+        _pool_size = pool_size
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def get_session(max_retry=0, retry_interval=0):
+    """get the shared session for given retry strategy.
+    The session is created once and reused by all threads, so connections to
+    Geonadir api and S3 are kept alive across images.
+
+    Args:
+        max_retry (int, optional): max retry. Defaults to 0.
+        retry_interval (int, optional): retry interval (backoff factor) in second. Defaults to 0.
+
+    Returns:
+        requests.Session: shared session
+    """
+    key = (max_retry, retry_interval)
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            retries = ObservedRetry(
+                total=max_retry,
+                backoff_factor=retry_interval,
+                raise_on_status=False,
+                status_forcelist=list(range(400, 600))
+            )
+            adapter = MeteredAdapter(
+                pool_connections=_pool_size,
+                pool_maxsize=_pool_size,
+                max_retries=retries,
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[key] = session
+    return session
+
+
+def pool_stats():
+    """count requests and newly opened connections per host over all shared sessions.
+    sample output:
+    {
+        "https://api.geonadir.com": {
+            "requests": 300,
+            "hits": 290,
+            "misses": 10
+        }
+    }
+
+    Returns:
+        dict: pool hits (requests on reused connections) and misses (new connections) per host.
+    """
+    stats = {}
+    with _lock:
+        sessions = list(_sessions.values())
+    for session in sessions:
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for pool_key in pools.keys():
+                try:
+                    pool = pools[pool_key]
+                except KeyError:
+                    continue
+                host = f"{pool.scheme}://{pool.host}"
+                if pool.port and pool.port not in (80, 443):
+                    host += f":{pool.port}"
+                host_stats = stats.setdefault(
+                    host, {"requests": 0, "hits": 0, "misses": 0})
+                host_stats["requests"] += pool.num_requests
+                host_stats["misses"] += pool.num_connections
+                host_stats["hits"] += max(pool.num_requests -
+                                          pool.num_connections, 0)
+    return stats
+
+
+def log_pool_stats():
+    """log connection pool hit/miss counts per host
+    """
+    for host, host_stats in pool_stats().items():
+        requests_count = host_stats["requests"]
+        hit_rate = host_stats["hits"] / requests_count if requests_count else 0
+        logger.info(
+            f"connection pool {host}: {requests_count} requests, "
+            f"{host_stats['hits']} hits, {host_stats['misses']} misses "
+            f"({hit_rate:.0%} keep-alive reuse)")
@@ -0,0 +1,203 @@
+"""token bucket bandwidth limiter with time-of-day schedule
+"""
+import datetime
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+env = os.environ.get("GEONADIR_CLI_ENV", "prod")
+LOG_LEVEL = logging.INFO
+if env != "prod":
+    LOG_LEVEL = logging.DEBUG
+logging.basicConfig(level=LOG_LEVEL)
+
+MB = 1000 * 1000
+# bytes passed through the limiter at a time, small enough for smooth pacing
+THROTTLE_CHUNK_SIZE = 64 * 1024
+# seconds of traffic allowed in a burst after the link was idle
+BURST_SECONDS = 0.25
+UNLIMITED = "unlimited"
+
+_limiter = None
+
+
+def parse_schedule(entries):
+    """parse time-of-day bandwidth limits.
+
+    Args:
+        entries (iterable): strings like "19:00-07:00=unlimited" or "09:00-17:00=5".
+            Rate is in MB/s or "unlimited". Windows may wrap around midnight.
+
+    Raises:
+        Exception: malformed entry.
+
+    Returns:
+        list: (start, end, rate) with start/end as datetime.time and rate in bytes/s (None if unlimited).
+    """
+    schedule = []
+    for entry in entries:
+        try:
+            window, rate = entry.split("=")
+            start, end = window.split("-")
+            start = datetime.time.fromisoformat(start.strip())
+            end = datetime.time.fromisoformat(end.strip())
+            rate = rate.strip().lower()
+            rate = None if rate == UNLIMITED else float(rate) * MB
+        except Exception as exc:
+            raise Exception(
+                f"invalid bandwidth schedule {entry}, expected e.g. 19:00-07:00=unlimited or 09:00-17:00=5") from exc
+        if rate is not None and rate <= 0:
+            raise Exception(f"invalid bandwidth schedule {entry}, rate must be positive")
+        schedule.append((start, end, rate))
+    return schedule
+
+
+class BandwidthLimiter:
+    """token bucket shared by all transfers of the run.
+
+    Tokens (bytes) are added continuously at the rate in force and capped at
+    BURST_SECONDS worth of traffic. Each chunk takes its tokens straight away
+    and the caller sleeps just long enough to pay off any debt, so transfers
+    are paced evenly instead of running flat out and then pausing. The rate in
+    force is the one of the first schedule window containing the local time of
+    day, otherwise the default limit.
+    """
+
+    def __init__(self, limit=None, schedule=None):
+        """
+        Args:
+            limit (float, optional): default rate in bytes/s, None for unlimited. Defaults to None.
+            schedule (list, optional): (start, end, rate) as returned by parse_schedule. Defaults to None.
+        """
+        self.limit = limit
+        self.schedule = schedule or []
+        self._lock = threading.Lock()
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self._rate = None
+
+    def rate_at(self, moment):
+        """get rate in force at given time of day.
+
+        Args:
+            moment (datetime.time): time of day.
+
+        Returns:
+            float | None: rate in bytes/s, None if unlimited.
+        """
+        for start, end, rate in self.schedule:
+            if start <= end:
+                inside = start <= moment < end
+            else:
+                inside = moment >= start or moment < end
+            if inside:
+                return rate
+        return self.limit
+
+    def throttle(self, nbytes):
+        """take tokens for nbytes, sleeping if the bucket runs into debt.
+
+        Args:
+            nbytes (int): bytes about to be sent or just received.
+        """
+        wait = self.reserve(nbytes)
+        if wait:
+            time.sleep(wait)
+
+    def reserve(self, nbytes):
+        """take tokens for nbytes without sleeping, e.g. for callers on an event loop.
+
+        Args:
+            nbytes (int): bytes about to be sent or just received.
+
+        Returns:
+            float: seconds the caller has to wait to pay off the debt of the bucket.
+        """
+        rate = self.rate_at(datetime.datetime.now().time())
+        with self._lock:
+            now = time.monotonic()
+            if rate != self._rate:
+                logger.info(
+                    f"bandwidth limit: {'unlimited' if rate is None else f'{rate / MB:g} MB/s'}")
+                self._rate = rate
+                self._tokens = 0.0
+            elif rate is not None:
+                self._tokens = min(
+                    self._tokens + (now - self._last) * rate, rate * BURST_SECONDS)
+            self._last = now
+            if rate is None:
+                return 0
+            self._tokens -= nbytes
+            return -self._tokens / rate if self._tokens < 0 else 0
+
+
+class ThrottledReader:
+    """file-like wrapper reading through a bandwidth limiter
+    """
+
+    def __init__(self, content, limiter):
+        """
+        Args:
+            content (file-like): object with read(size).
+            limiter (BandwidthLimiter): limiter to read through.
+        """
+        self._content = content
+        self._limiter = limiter
+
+    def read(self, size=-1):
+        """read up to size bytes, at most THROTTLE_CHUNK_SIZE at a time.
+
+        Args:
+            size (int, optional): max bytes returned. Defaults to -1.
+
+        Returns:
+            bytes: content read.
+        """
+        if size is None or size < 0 or size > THROTTLE_CHUNK_SIZE:
+            size = THROTTLE_CHUNK_SIZE
+        chunk = self._content.read(size)
+        if chunk:
+            self._limiter.throttle(len(chunk))
+        return chunk
+
+
+def throttled_chunks(chunks, limiter):
+    """pass chunks through a bandwidth limiter
+
+    Args:
+        chunks (iterable): bytes chunks.
+        limiter (BandwidthLimiter): limiter to pass through.
+
+    Yields:
+        bytes: same chunks.
+    """
+    for chunk in chunks:
+        limiter.throttle(len(chunk))
+        yield chunk
+
+
+def configure_bandwidth(limit=None, schedule=None):
+    """set the bandwidth limiter shared by uploads to storage and asset downloads.
+
+    Args:
+        limit (float, optional): default limit in MB/s, None for unlimited. Defaults to None.
+        schedule (iterable, optional): time-of-day limits as accepted by parse_schedule. Defaults to None.
+    """
+    global _limiter
+    schedule = parse_schedule(schedule or [])
+    if limit is None and all(rate is None for _, _, rate in schedule):
+        _limiter = None
+        return
+    _limiter = BandwidthLimiter(limit * MB if limit else None, schedule)
+    logger.debug(f"bandwidth limit {limit} MB/s, schedule {schedule}")
+
+
+def get_limiter():
+    """get the shared bandwidth limiter
+
+    Returns:
+        BandwidthLimiter | None: limiter, or None if bandwidth is unlimited.
+    """
+    return _limiter
@@ -0,0 +1,83 @@
+"""per-image timing of upload phases
+"""
+import contextlib
+import contextvars
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+env = os.environ.get("GEONADIR_CLI_ENV", "prod")
+LOG_LEVEL = logging.INFO
+if env != "prod":
+    LOG_LEVEL = logging.DEBUG
+logging.basicConfig(level=LOG_LEVEL)
+
+PHASES = ("download", "presign", "storage", "register")
+
+_current = contextvars.ContextVar("phase_timer", default=None)
+
+
+class PhaseTimer:
+    """durations of the upload phases of a single image, and number of failed
+    attempts retried on its behalf.
+
+    The timer is made current with activate while the image is processed, so
+    phases timed and retries counted deep inside upload functions, shared
+    sessions or the async engine are attributed to the right image. A phase
+    entered more than once, e.g. after the journal sent the image back to
+    registering, adds up.
+    """
+
+    __slots__ = ("durations", "retries")
+
+    def __init__(self):
+        self.durations = {}
+        self.retries = 0
+
+    @contextlib.contextmanager
+    def activate(self):
+        """make this the timer of the current thread or asyncio task
+        """
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def duration(self, name):
+        """get time spent in a phase.
+
+        Args:
+            name (str): one of PHASES.
+
+        Returns:
+            float | None: seconds, or None if the image didn't go through the phase.
+        """
+        return self.durations.get(name)
+
+
+@contextlib.contextmanager
+def phase(name):
+    """time the enclosed block as a phase of the current image, if there is a current timer.
+
+    Args:
+        name (str): one of PHASES.
+    """
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.durations[name] = timer.durations.get(name, 0.0) + time.perf_counter() - start
+
+
+def count_retry():
+    """count a failed attempt about to be retried for the current image, if there is a current timer.
+    """
+    timer = _current.get()
+    if timer is not None:
+        timer.retries += 1
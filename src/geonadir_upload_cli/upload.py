@@ -5,12 +5,23 @@ import json
 import logging
 import os
 import re
-import tempfile
+import time
 
+from .adaptive import MAX_ADAPTIVE_WORKERS, AdaptiveConcurrency
+from .async_upload import check_async_engine
 from .dataset import dataset_info
+from .hashing import shutdown_hashing
+from .httpcache import DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE, configure_cache
+from .journal import JOURNAL_FILENAME, UploadJournal
+from .metrics import configure_metrics, queued, stop_metrics
 from .parallel import process_thread
-from .util import (deal_with_collection, download_to_dir,
-                   generate_four_timestamps, really_get_all_collections)
+from .results import log_run_summary
+from .scheduler import ImageScheduler
+from .session import configure_pool, log_pool_stats
+from .throttle import configure_bandwidth
+from .util import (crawl_catalog, filter_collections,
+                   generate_four_timestamps)
+from .verify import VERIFY_TIMEOUT
 
 logger = logging.getLogger(__name__)
 env = os.environ.get("GEONADIR_CLI_ENV", "prod")
@@ -19,25 +30,56 @@ if env != "prod":
     LOG_LEVEL = logging.DEBUG
 logging.basicConfig(level=LOG_LEVEL)
 
+MAX_DATASET_THREADS = 5
+# datasets set up and verified at the same time when their images share the global scheduler
+MAX_SCHEDULED_DATASETS = 20
+
+
+def create_scheduler(workers, scheduled, adaptive, max_workers):
+    """create global image scheduler of the run
+
+    Args:
+        workers (int): concurrent image uploads per dataset thread, as given by --workers.
+        scheduled (bool): whether images of all datasets share the global scheduler.
+        adaptive (bool): whether the number of concurrent image uploads is adjusted by AIMD controller.
+        max_workers (int): max concurrent image uploads when adaptive.
+
+    Returns:
+        ImageScheduler | None: scheduler, or None if not scheduled.
+    """
+    if not scheduled:
+        return None
+    if adaptive:
+        return ImageScheduler(
+            max_workers,
+            AdaptiveConcurrency(MAX_DATASET_THREADS * workers, max_workers),
+        )
+    return ImageScheduler(MAX_DATASET_THREADS * workers)
+
 
 def upload_from_catalog(**kwargs):
     """recursively retrieve all collections and upload dataset from each
     """
     catalog_url = kwargs.get("item")
+    configure_pool(MAX_DATASET_THREADS * kwargs.get("workers", 1))
+    configure_cache(
+        kwargs.get("cache_dir", DEFAULT_CACHE_DIR),
+        kwargs.get("cache_size", DEFAULT_CACHE_SIZE),
+    )
     logger.debug(f"catalog url: {catalog_url}")
-    with tempfile.TemporaryDirectory() as tmpdir:
-        collections_list = []
+
+    def crawled():
         try:
-            for collection_url in really_get_all_collections(catalog_url, tmpdir):
-                collections_list.append(("=", collection_url))
+            for collection_url in crawl_catalog(catalog_url):
+                logger.debug(f"collection found: {collection_url}")
+                yield "=", collection_url
         except Exception as exc:
             logger.error(
                 f"Error when retrieving collections from remote catalog: \n{str(exc)}")
-            return
-        logger.debug(f"collections_list: {collections_list}")
-        kwargs["item"] = collections_list
-        upload_from_collection(**kwargs)
-        logger.info(f"cleanup {tmpdir}")
+
+    # collections are uploaded as the crawl finds them
+    kwargs["item"] = crawled()
+    upload_from_collection(**kwargs)
 
 
 def normal_upload(**kwargs):
@@ -55,6 +97,34 @@ def normal_upload(**kwargs):
     retry_interval = kwargs.get("retry_interval")
     timeout = kwargs.get("timeout")
     dataset_id = kwargs.get("dataset_id")
+    workers = kwargs.get("workers", 1)
+    presign_batch_size = kwargs.get("presign_batch_size", 1)
+    verify_timeout = kwargs.get("verify_timeout", VERIFY_TIMEOUT)
+    adaptive = kwargs.get("adaptive", False)
+    max_workers = kwargs.get("max_workers", MAX_ADAPTIVE_WORKERS)
+    bandwidth_limit = kwargs.get("bandwidth_limit")
+    bandwidth_schedule = kwargs.get("bandwidth_schedule", [])
+    engine = kwargs.get("engine", "thread")
+    if engine == "async":
+        check_async_engine()
+    journal_path = kwargs.get("journal")
+    dedup = kwargs.get("dedup", False)
+    recursive = kwargs.get("recursive", False)
+    metrics_port = kwargs.get("metrics_port")
+    metrics_file = kwargs.get("metrics_file")
+    if dedup and not journal_path:
+        logger.info("--dedup keeps its hash index in upload journal. Journal enabled.")
+        journal_path = JOURNAL_FILENAME
+    if journal_path == JOURNAL_FILENAME:
+        journal_path = os.path.join(
+            kwargs.get("output_folder") or os.getcwd(), JOURNAL_FILENAME)
+    # images of all datasets share one budget, except on the async engine
+    scheduled = engine == "thread"
+    if adaptive and not scheduled:
+        logger.warning("--adaptive only applies to the thread engine. Ignored.")
+        adaptive = False
+    configure_pool(max_workers if adaptive else MAX_DATASET_THREADS * workers)
+    configure_bandwidth(bandwidth_limit, bandwidth_schedule)
     existing_dataset_name = ""
     if dataset_id:
         logger.debug(f"searching for metadata of dataset {dataset_id}")
@@ -79,6 +149,26 @@ def normal_upload(**kwargs):
         logger.info(f"max_retry: {max_retry} times")
         logger.info(f"retry_interval: {retry_interval} sec")
         logger.info(f"timeout: {timeout} sec")
+        logger.info(f"engine: {engine}")
+        logger.info(f"journal: {journal_path}")
+        logger.info(f"dedup: {dedup}")
+        logger.info(f"recursive: {recursive}")
+        if adaptive:
+            logger.info(
+                f"workers: adaptive from {MAX_DATASET_THREADS * workers} up to {max_workers} shared by all datasets")
+        elif scheduled:
+            logger.info(
+                f"workers: {MAX_DATASET_THREADS * workers} shared by all datasets")
+        else:
+            logger.info(f"workers: {workers} per dataset")
+        logger.info(f"presign_batch_size: {presign_batch_size} images")
+        logger.info(f"verify_timeout: {verify_timeout} sec")
+        logger.info(
+            f"bandwidth_limit: {f'{bandwidth_limit} MB/s' if bandwidth_limit else 'unlimited'}")
+        if bandwidth_schedule:
+            logger.info(f"bandwidth_schedule: {', '.join(bandwidth_schedule)}")
+        logger.info(f"metrics_port: {metrics_port}")
+        logger.info(f"metrics_file: {metrics_file}")
         for count, i in enumerate(item):
             logger.info(f"--item {count + 1}:")
             dataset_name, image_location = i
@@ -110,6 +200,16 @@ def normal_upload(**kwargs):
         with open(metadata_json) as f:
             metadata = json.load(f)
         logger.info(f"metadata: {metadata_json}")
+    options = {
+        "workers": workers,
+        "engine": engine,
+        "journal": UploadJournal(journal_path) if journal_path else None,
+        "presign_batch_size": presign_batch_size,
+        "verify_timeout": verify_timeout,
+        "dedup": dedup,
+        "recursive": recursive,
+        "scheduler": create_scheduler(workers, scheduled, adaptive, max_workers),
+    }
     dataset_details = []
     for i in item:
         dataset_name, image_location = i
@@ -147,18 +247,28 @@ def normal_upload(**kwargs):
                 max_retry,
                 retry_interval,
                 timeout,
+                options,
             )
         )
     if complete:
         logger.info("Orthomosaic will be triggered after uploading.")
-    num_threads = len(dataset_details) if len(dataset_details) <= 5 else 5
+    num_threads = min(
+        len(dataset_details),
+        MAX_SCHEDULED_DATASETS if options["scheduler"] else MAX_DATASET_THREADS
+    )
     logger.debug(f"nubmer of threads: {num_threads}")
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
-        futures = [executor.submit(process_thread, *params)
-                   for params in dataset_details]
-        results = [future.result()
-                   for future in concurrent.futures.as_completed(futures)]
-        result_processing(results, output_dir)
+    configure_metrics(metrics_port, metrics_file)
+    start_time = time.monotonic()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+            futures = [executor.submit(queued("datasets_queued", process_thread), *params)
+                       for params in dataset_details]
+            results = [future.result()
+                       for future in concurrent.futures.as_completed(futures)]
+            result_processing(results, output_dir)
+        log_run_summary(results, time.monotonic() - start_time)
+    finally:
+        close_run(options)
 
 
 def upload_from_collection(**kwargs):
@@ -178,6 +288,35 @@ def upload_from_collection(**kwargs):
     retry_interval = kwargs.get("retry_interval")
     timeout = kwargs.get("timeout")
     dataset_id = kwargs.get("dataset_id")
+    workers = kwargs.get("workers", 1)
+    presign_batch_size = kwargs.get("presign_batch_size", 1)
+    verify_timeout = kwargs.get("verify_timeout", VERIFY_TIMEOUT)
+    adaptive = kwargs.get("adaptive", False)
+    max_workers = kwargs.get("max_workers", MAX_ADAPTIVE_WORKERS)
+    bandwidth_limit = kwargs.get("bandwidth_limit")
+    bandwidth_schedule = kwargs.get("bandwidth_schedule", [])
+    engine = kwargs.get("engine", "thread")
+    if engine == "async":
+        check_async_engine()
+    journal_path = kwargs.get("journal")
+    if journal_path == JOURNAL_FILENAME:
+        journal_path = os.path.join(
+            kwargs.get("output_folder") or os.getcwd(), JOURNAL_FILENAME)
+    stream = kwargs.get("stream", False)
+    download_workers = kwargs.get("download_workers", 0)
+    prefetch = kwargs.get("prefetch", 2)
+    metrics_port = kwargs.get("metrics_port")
+    metrics_file = kwargs.get("metrics_file")
+    cache_dir = kwargs.get("cache_dir", DEFAULT_CACHE_DIR)
+    cache_size = kwargs.get("cache_size", DEFAULT_CACHE_SIZE)
+    configure_cache(cache_dir, cache_size)
+    # images of all datasets share one budget, except on the async engine and in pipelines
+    scheduled = engine == "thread" and not (download_workers and not stream)
+    if adaptive and not scheduled:
+        logger.warning("--adaptive only applies to the thread engine without download workers. Ignored.")
+        adaptive = False
+    configure_pool(max_workers if adaptive else MAX_DATASET_THREADS * workers)
+    configure_bandwidth(bandwidth_limit, bandwidth_schedule)
     existing_dataset_name = ""
     if dataset_id:
         logger.debug(f"searching for metadata of dataset {dataset_id}")
@@ -194,7 +333,6 @@ def upload_from_collection(**kwargs):
 
     cb, ca, ub, ua = generate_four_timestamps(**kwargs)
 
-    tmpdirs = []
     uploads = []
 
     if dry_run:
@@ -207,23 +345,39 @@ def upload_from_collection(**kwargs):
         logger.info(f"max_retry: {max_retry} times")
         logger.info(f"retry_interval: {retry_interval} sec")
         logger.info(f"timeout: {timeout} sec")
+        logger.info(f"engine: {engine}")
+        logger.info(f"journal: {journal_path}")
+        if adaptive:
+            logger.info(
+                f"workers: adaptive from {MAX_DATASET_THREADS * workers} up to {max_workers} shared by all datasets")
+        elif scheduled:
+            logger.info(
+                f"workers: {MAX_DATASET_THREADS * workers} shared by all datasets")
+        else:
+            logger.info(f"workers: {workers} per dataset")
+        logger.info(f"presign_batch_size: {presign_batch_size} images")
+        logger.info(f"verify_timeout: {verify_timeout} sec")
+        logger.info(
+            f"bandwidth_limit: {f'{bandwidth_limit} MB/s' if bandwidth_limit else 'unlimited'}")
+        if bandwidth_schedule:
+            logger.info(f"bandwidth_schedule: {', '.join(bandwidth_schedule)}")
+        logger.info(f"stream: {stream}")
+        logger.info(
+            f"cache: {f'{cache_dir}, up to {cache_size} MB' if cache_size else 'disabled'}")
+        if download_workers and not stream:
+            logger.info(
+                f"download_workers: {download_workers} per dataset, prefetching up to {prefetch} assets")
+        logger.info(f"metrics_port: {metrics_port}")
+        logger.info(f"metrics_file: {metrics_file}")
         if exclude:
             logger.info(f"excluding keywords: {str(exclude)}")
         if include:
             logger.info(f"excluding keywords: {str(include)}")
-        for count, i in enumerate(item):
-            dataset_name, image_location = i
-            remote_collection_json = image_location
+        for count, dataset_name, image_location, collection, title in filter_collections(
+                item, exclude, include, cb, ca, ub, ua, ordered=True):
             logger.info("")
             logger.info(f"--item {count + 1}:")
             logger.info(f"collection url: {image_location}")
-            tmpdir = tempfile.TemporaryDirectory()
-            tmpdirs.append(tmpdir)
-            success = download_to_dir(image_location, tmpdir.name)
-            if not success:
-                continue
-            title = deal_with_collection(
-                image_location, exclude, include, cb, ca, ub, ua)
             if not title:
                 continue
             if not dataset_id:
@@ -260,10 +414,6 @@ def upload_from_collection(**kwargs):
             logger.info(dataset)
         logger.info("-----------------------------------------------------")
         logger.info("")
-
-        logger.info(f"cleanup {', '.join([i.name for i in tmpdirs])}")
-        for i in tmpdirs:
-            i.cleanup()
         return
 
     logger.info(base_url)
@@ -273,80 +423,103 @@ def upload_from_collection(**kwargs):
             with open(metadata_json) as f:
                 metadata = json.load(f)
             logger.info(f"metadata: {metadata_json}")
-    dataset_details = []
-    for count, i in enumerate(item):
-        dataset_name, image_location = i
-        meta = None
-        remote_collection_json = image_location
-        logger.info(
-            f"retreiving collection.json from {remote_collection_json}")
-        tmpdir = tempfile.TemporaryDirectory()
-        tmpdirs.append(tmpdir)
-        success = download_to_dir(image_location, tmpdir.name)
-        if not success:
-            continue
-        title = deal_with_collection(
-            image_location, exclude, include, cb, ca, ub, ua)
-        if not title:
-            continue
-        if not dataset_id:
-            logger.debug(f"processing original dataset name: {dataset_name}")
-            dataset_name = re.sub(
-                r"[^a-zA-Z0-9-_]+", "", dataset_name.replace(" ", "_")).strip("_")
-            if not dataset_name:
-                logger.debug(f"No legal character in original dataset name.")
-                logger.debug(f"processing collection title: {title}")
-                dataset_name = re.sub(
-                    r"[^a-zA-Z0-9-_]+", "", title.replace(" ", "_")).strip("_")
-                if not dataset_name:
-                    logger.warning(
-                        f"No legal character. Dataset named 'untitled_{count}'")
-                    dataset_name = f"untitled_{count}"
-            logger.info(f"Dataset name: {dataset_name}")
-            if metadata_json:
-                meta = metadata.get(dataset_name, None)
-                if meta:
-                    logger.info(
-                        f"Metadata specified for dataset {dataset_name} in {metadata_json}")
-        else:
-            logger.info(f"Upload to existing dataset id: {dataset_id}")
-
-        if existing_dataset_name:
-            dataset_name = existing_dataset_name
-            logger.info(f"existing dataset name: {dataset_name}")
-        dataset_details.append(
-            (
-                dataset_id,
-                dataset_name,
-                image_location,
-                base_url,
-                token,
-                private,
-                meta,
-                complete,
-                remote_collection_json,
-                max_retry,
-                retry_interval,
-                timeout,
-            )
-        )
+    options = {
+        "workers": workers,
+        "engine": engine,
+        "journal": UploadJournal(journal_path) if journal_path else None,
+        "presign_batch_size": presign_batch_size,
+        "verify_timeout": verify_timeout,
+        "scheduler": create_scheduler(workers, scheduled, adaptive, max_workers),
+        "stream": stream,
+        "download_workers": download_workers,
+        "prefetch": prefetch,
+    }
     if complete:
         logger.info("Orthomosaic will be triggered after uploading.")
-    num_threads = len(dataset_details) if len(dataset_details) <= 5 else 5
-    if not num_threads:
-        logger.error("No dataset to upload.")
-    else:
-        logger.debug(f"nubmer of threads: {num_threads}")
+    num_threads = MAX_SCHEDULED_DATASETS if options["scheduler"] else MAX_DATASET_THREADS
+    logger.debug(f"nubmer of threads: {num_threads}")
+    futures = []
+    configure_metrics(metrics_port, metrics_file)
+    start_time = time.monotonic()
+    try:
         with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
-            futures = [executor.submit(process_thread, *params)
-                       for params in dataset_details]
+            # each dataset starts uploading as soon as its collection is loaded and passes the filters
+            for count, dataset_name, image_location, collection, title in filter_collections(
+                    item, exclude, include, cb, ca, ub, ua):
+                if not title:
+                    continue
+                meta = None
+                remote_collection_json = image_location
+                if not dataset_id:
+                    logger.debug(f"processing original dataset name: {dataset_name}")
+                    dataset_name = re.sub(
+                        r"[^a-zA-Z0-9-_]+", "", dataset_name.replace(" ", "_")).strip("_")
+                    if not dataset_name:
+                        logger.debug(f"No legal character in original dataset name.")
+                        logger.debug(f"processing collection title: {title}")
+                        dataset_name = re.sub(
+                            r"[^a-zA-Z0-9-_]+", "", title.replace(" ", "_")).strip("_")
+                        if not dataset_name:
+                            logger.warning(
+                                f"No legal character. Dataset named 'untitled_{count}'")
+                            dataset_name = f"untitled_{count}"
+                    logger.info(f"Dataset name: {dataset_name}")
+                    if metadata_json:
+                        meta = metadata.get(dataset_name, None)
+                        if meta:
+                            logger.info(
+                                f"Metadata specified for dataset {dataset_name} in {metadata_json}")
+                else:
+                    logger.info(f"Upload to existing dataset id: {dataset_id}")
+
+                if existing_dataset_name:
+                    dataset_name = existing_dataset_name
+                    logger.info(f"existing dataset name: {dataset_name}")
+                futures.append(executor.submit(
+                    queued("datasets_queued", process_thread),
+                    dataset_id,
+                    dataset_name,
+                    image_location,
+                    base_url,
+                    token,
+                    private,
+                    meta,
+                    complete,
+                    remote_collection_json,
+                    max_retry,
+                    retry_interval,
+                    timeout,
+                    options,
+                    collection,
+                ))
+            # parsed collections are only held by their dataset thread from now on,
+            # and released as soon as the dataset finishes
+            collection = None
             results = [future.result()
                        for future in concurrent.futures.as_completed(futures)]
+        if not futures:
+            logger.error("No dataset to upload.")
+        else:
             result_processing(results, output_dir)
+            log_run_summary(results, time.monotonic() - start_time)
+    finally:
+        close_run(options)
 
-    logger.debug(f"cleanup {', '.join([i.name for i in tmpdirs])}")
-    for i in tmpdirs:
-        i.cleanup()
+
+def close_run(options):
+    """log connection pool stats, stop exporting metrics, and release the global
+    scheduler, hashing processes and upload journal of the run, whether it succeeded or not.
+
+    Args:
+        options (dict): tuning options of the run.
+    """
+    log_pool_stats()
+    stop_metrics()
+    shutdown_hashing()
+    if options["scheduler"]:
+        options["scheduler"].shutdown()
+    if options["journal"]:
+        options["journal"].close()
 
 
 def result_processing(results, output_dir):
@@ -356,13 +529,15 @@ def result_processing(results, output_dir):
         results (list): uploading results
         output_dir (str): directory of output csv files
     """
+    import pandas as pd
+
     for dataset_name, df, error in results:
         if error:
             logger.warning(f"{dataset_name} uploading failed when {error}")
         else:
             logger.info(f"{dataset_name} uploading success")
         if output_dir:
-            if df is not None:
+            if isinstance(df, pd.DataFrame):
                 df.to_csv(
                     f"{os.path.join(output_dir, dataset_name)}.csv", index=False)
                 if error:
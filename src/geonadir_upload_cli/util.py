@@ -1,13 +1,15 @@
 """util functions for STAC objects
 """
+import concurrent.futures
+import itertools
+import json
 import logging
 import os
 import re
 import urllib
 from datetime import datetime
 
-import pystac
-import requests
+from .httpcache import fetch
 
 logger = logging.getLogger(__name__)
 env = os.environ.get("GEONADIR_CLI_ENV", "prod")
@@ -16,19 +18,20 @@ if env != "prod":
     LOG_LEVEL = logging.DEBUG
 logging.basicConfig(level=LOG_LEVEL)
 
+CRAWL_WORKERS = 8
+COLLECTION_WORKERS = 8
 
-def get_filelist_from_collection(collection_path: str, remote_collection_json: str):
-    """get list of all assets from STAC collection file
+
+def get_filelist_from_collection(collection, remote_collection_json: str):
+    """get list of all assets from STAC collection
 
     Args:
-        collection_path (str): local path of downloaded collection.json
+        collection (pystac.Collection): parsed collection
         remote_collection_json (str): original url location of valid collection
 
     Returns:
         dict: asset names and urls
     """
-    logger.debug(f"loading STAC collection from {collection_path}")
-    collection = pystac.Collection.from_file(collection_path)
     file_dict = {}
     for name, asset in collection.assets.items():
         if name.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tif')):
@@ -37,43 +40,90 @@ def get_filelist_from_collection(collection_path: str, remote_collection_json: s
     return file_dict
 
 
-def really_get_all_collections(catalog_url: str, local_folder: str):
-    """recursively get list of all sub-collections
+def scan_images(img_dir: str, recursive: bool = False):
+    """lazily list image files in a directory with os.scandir, yielding each
+    image as soon as it is found, so uploading can start before the listing
+    of a large directory finishes. Sizes come from the directory entries.
 
     Args:
-        catalog_url (str): original url location of valid catalog
-        local_folder (str): local folder of downloaded catalog.json
+        img_dir (str): image directory
+        recursive (bool, optional): whether to descend into subdirectories. Defaults to False.
 
     Yields:
-        str: url of valid collection
+        (str, int): image path relative to img_dir, and size in bytes
+    """
+    pending = [""]
+    while pending:
+        rel_dir = pending.pop()
+        with os.scandir(os.path.join(img_dir, rel_dir)) as entries:
+            for entry in entries:
+                rel_path = os.path.join(rel_dir, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        pending.append(rel_path)
+                elif entry.name.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tif')):
+                    if entry.is_file():
+                        yield rel_path, entry.stat().st_size
+
+
+def get_child_links(catalog_url: str):
+    """fetch a STAC catalog and sort its child links into collections and sub-catalogs.
+    The catalog is parsed in memory without being written to disk.
+
+    Args:
+        catalog_url (str): url of catalog.json
+
+    Returns:
+        (list, list): urls of child collections, urls of child catalogs
     """
-    # catalog_url = "https://data-test.tern.org.au/uas_raw/catalog.json"
     logger.info(f"getting child collection urls from {catalog_url}")
-    r = requests.get(catalog_url, timeout=60)
-    r.raise_for_status()
-    logger.debug(r.text)
-
-    catalog_location = os.path.join(local_folder, "catalog.json")
-    with open(catalog_location, 'wb') as fd:
-        logger.debug(
-            f"writing catalog from {catalog_url} to {catalog_location}")
-        fd.write(r.content)
-
-    logger.debug(f"loading STAC catalog from {catalog_location}")
-    catalog = pystac.Catalog.from_file(catalog_location)
-    for child_link in catalog.get_child_links():
-        href = child_link.href
+    content = fetch(catalog_url, timeout=60)
+    logger.debug(content)
+    collections, catalogs = [], []
+    for link in json.loads(content).get("links", []):
+        if link.get("rel") != "child":
+            continue
+        href = link.get("href", "")
         if href.endswith("collection.json"):
             logger.debug(f"collection found: {href}")
-            yield urllib.parse.urljoin(catalog_url, href)
+            collections.append(urllib.parse.urljoin(catalog_url, href))
         if href.endswith("catalog.json"):
             logger.debug(f"sub-catalog found: {href}")
-            subcat_href = urllib.parse.urljoin(catalog_url, href)
-            local_subfolder = urllib.parse.urljoin(
-                catalog_location, href).removesuffix("/catalog.json")
-            logger.debug(f"creating local directory: {local_subfolder}")
-            os.makedirs(local_subfolder, exist_ok=True)
-            yield from really_get_all_collections(subcat_href, local_subfolder)
+            catalogs.append(urllib.parse.urljoin(catalog_url, href))
+    return collections, catalogs
+
+
+def crawl_catalog(catalog_url: str, workers: int = CRAWL_WORKERS):
+    """get all sub-collections of a catalog, breadth-first with sub-catalogs fetched
+    in parallel. Collections are yielded as soon as their parent catalog is fetched.
+
+    Args:
+        catalog_url (str): original url location of valid catalog
+        workers (int, optional): max number of catalogs fetched at the same time. Defaults to CRAWL_WORKERS.
+
+    Raises:
+        Exception: Failed to fetch a catalog.
+
+    Yields:
+        str: url of valid collection
+    """
+    seen = {catalog_url}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(get_child_links, catalog_url)}
+        try:
+            while pending:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    collections, catalogs = future.result()
+                    for sub_catalog in catalogs:
+                        if sub_catalog not in seen:
+                            seen.add(sub_catalog)
+                            pending.add(executor.submit(get_child_links, sub_catalog))
+                    yield from collections
+        finally:
+            for future in pending:
+                future.cancel()
 
 
 def generate_four_timestamps(**kwargs):
@@ -114,39 +164,44 @@ def generate_four_timestamps(**kwargs):
     return cb, ca, ub, ua
 
 
-def download_to_dir(url, directory):
-    """download collection.json
+def load_collection(url):
+    """download and parse collection.json. The parsed collection is meant to be
+    passed along to filtering, dataset creation and asset listing, so that each
+    collection is parsed only once per run.
 
     Args:
         url (str): url of collection
-        directory (str): dest folder of downloaded collection.json
 
     Returns:
-        bool: whether successfully downloaded
+        pystac.Collection | None: parsed collection, or None if undownloadable or illegal
     """
-    image_location = os.path.join(directory, "collection.json")
     try:
-        logger.debug(f"downloading {url} to {image_location}")
-        r = requests.get(url, timeout=60)
-        r.raise_for_status()
-        with open(image_location, 'wb') as fd:
-            fd.write(r.content)
+        logger.debug(f"loading STAC collection from {url}")
+        content = fetch(url, timeout=60)
     except Exception as exc:
-        if r.status_code == 401:
+        response = getattr(exc, "response", None)
+        if response is not None and response.status_code == 401:
             logger.error(
-                f"Authentication failed for downloading {image_location}. See readme for instruction.")
+                f"Authentication failed for downloading {url}. See readme for instruction.")
         else:
             logger.error(
-                f"{image_location} doesn't exist or is undownloadable: {str(exc)}")
-        return False
-    return True
+                f"{url} doesn't exist or is undownloadable: {str(exc)}")
+        return None
+    import pystac
+
+    try:
+        return pystac.Collection.from_dict(
+            json.loads(content), href=url, migrate=True, preserve_dict=False)
+    except Exception as exc:
+        logger.error(f"{url} illegal: {str(exc)}")
+        return None
 
 
-def deal_with_collection(collection_location, exclude, include, cb, ca, ub, ua):
+def deal_with_collection(collection, exclude, include, cb, ca, ub, ua):
     """filter collections based on name and datetime
 
     Args:
-        collection_location (str): local collection.json file
+        collection (pystac.Collection): parsed collection
         exclude (str): exclude collection with name containing certain string
         include (str): include collection with name containing certain string
         cb (datetime): exclude collection not created before given datetime
@@ -158,8 +213,6 @@ def deal_with_collection(collection_location, exclude, include, cb, ca, ub, ua):
         str | bool: dataset name retrieved from collection.json. return False if collection is filtered out.
     """
     try:
-        logger.debug(f"loading STAC collection from {collection_location}")
-        collection = pystac.Collection.from_file(collection_location)
         logger.debug(f"processing original title: {collection.title}")
         dataset_name = re.sub(r"[^a-zA-Z0-9-_]+", "",
                               collection.title.replace(" ", "_")).strip("_")
@@ -206,11 +259,67 @@ def deal_with_collection(collection_location, exclude, include, cb, ca, ub, ua):
                 f"Can't find legal created/updated timestamp for {dataset_name}:")
             logger.warning(f"\t{str(exc)}")
     except Exception as exc:
-        logger.error(f"{collection_location} illegal: {str(exc)}")
+        logger.error(f"{collection.get_self_href()} illegal: {str(exc)}")
         return False
     return dataset_name
 
 
+def filter_collections(items, exclude, include, cb, ca, ub, ua,
+                       workers: int = COLLECTION_WORKERS, ordered: bool = False):
+    """load and filter collections concurrently, with at most workers collections
+    in flight, so the first collections can be uploaded while the rest are fetched.
+
+    Args:
+        items (iterable): (dataset name, collection url)
+        exclude (str): exclude collection with name containing certain string
+        include (str): include collection with name containing certain string
+        cb (datetime): exclude collection not created before given datetime
+        ca (datetime): exclude collection not created after given datetime
+        ub (datetime): exclude collection not updated before given datetime
+        ua (datetime): exclude collection not updated after given datetime
+        workers (int, optional): max number of collections loaded at the same time. Defaults to COLLECTION_WORKERS.
+        ordered (bool, optional): yield in order of items instead of as soon as loaded. Defaults to False.
+
+    Yields:
+        (int, str, str, pystac.Collection, str): index in items, dataset name, collection url,
+            parsed collection and dataset name retrieved from it. Collection and name are
+            None for collections undownloadable, illegal or filtered out.
+    """
+    def load(count, dataset_name, url):
+        collection = load_collection(url)
+        if collection is None:
+            return count, dataset_name, url, None, None
+        title = deal_with_collection(collection, exclude, include, cb, ca, ub, ua)
+        if not title:
+            return count, dataset_name, url, None, None
+        return count, dataset_name, url, collection, title
+
+    items = enumerate(items)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        # start with a single collection and grow the window by one per loaded collection,
+        # so the first one is handed over without waiting for more items, e.g. from a catalog crawl
+        pending = [executor.submit(load, count, dataset_name, url)
+                   for count, (dataset_name, url) in itertools.islice(items, 1)]
+        try:
+            while pending:
+                if ordered:
+                    done = [pending.pop(0)]
+                else:
+                    done, rest = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    pending = list(rest)
+                for future in done:
+                    # hand over the loaded collection before pulling the next items,
+                    # which may wait for a catalog crawl
+                    yield future.result()
+                    refill = min(2, workers - len(pending))
+                    for count, (dataset_name, url) in itertools.islice(items, refill):
+                        pending.append(executor.submit(load, count, dataset_name, url))
+        finally:
+            for future in pending:
+                future.cancel()
+
+
 def original_filename(url: str):
     """
     Extract the original file name from Geonadir image url.
@@ -253,6 +362,22 @@ def geonadir_filename_trans(filename: str):
     return trans_name + ext
 
 
+def image_url_index(image_urls):
+    """Index Geonadir image urls by original file name, so that each local image
+    can be looked up in constant time instead of scanning all urls.
+
+    Args:
+        image_urls (iterable): Geonadir image urls
+
+    Returns:
+        dict: original file name -> first image url with that name
+    """
+    index = {}
+    for url in image_urls:
+        index.setdefault(original_filename(url), url)
+    return index
+
+
 def first_value(iterable):
     """Extract the first non-None value
 
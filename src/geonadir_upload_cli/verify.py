@@ -0,0 +1,105 @@
+"""verification of uploaded images in Geonadir
+"""
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+env = os.environ.get("GEONADIR_CLI_ENV", "prod")
+LOG_LEVEL = logging.INFO
+if env != "prod":
+    LOG_LEVEL = logging.DEBUG
+logging.basicConfig(level=LOG_LEVEL)
+
+VERIFY_TIMEOUT = 120
+VERIFY_INTERVAL = 1
+VERIFY_MAX_INTERVAL = 15
+
+
+def dataset_image_count(dataset_id, base_url):
+    """get number of images Geonadir reports for a dataset.
+
+    Args:
+        dataset_id (str): GN dataset id.
+        base_url (str): Base url of Geonadir api.
+
+    Returns:
+        int | None: image count, or None if not available.
+    """
+    from .dataset import dataset_info
+
+    try:
+        info = dataset_info(dataset_id, base_url)
+    except Exception as exc:
+        logger.debug(f"getting image count of dataset {dataset_id} failed: {str(exc)}")
+        return None
+    if not isinstance(info, dict):
+        return None
+    count = info.get("project_id", {}).get("image_count", info.get("image_count"))
+    return count if isinstance(count, int) else None
+
+
+def wait_for_images(
+    dataset_id,
+    base_url,
+    image_names,
+    initial_count=0,
+    verify_timeout=VERIFY_TIMEOUT,
+    interval=VERIFY_INTERVAL,
+    max_interval=VERIFY_MAX_INTERVAL
+):
+    """poll Geonadir until all given images are listed in the dataset or the deadline passes.
+    The cheap image count of the dataset is checked first and the image listing is only
+    fetched once the count has grown by the number of given images. Interval between
+    polls doubles up to max_interval.
+
+    Args:
+        dataset_id (str): GN dataset id.
+        base_url (str): Base url of Geonadir api.
+        image_names (iterable): file names of images as stored in Geonadir.
+        initial_count (int, optional): image count of the dataset before the images were uploaded,
+            None if unknown, in which case the listing is fetched at every poll. Defaults to 0.
+        verify_timeout (float, optional): seconds to wait before giving up. Defaults to VERIFY_TIMEOUT.
+        interval (float, optional): seconds before the first re-check. Defaults to VERIFY_INTERVAL.
+        max_interval (float, optional): max seconds between checks. Defaults to VERIFY_MAX_INTERVAL.
+
+    Raises:
+        Exception: Failed to get image listing.
+
+    Returns:
+        dict: original file name -> image url, for every listed image of the dataset.
+    """
+    from .dataset import paginate_dataset_images
+    from .util import image_url_index
+
+    wanted = set(image_names)
+    if not wanted:
+        return {}
+    target = None if initial_count is None else initial_count + len(wanted)
+    deadline = time.monotonic() + verify_timeout
+    index = {}
+    checks = 0
+    while True:
+        checks += 1
+        count = dataset_image_count(dataset_id, base_url)
+        if count is None or target is None or count >= target:
+            index = image_url_index(paginate_dataset_images(base_url, dataset_id))
+            missing = len(wanted - index.keys())
+            if not missing:
+                logger.info(
+                    f"All {len(wanted)} images confirmed in dataset {dataset_id} after {checks} checks")
+                return index
+            logger.debug(f"{missing} images not yet listed in dataset {dataset_id}")
+        else:
+            logger.debug(
+                f"dataset {dataset_id} has {count} of at least {target} images")
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.warning(
+                f"Not all images confirmed in dataset {dataset_id} within {verify_timeout} sec")
+            if count is not None and target is not None and count < target:
+                index = image_url_index(paginate_dataset_images(base_url, dataset_id))
+            return index
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, max_interval)
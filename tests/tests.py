@@ -1,7 +1,526 @@
+import asyncio
+import datetime
+import importlib.util
+import io
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.insert(0, SRC_DIR)
+
+from geonadir_upload_cli import adaptive, journal  # noqa: E402
+from geonadir_upload_cli.adaptive import MIN_WINDOW, AdaptiveConcurrency  # noqa: E402
+from geonadir_upload_cli.journal import (PRESIGNED, REGISTERED, STORED,  # noqa: E402
+                                         UploadJournal, reusable_presigned_info)
+from geonadir_upload_cli.multipart import MultipartStream  # noqa: E402
+from geonadir_upload_cli.pipeline import run_pipeline  # noqa: E402
+from geonadir_upload_cli.throttle import MB, BandwidthLimiter, parse_schedule  # noqa: E402
+from geonadir_upload_cli.util import scan_images  # noqa: E402
+
+# dependencies only the commands needing them may import
+HEAVY_MODULES = ("pandas", "pystac", "tqdm", "aiohttp")
+# cumulative import time of the cli module, well above a warm start on a laptop
+STARTUP_BUDGET = 0.3  # sec
+
+
+def import_times(module):
+    """import module in a fresh interpreter with -X importtime.
+
+    Returns:
+        dict: imported module name -> cumulative import time in seconds.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [SRC_DIR] + [p for p in [os.environ.get("PYTHONPATH")] if p]))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env, capture_output=True, text=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
 
 
 class ApplicationTests(unittest.TestCase):
 
     def test_hello(self):
         self.assertTrue(True)
+
+
+@unittest.skipUnless(importlib.util.find_spec("click"), "click not installed")
+class StartupTests(unittest.TestCase):
+
+    def test_cli_startup(self):
+        times = import_times("geonadir_upload_cli.cli")
+        for name in HEAVY_MODULES + ("requests",):
+            self.assertNotIn(name, times, f"{name} imported at cli startup")
+        self.assertLess(times["geonadir_upload_cli.cli"], STARTUP_BUDGET)
+
+    @unittest.skipUnless(importlib.util.find_spec("requests"), "requests not installed")
+    def test_dataset_search_imports(self):
+        times = import_times("geonadir_upload_cli.dataset")
+        for name in HEAVY_MODULES:
+            self.assertNotIn(name, times, f"{name} imported by dataset search")
+
+
+@unittest.skipUnless(importlib.util.find_spec("requests"), "requests not installed")
+class AsyncUploadTests(unittest.TestCase):
+
+    def test_collection_assets_use_batched_presigned_info(self):
+        from geonadir_upload_cli import async_upload
+        from geonadir_upload_cli.presign import PresignedUrlBatcher
+
+        asset_names = ["site_1/a.jpg", "site_1/b.jpg"]
+        batch = [{"fields": [{"key": f"privateuploads/{name}"}]} for name in asset_names]
+
+        async def download(session, url, file_path, *args):
+            with open(file_path, "wb") as f:
+                f.write(b"image")
+
+        with tempfile.TemporaryDirectory() as download_dir, \
+                mock.patch("geonadir_upload_cli.presign.generate_presigned_url_batch",
+                           return_value=batch) as generate_batch, \
+                mock.patch.object(async_upload, "_download", download), \
+                mock.patch.object(async_upload, "_generate_presigned_url") as generate_single, \
+                mock.patch.object(async_upload, "_upload_to_amazon") as upload_to_amazon, \
+                mock.patch.object(async_upload, "_create_post_image", return_value=201):
+            # built like the collection upload does: batcher keyed by asset name,
+            # assets downloaded into the dataset temp directory
+            batcher = PresignedUrlBatcher("1", "https://geonadir.test", "token", asset_names, 2)
+            for name, presigned_info in zip(asset_names, batch):
+                item = (name, os.path.join(download_dir, os.path.basename(name)),
+                        f"https://example.test/{name}")
+                result = asyncio.run(async_upload._upload_timed(
+                    None, item, {"dataset_id": "1"}, 0, 0, 1, batcher))
+                self.assertEqual(result[:2], (name, 201))
+                self.assertIs(upload_to_amazon.call_args.args[1], presigned_info)
+
+        generate_batch.assert_called_once()
+        generate_single.assert_not_called()
+
+
+@unittest.skipUnless(importlib.util.find_spec("requests"), "requests not installed")
+class VerifyTests(unittest.TestCase):
+
+    def test_listing_waits_for_count_past_existing_images(self):
+        from geonadir_upload_cli import verify
+
+        counts = iter([100, 101, 102])
+        with mock.patch.object(verify, "dataset_image_count", lambda *args: next(counts)), \
+                mock.patch("geonadir_upload_cli.dataset.paginate_dataset_images",
+                           return_value=[]) as paginate, \
+                mock.patch("geonadir_upload_cli.util.image_url_index",
+                           return_value={"a.jpg": "url_a", "b.jpg": "url_b"}), \
+                mock.patch.object(verify.time, "sleep"):
+            index = verify.wait_for_images("1", "https://geonadir.test", ["a.jpg", "b.jpg"], 100)
+
+        self.assertEqual(index, {"a.jpg": "url_a", "b.jpg": "url_b"})
+        paginate.assert_called_once()
+
+
+class MultipartStreamTests(unittest.TestCase):
+
+    fields = [("key", "privateuploads/a.jpg"), ("policy", "p0l1cy")]
+    content = bytes(range(256)) * 40
+
+    def expected(self, boundary):
+        return (
+            f"--{boundary}\r\n"
+            'Content-Disposition: form-data; name="key"\r\n\r\n'
+            "privateuploads/a.jpg\r\n"
+            f"--{boundary}\r\n"
+            'Content-Disposition: form-data; name="policy"\r\n\r\n'
+            "p0l1cy\r\n"
+            f"--{boundary}\r\n"
+            'Content-Disposition: form-data; name="file"; filename="a.jpg"\r\n\r\n'
+        ).encode("utf-8") + self.content + f"\r\n--{boundary}--\r\n".encode("utf-8")
+
+    def read_all(self, body, size):
+        parts = []
+        while True:
+            part = body.read(size)
+            if not part:
+                return b"".join(parts)
+            self.assertLessEqual(len(part), size)
+            parts.append(part)
+
+    def test_body_from_file(self):
+        body = MultipartStream(
+            self.fields, "site_1/a.jpg", io.BytesIO(self.content), len(self.content), chunk_size=1000)
+        expected = self.expected(body.boundary)
+        self.assertEqual(len(body), len(expected))
+        # read sizes not lining up with chunks, like requests reading the body
+        self.assertEqual(self.read_all(body, 777), expected)
+        self.assertEqual(body.content_type, f"multipart/form-data; boundary={body.boundary}")
+
+    def test_body_from_chunks(self):
+        chunks = [self.content[i:i + 999] for i in range(0, len(self.content), 999)]
+        body = MultipartStream(self.fields, "a.jpg", iter(chunks), len(self.content))
+        expected = self.expected(body.boundary)
+        self.assertEqual(b"".join(body), expected)
+        self.assertEqual(len(body), len(expected))
+
+    def test_short_content_raises(self):
+        body = MultipartStream(
+            self.fields, "a.jpg", io.BytesIO(self.content), len(self.content) + 1)
+        with self.assertRaisesRegex(Exception, "content ended after"):
+            body.read()
+
+    def test_long_content_raises(self):
+        body = MultipartStream(
+            self.fields, "a.jpg", io.BytesIO(self.content), len(self.content) - 1)
+        with self.assertRaisesRegex(Exception, "content longer than declared length"):
+            body.read()
+
+
+class BandwidthLimiterTests(unittest.TestCase):
+
+    def test_parse_schedule(self):
+        self.assertEqual(
+            parse_schedule(["19:00-07:00=unlimited", " 09:00 - 17:30 = 2.5 "]),
+            [
+                (datetime.time(19), datetime.time(7), None),
+                (datetime.time(9), datetime.time(17, 30), 2.5 * MB),
+            ])
+
+    def test_parse_schedule_rejects_malformed_entries(self):
+        for entry in ("19:00=5", "19:00-07:00", "7pm-7am=5", "19:00-07:00=fast", "19:00-07:00=0"):
+            with self.assertRaises(Exception, msg=entry):
+                parse_schedule([entry])
+
+    def test_window_wrapping_past_midnight(self):
+        limiter = BandwidthLimiter(20 * MB, parse_schedule(["19:00-07:00=unlimited", "12:00-13:00=5"]))
+        for moment, rate in (
+            (datetime.time(19), None),
+            (datetime.time(23, 59), None),
+            (datetime.time(0), None),
+            (datetime.time(6, 59), None),
+            (datetime.time(7), 20 * MB),
+            (datetime.time(12, 30), 5 * MB),
+            (datetime.time(18, 59), 20 * MB),
+        ):
+            self.assertEqual(limiter.rate_at(moment), rate, moment)
+
+    def test_reserve_paces_to_rate(self):
+        limiter = BandwidthLimiter(1000)
+        with mock.patch("geonadir_upload_cli.throttle.time.monotonic", return_value=100.0):
+            # the bucket starts empty, so the first bytes run it into debt
+            self.assertAlmostEqual(limiter.reserve(1000), 1.0)
+            self.assertAlmostEqual(limiter.reserve(500), 1.5)
+        with mock.patch("geonadir_upload_cli.throttle.time.monotonic", return_value=110.0):
+            # refilled while idle, but only up to a short burst
+            self.assertEqual(limiter.reserve(250), 0)
+            self.assertAlmostEqual(limiter.reserve(100), 0.1)
+
+    def test_unlimited_never_waits(self):
+        limiter = BandwidthLimiter()
+        self.assertEqual(limiter.reserve(10 * MB), 0)
+        self.assertEqual(limiter.reserve(10 * MB), 0)
+
+
+class UploadJournalTests(unittest.TestCase):
+
+    presigned_info = {"AWSAccessKeyId": "id", "fields": [{"key": "privateuploads/a.jpg"}]}
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "journal.sqlite")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def open_journal(self):
+        upload_journal = UploadJournal(self.path)
+        self.addCleanup(upload_journal.close)
+        return upload_journal
+
+    def test_phase_transitions(self):
+        upload_journal = self.open_journal()
+        self.assertIsNone(upload_journal.get("1", "site_1/a.jpg"))
+
+        upload_journal.record("1", "site_1/a.jpg", PRESIGNED, self.presigned_info)
+        entry = upload_journal.get("1", "site_1/a.jpg")
+        self.assertEqual(entry["phase"], PRESIGNED)
+        self.assertEqual(entry["presigned_info"], self.presigned_info)
+        self.assertIsNotNone(entry["presigned_at"])
+
+        upload_journal.record("1", "site_1/a.jpg", STORED, size=123)
+        upload_journal.record("1", "site_1/a.jpg", REGISTERED)
+        registered = upload_journal.get("1", "site_1/a.jpg")
+        # presigned info, its age and size are kept from earlier phases
+        self.assertEqual(registered["phase"], REGISTERED)
+        self.assertEqual(registered["presigned_info"], self.presigned_info)
+        self.assertEqual(registered["presigned_at"], entry["presigned_at"])
+        self.assertEqual(registered["size"], 123)
+
+        # images are keyed by relative path per dataset
+        self.assertIsNone(upload_journal.get("1", "site_2/a.jpg"))
+        self.assertIsNone(upload_journal.get("2", "site_1/a.jpg"))
+        self.assertEqual(list(upload_journal.entries("1")), ["site_1/a.jpg"])
+
+        upload_journal.forget("1", "site_1/a.jpg")
+        self.assertIsNone(upload_journal.get("1", "site_1/a.jpg"))
+
+    def test_presigned_info_expires(self):
+        upload_journal = self.open_journal()
+        with mock.patch.object(journal.time, "time", return_value=1000.0):
+            upload_journal.record("1", "a.jpg", PRESIGNED, self.presigned_info)
+        # storing the image later doesn't make its presigned info any younger
+        with mock.patch.object(journal.time, "time", return_value=1000.0 + journal.PRESIGNED_TTL):
+            upload_journal.record("1", "a.jpg", STORED, size=123)
+            self.assertEqual(
+                reusable_presigned_info(upload_journal.get("1", "a.jpg")), self.presigned_info)
+        with mock.patch.object(journal.time, "time", return_value=1001.0 + journal.PRESIGNED_TTL):
+            self.assertIsNone(reusable_presigned_info(upload_journal.get("1", "a.jpg")))
+        self.assertIsNone(reusable_presigned_info(None))
+
+    def test_migrates_journal_without_presigned_at(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute(
+            """CREATE TABLE images (
+                dataset_id TEXT NOT NULL,
+                image_name TEXT NOT NULL,
+                phase TEXT NOT NULL,
+                presigned_info TEXT,
+                size INTEGER,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (dataset_id, image_name)
+            )""")
+        conn.execute(
+            "INSERT INTO images VALUES (?, ?, ?, ?, ?, ?)",
+            ("1", "a.jpg", PRESIGNED, json.dumps(self.presigned_info), None, 1000.0))
+        conn.commit()
+        conn.close()
+
+        upload_journal = self.open_journal()
+        entry = upload_journal.get("1", "a.jpg")
+        self.assertEqual(entry["phase"], PRESIGNED)
+        self.assertIsNone(entry["presigned_at"])
+        # age unknown, so it is treated as expired
+        self.assertIsNone(reusable_presigned_info(entry))
+
+        upload_journal.record("1", "a.jpg", PRESIGNED, self.presigned_info)
+        self.assertEqual(
+            reusable_presigned_info(upload_journal.get("1", "a.jpg")), self.presigned_info)
+
+
+class ProgressBar:
+    """stand-in for tqdm.tqdm counting updates
+    """
+
+    def __init__(self):
+        self.n = 0
+
+    def update(self, n):
+        self.n += n
+
+
+class PipelineTests(unittest.TestCase):
+
+    def test_results_in_item_order(self):
+        def upload(item):
+            # later items finish first
+            time.sleep(0.001 * (20 - item))
+            return item * 10
+
+        pbar = ProgressBar()
+        results = run_pipeline(
+            list(range(20)), lambda item: None if item % 5 == 0 else item, upload, 3, 4, 2, pbar)
+        self.assertEqual(results, [item * 10 for item in range(20) if item % 5])
+        self.assertEqual(pbar.n, 20)
+
+    def test_first_error_stops_both_stages_and_discards_prefetched(self):
+        lock = threading.Lock()
+        downloaded, uploaded, discarded = [], [], []
+
+        def download(item):
+            with lock:
+                downloaded.append(item)
+            return item
+
+        def upload(item):
+            with lock:
+                uploaded.append(item)
+            if item == 3:
+                raise Exception("upload failed")
+            return item
+
+        def discard(item):
+            with lock:
+                discarded.append(item)
+
+        with self.assertRaisesRegex(Exception, "upload failed"):
+            run_pipeline(list(range(1000)), download, upload, 2, 1, 4, ProgressBar(), discard)
+        # downloads stop at the first error instead of running through all items
+        self.assertLess(len(downloaded), 100)
+        # everything downloaded is either uploaded or cleaned up, never both
+        self.assertEqual(sorted(uploaded + discarded), sorted(downloaded))
+
+    def test_download_error_is_raised(self):
+        def download(item):
+            if item == 5:
+                raise Exception("download failed")
+            return item
+
+        with self.assertRaisesRegex(Exception, "download failed"):
+            run_pipeline(list(range(10)), download, lambda item: item, 1, 1, 2, ProgressBar(), lambda item: None)
+
+
+class ScanImagesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        files = {
+            "a.jpg": 1,
+            "notes.txt": 2,
+            os.path.join("site_1", "b.JPG"): 3,
+            os.path.join("site_1", "deeper", "c.tif"): 4,
+            os.path.join("site_2", "a.jpg"): 5,
+        }
+        for name, size in files.items():
+            path = os.path.join(self.tmp.name, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(b"x" * size)
+        # a directory named like an image is not an image
+        os.makedirs(os.path.join(self.tmp.name, "folder.jpg"))
+
+    def test_top_level_only(self):
+        self.assertEqual(dict(scan_images(self.tmp.name)), {"a.jpg": 1})
+
+    def test_recursive(self):
+        self.assertEqual(dict(scan_images(self.tmp.name, recursive=True)), {
+            "a.jpg": 1,
+            os.path.join("site_1", "b.JPG"): 3,
+            os.path.join("site_1", "deeper", "c.tif"): 4,
+            os.path.join("site_2", "a.jpg"): 5,
+        })
+
+
+@unittest.skipUnless(importlib.util.find_spec("requests"), "requests not installed")
+class PresignedUrlBatcherTests(unittest.TestCase):
+
+    names = ["a.jpg", "b.jpg", "c.jpg", "d.jpg", "e.jpg"]
+
+    def batcher(self):
+        from geonadir_upload_cli.presign import PresignedUrlBatcher
+
+        return PresignedUrlBatcher("1", "https://geonadir.test", "token", self.names, 2)
+
+    def respond(self, fields):
+        session = mock.Mock()
+        session.post.return_value.json.return_value = {"AWSAccessKeyId": "id", "fields": fields}
+        return mock.patch("geonadir_upload_cli.presign.get_session", return_value=session)
+
+    def test_batches_split_per_image(self):
+        fields = [{"key": "privateuploads/a.jpg"}, {"key": "privateuploads/b.jpg"}]
+        with self.respond(fields) as get_session:
+            batcher = self.batcher()
+            self.assertEqual(batcher.get("b.jpg"), {"AWSAccessKeyId": "id", "fields": [fields[1]]})
+            self.assertEqual(batcher.get("a.jpg"), {"AWSAccessKeyId": "id", "fields": [fields[0]]})
+            # one request for the whole batch
+            self.assertEqual(get_session.return_value.post.call_count, 1)
+            self.assertEqual(
+                get_session.return_value.post.call_args.kwargs["json"]["images"], ["a.jpg", "b.jpg"])
+        self.assertIsNone(batcher.get("unknown.jpg"))
+
+    def test_mismatched_batch_falls_back_to_single_requests(self):
+        with self.respond([{"key": "privateuploads/a.jpg"}]) as get_session:
+            batcher = self.batcher()
+            self.assertIsNone(batcher.get("a.jpg"))
+            self.assertIsNone(batcher.get("b.jpg"))
+            self.assertIsNone(batcher.get("c.jpg"))
+            self.assertTrue(batcher.rejected)
+            # no further batches requested once rejected
+            self.assertEqual(get_session.return_value.post.call_count, 1)
+
+    def test_rejected_batch_falls_back_to_single_requests(self):
+        with mock.patch("geonadir_upload_cli.presign.generate_presigned_url_batch",
+                        side_effect=Exception("400 Bad Request")) as generate_batch:
+            batcher = self.batcher()
+            for name in self.names:
+                self.assertIsNone(batcher.get(name))
+        self.assertTrue(batcher.rejected)
+        generate_batch.assert_called_once()
+
+
+class AdaptiveConcurrencyTests(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        patcher = mock.patch.object(adaptive.time, "monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def window(self, controller, latency, duration=1.0):
+        """finish one window of images of given latency within duration seconds
+        """
+        count = max(MIN_WINDOW, controller.limit)
+        for _ in range(count):
+            controller.acquire()
+            self.now += duration / count
+            controller.release(latency)
+
+    def test_grows_by_one_while_throughput_holds(self):
+        controller = AdaptiveConcurrency(4, 6)
+        self.window(controller, 0.1)
+        self.assertEqual(controller.limit, 5)
+        self.window(controller, 0.1)
+        self.assertEqual(controller.limit, 6)
+        # capped at maximum
+        self.window(controller, 0.1)
+        self.assertEqual(controller.limit, 6)
+        self.assertEqual([limit for _, limit in controller.history], [4, 5, 6])
+
+    def test_kept_when_throughput_drops(self):
+        controller = AdaptiveConcurrency(4, 64)
+        self.window(controller, 0.1, duration=1.0)
+        self.window(controller, 0.1, duration=2.0)
+        self.assertEqual(controller.limit, 5)
+
+    def test_halved_when_p95_rises(self):
+        controller = AdaptiveConcurrency(9, 64)
+        self.window(controller, 0.1)
+        self.assertEqual(controller.limit, 10)
+        self.window(controller, 1.0)
+        self.assertEqual(controller.limit, 5)
+
+    def test_limit_bounds_images_in_flight(self):
+        controller = AdaptiveConcurrency(2, 64)
+        controller.acquire()
+        controller.acquire()
+        blocked = threading.Thread(target=controller.acquire, daemon=True)
+        blocked.start()
+        blocked.join(0.05)
+        self.assertTrue(blocked.is_alive())
+        controller.release(0.1)
+        blocked.join(1)
+        self.assertFalse(blocked.is_alive())
+
+    @unittest.skipUnless(importlib.util.find_spec("requests"), "requests not installed")
+    def test_halved_once_per_window_on_throttling(self):
+        controller = AdaptiveConcurrency(16, 64)
+        for _ in range(3):
+            controller.acquire()
+        controller.on_retry(429, None)
+        controller.on_retry(503, None)
+        controller.on_retry(500, None)
+        self.assertEqual(controller.limit, 8)
+        # images started under the old limit are left out of the next window
+        for _ in range(3):
+            controller.release(5.0)
+        self.window(controller, 0.1)
+        self.assertEqual(controller.limit, 8)
+        controller.on_retry(429, None)
+        self.assertEqual(controller.limit, 4)